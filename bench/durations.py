@@ -0,0 +1,82 @@
+"""
+Recording duration check: the duration PyAV reads back from each recorded
+file must match the durationSec the recorder puts in the metadata.
+
+Frames are fed through a real Recorder with capture times that include a
+long gap (a camera that went still, then sent two late frames), for every
+encoder profile in both timing modes, plus an MJPEG recording transcoded
+to H.264. Exits 1 if any file is off by more than one frame interval:
+
+    python bench/durations.py
+"""
+import argparse
+import contextlib
+import json
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from loadgen import make_fixtures  # noqa: E402
+from server import recording  # noqa: E402
+
+# 0-3.9 s at 10 fps, then frames at 5.0 s and 7.1 s
+CAPTURE_TIMES = [i * 0.1 for i in range(40)] + [5.0, 7.1]
+
+
+def file_duration(path: str) -> dict:
+    import av
+
+    with av.open(path) as container:
+        stream = container.streams.video[0]
+        return {
+            "container": round(container.duration / 1e6, 3),
+            "stream": round(float(stream.duration * stream.time_base), 3),
+        }
+
+
+def run(fmt: str, timing: str, profile: str, fixtures: list, fps: int) -> dict:
+    rec = recording.Recorder(client_id=f"durations-{fmt}-{timing}-{profile}", fps=fps, format=fmt,
+                             timing=timing, profile=profile)
+    for i, ts in enumerate(CAPTURE_TIMES):
+        rec._encode((fixtures[i % len(fixtures)], ts))
+    rec._close_container()
+    expected = round(rec._last_pts / 1000 + 1 / fps, 2)  # Recorder.stop's durationSec
+    path = rec._path_local
+    if fmt == "mjpeg":
+        path = rec._path_local[:-4] + "_h264.mp4"
+        recording.transcode_to_h264(rec._path_local, path, recording.ENCODER_PROFILES[profile])
+    measured = file_duration(path)
+    ok = all(abs(d - expected) <= 1 / fps for d in measured.values())
+    return {"format": fmt if fmt == "h264" else "mjpeg->h264", "timing": timing, "profile": profile,
+            "durationSec": expected, "file": measured, "ok": ok}
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    p.add_argument("--fps", type=int, default=10)
+    p.add_argument("--output", help="write the JSON result here (default: stdout)")
+    args = p.parse_args(argv)
+
+    fixtures = make_fixtures(10, 320, 240, 80, False)
+    cases = [("h264", timing, profile) for timing in recording.TIMING_MODES for profile in recording.ENCODER_PROFILES]
+    cases += [("mjpeg", "vfr", profile) for profile in recording.ENCODER_PROFILES]
+    # The Recorder's own log lines go to stderr, keeping stdout for the JSON
+    with tempfile.TemporaryDirectory(prefix="durations_") as workdir, contextlib.redirect_stdout(sys.stderr):
+        recording.RECORDINGS_DIR = workdir
+        results = [run(fmt, timing, profile, fixtures, args.fps) for fmt, timing, profile in cases]
+    for r in results:
+        print(f"[durations] {r['format']:>11} {r['timing']} {r['profile']:>12}: metadata {r['durationSec']} s  "
+              f"file {r['file']['container']} s  {'ok' if r['ok'] else 'MISMATCH'}", file=sys.stderr)
+
+    text = json.dumps({"config": vars(args), "runs": results}, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0 if all(r["ok"] for r in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,122 @@
+"""
+Microbenchmark for the recorder's H.264 frame path: JPEG in, encoded
+frame out, per frame.
+
+"legacy" is the previous path (decode, BGR -> RGB copy, a new rgb24
+VideoFrame that PyAV converts to yuv420p for the encoder); "pooled" is
+Recorder._prepare_bgr, which converts into buffers and frames reused for the
+whole recording. Both feed the same Recorder and encoder, so the difference
+is the preparation alone:
+
+    python bench/encode.py --frames 300 --width 1280 --height 720
+
+Allocation figures come from tracemalloc and cover what numpy / OpenCV /
+Python allocate (the JPEG decode included); FFmpeg's own buffers are not
+visible to it.
+"""
+import argparse
+import contextlib
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from server import recording  # noqa: E402
+
+
+def legacy_prepare(rec, data):
+    """The pre-pool Recorder._prepare_bgr, kept here for comparison."""
+    import av
+
+    frame_bgr = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if frame_bgr is None:
+        return None
+    h, w = frame_bgr.shape[:2]
+    if rec._container is None:
+        rec._open_container(w, h)
+    if (h, w) != (rec._h, rec._w):
+        frame_bgr = cv2.resize(frame_bgr, (rec._w, rec._h))
+    frame_rgb = cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2RGB)
+    return av.VideoFrame.from_ndarray(frame_rgb, format="rgb24")
+
+
+def make_fixtures(count: int, width: int, height: int, quality: int) -> list:
+    rng = np.random.default_rng(0)
+    base = cv2.GaussianBlur(rng.integers(0, 256, (height, width, 3), dtype=np.uint8), (0, 0), 3)
+    out = []
+    for i in range(count):
+        img = np.roll(base, i * 8, axis=1)
+        cv2.putText(img, f"{i:04d}", (40, height // 2), cv2.FONT_HERSHEY_SIMPLEX, 3, (255, 255, 255), 6)
+        out.append(cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes())
+    return out
+
+
+def run(path: str, fixtures: list, frames: int) -> dict:
+    rec = recording.Recorder(client_id=f"bench-{path}", fps=30, format="h264")
+    prepare = (lambda data: legacy_prepare(rec, data)) if path == "legacy" else rec._prepare_bgr
+    rec._open_container(*recording.jpeg_dimensions(fixtures[0]))
+    rec._frames = 1  # skip the first-frame thumbnail in both paths
+
+    prep_ms, total_ms, peak_bytes = [], [], []
+    tracemalloc.start()
+    for i in range(frames):
+        data = fixtures[i % len(fixtures)]
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        t0 = time.perf_counter()
+        payload = prepare(data)
+        t1 = time.perf_counter()
+        rec._write(payload, i * 33)
+        t2 = time.perf_counter()
+        peak_bytes.append(tracemalloc.get_traced_memory()[1] - base)
+        prep_ms.append(1000 * (t1 - t0))
+        total_ms.append(1000 * (t2 - t0))
+    tracemalloc.stop()
+    rec._close_container()
+    os.remove(rec._path_local)
+
+    warm = slice(min(10, frames // 2), None)  # leave out encoder start-up
+    return {
+        "path": path,
+        "prepareMsPerFrame": round(statistics.median(prep_ms[warm]), 3),
+        "totalMsPerFrame": round(statistics.median(total_ms[warm]), 3),
+        "peakBytesPerFrame": int(statistics.median(peak_bytes[warm])),
+    }
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    p.add_argument("--frames", type=int, default=200)
+    p.add_argument("--width", type=int, default=1280)
+    p.add_argument("--height", type=int, default=720)
+    p.add_argument("--quality", type=int, default=80)
+    p.add_argument("--output", help="write the JSON result here (default: stdout)")
+    args = p.parse_args(argv)
+
+    fixtures = make_fixtures(30, args.width, args.height, args.quality)
+    # The Recorder's own log lines go to stderr, keeping stdout for the JSON
+    with tempfile.TemporaryDirectory(prefix="encode_") as workdir, contextlib.redirect_stdout(sys.stderr):
+        recording.RECORDINGS_DIR = workdir
+        results = [run(path, fixtures, args.frames) for path in ("legacy", "pooled")]
+    for r in results:
+        print(f"[encode] {r['path']:>7}: prepare {r['prepareMsPerFrame']} ms  total {r['totalMsPerFrame']} ms  "
+              f"peak alloc {r['peakBytesPerFrame'] / 1024:.0f} KiB per frame", file=sys.stderr)
+
+    text = json.dumps({"config": vars(args), "runs": results}, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,381 @@
+"""
+Headless load generator / benchmark for the ingest server.
+
+Simulates N cameras posting pre-encoded JPEGs at a fixed rate, optionally
+while each one is being recorded, and reports throughput, request latency
+(p50/p90/p99), server CPU per frame and server memory as JSON.
+
+By default it starts its own server -- create_app() with the local
+Firebase stand-ins (FIREBASE_BACKEND=local) in a temporary directory -- so
+nothing touches the cloud:
+
+    python bench/loadgen.py --cameras 1,4,16,64 --fps 10 --duration 20 --output run.json
+    python bench/loadgen.py --server asgi --mode batch --record --baseline last_release.json
+
+--cameras takes a list to measure how throughput scales with concurrency.
+With --baseline the run fails (exit 1) if fps drops or p99 latency rises by
+more than --tolerance against the matching run of an earlier result file.
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+
+import cv2
+import numpy as np
+import requests
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+FRAME_HEADER = struct.Struct(">IQ")  # same layout as server/framing.py
+
+SERVERS = {
+    # Threaded werkzeug server around create_app(), the simplest baseline
+    "flask": [sys.executable, "-c",
+              "import sys; from werkzeug.serving import make_server; from server import create_app; "
+              "make_server('127.0.0.1', int(sys.argv[1]), create_app(), threaded=True).serve_forever()",
+              "{port}"],
+    "gunicorn": [sys.executable, "-m", "gunicorn", "app:app", "-b", "127.0.0.1:{port}", "--log-level", "warning"],
+    "asgi": [sys.executable, "-m", "uvicorn", "asgi:app", "--port", "{port}", "--log-level", "warning"],
+}
+
+
+# ---------------------------------------------------------------------- #
+def make_fixtures(count: int, width: int, height: int, quality: int, static: bool) -> List[bytes]:
+    """Synthetic JPEGs: a moving gradient + noise, or one still image repeated."""
+    rng = np.random.default_rng(0)
+    base = np.tile(np.linspace(0, 255, width, dtype=np.uint8), (height, 1))
+    frames = []
+    for i in range(1 if static else count):
+        img = np.roll(base, i * 7, axis=1)
+        img = np.dstack([img, np.roll(img, 40, axis=0), 255 - img])
+        img = cv2.add(img, rng.integers(0, 24, img.shape, dtype=np.uint8))
+        cv2.putText(img, f"{i:04d}", (10, height // 2), cv2.FONT_HERSHEY_SIMPLEX, 1.5, (255, 255, 255), 3)
+        frames.append(cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes())
+    return frames
+
+
+def load_fixtures(pattern: str) -> List[bytes]:
+    frames = []
+    for path in sorted(glob.glob(pattern)):
+        with open(path, "rb") as f:
+            frames.append(f.read())
+    if not frames:
+        raise SystemExit(f"No fixtures match {pattern!r}")
+    return frames
+
+
+def percentile(sorted_values: List[float], q: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+# ---------------------------------------------------------------------- #
+class ServerProcess:
+    """create_app() in a child process, so its CPU and memory can be read on their own."""
+
+    def __init__(self, kind: str, workdir: str, extra_env: Dict[str, str]):
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            self.port = s.getsockname()[1]
+        self.url = f"http://127.0.0.1:{self.port}"
+        # Everything the server writes stays in the workdir: its recordings, and
+        # an upload queue of its own (recover() must not pick up real jobs)
+        env = dict(os.environ, FIREBASE_BACKEND="local",
+                   LOCAL_STORAGE_DIR=os.path.join(workdir, "storage"),
+                   RECORDINGS_INDEX_PATH=os.path.join(workdir, "recordings_index.sqlite3"),
+                   RECORDINGS_DIR=os.path.join(workdir, "recordings"),
+                   UPLOAD_QUEUE_DIR=os.path.join(workdir, "recordings", "upload_queue"),
+                   **extra_env)
+        cmd = [part.format(port=self.port) for part in SERVERS[kind]]
+        self.log_path = os.path.join(workdir, "server.log")
+        with open(self.log_path, "wb") as log:
+            self.proc = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=log)
+        self.started = time.time()
+        deadline = time.time() + 60
+        while time.time() < deadline:
+            try:
+                if requests.get(f"{self.url}/test", timeout=1).ok:
+                    self.ready_seconds = time.time() - self.started
+                    return
+            except requests.RequestException:
+                pass
+            if self.proc.poll() is not None:
+                with open(self.log_path, errors="replace") as log:
+                    tail = log.read()[-2000:]
+                raise SystemExit(f"{kind} server exited early:\n{tail}")
+            time.sleep(0.1)
+        self.stop()
+        raise SystemExit("Server did not come up within 60 s")
+
+    def _pids(self) -> List[int]:
+        # gunicorn / uvicorn --workers fork children; count the whole tree
+        pids, todo = [], [self.proc.pid]
+        while todo:
+            pid = todo.pop()
+            pids.append(pid)
+            try:
+                with open(f"/proc/{pid}/task/{pid}/children") as f:
+                    todo += [int(p) for p in f.read().split()]
+            except OSError:
+                pass
+        return pids
+
+    def cpu_seconds(self) -> Optional[float]:
+        """User + system CPU of the server processes (Linux /proc)."""
+        total, tick = 0.0, os.sysconf("SC_CLK_TCK")
+        try:
+            for pid in self._pids():
+                with open(f"/proc/{pid}/stat") as f:
+                    fields = f.read().rsplit(")", 1)[1].split()
+                total += (int(fields[11]) + int(fields[12])) / tick
+        except (OSError, ValueError):
+            return None
+        return total
+
+    def memory_mb(self) -> Dict[str, Optional[float]]:
+        rss = peak = 0
+        try:
+            for pid in self._pids():
+                with open(f"/proc/{pid}/status") as f:
+                    for line in f:
+                        if line.startswith("VmRSS:"):
+                            rss += int(line.split()[1])
+                        elif line.startswith("VmHWM:"):
+                            peak += int(line.split()[1])
+        except OSError:
+            return {"rss": None, "peakRss": None}
+        return {"rss": round(rss / 1024, 1), "peakRss": round(peak / 1024, 1)}
+
+    def stop(self):
+        self.proc.terminate()
+        try:
+            self.proc.wait(10)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+
+
+class RemoteServer:
+    """--url target: only request-side figures are available."""
+
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+
+    def cpu_seconds(self) -> Optional[float]:
+        return None
+
+    def memory_mb(self) -> Dict[str, Optional[float]]:
+        return {"rss": None, "peakRss": None}
+
+    def stop(self):
+        pass
+
+
+# ---------------------------------------------------------------------- #
+class Camera(threading.Thread):
+    """One simulated camera: posts fixtures at `fps` (0 = as fast as possible)."""
+
+    def __init__(self, url: str, client_id: str, fixtures: List[bytes], fps: float,
+                 mode: str, batch_size: int, stop_at: float):
+        super().__init__(daemon=True)
+        self.url, self.client_id, self.fixtures = url, client_id, fixtures
+        self.fps, self.mode, self.batch_size, self.stop_at = fps, mode, batch_size, stop_at
+        self.session = requests.Session()
+        self.session.headers["X-Client-ID"] = client_id
+        self.latencies: List[float] = []
+        self.frames = 0
+        self.requests = 0
+        self.errors = 0
+        self.throttled = 0
+
+    def _post(self, frames: List[bytes]):
+        now_ms = str(int(time.time() * 1000))
+        if self.mode == "batch":
+            body = b"".join(FRAME_HEADER.pack(len(f), int(now_ms)) + f for f in frames)
+            return self.session.post(f"{self.url}/upload/batch", data=body, timeout=30,
+                                     headers={"Content-Type": "application/octet-stream"})
+        return self.session.post(f"{self.url}/upload", timeout=30, headers={"X-Capture-Ts": now_ms},
+                                 files={"image": ("frame.jpg", frames[0], "image/jpeg")})
+
+    def run(self):
+        per_request = self.batch_size if self.mode == "batch" else 1
+        interval = per_request / self.fps if self.fps else 0.0
+        next_at = time.time()
+        i = 0
+        while time.time() < self.stop_at:
+            frames = [self.fixtures[(i + k) % len(self.fixtures)] for k in range(per_request)]
+            i += per_request
+            start = time.perf_counter()
+            try:
+                r = self._post(frames)
+                self.requests += 1
+                if r.status_code == 429:
+                    self.throttled += 1
+                    time.sleep(float(r.headers.get("Retry-After", 1)))
+                elif r.ok:
+                    self.latencies.append(time.perf_counter() - start)
+                    self.frames += per_request
+                else:
+                    self.errors += 1
+            except requests.RequestException:
+                self.errors += 1
+            if interval:
+                next_at += interval
+                delay = next_at - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    next_at = time.time()  # fell behind; don't burst to catch up
+
+
+def wait_for_uploads(url: str, timeout: float = 120.0):
+    """Let the recordings finish uploading before the server is stopped."""
+    time.sleep(1.0)  # stop hands the upload job over asynchronously
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        uploads = requests.get(f"{url}/stats", timeout=10).json()["uploads"]
+        if uploads["pending"] == 0 and uploads["inFlight"] == 0:
+            return
+        time.sleep(0.5)
+    print("[loadgen] Uploads still pending after the run", file=sys.stderr)
+
+
+def run_once(server: ServerProcess, cameras: int, args, fixtures: List[bytes]) -> dict:
+    ids = [f"BENCH_{cameras}_{n:04d}" for n in range(cameras)]
+    if args.record:
+        for cid in ids:
+            requests.post(f"{server.url}/record/start", timeout=10, json={
+                "clientId": cid, "fps": int(args.fps or 10), "maxSeconds": 0, "format": args.record_format})
+
+    cpu0, wall0 = server.cpu_seconds(), time.time()
+    stop_at = wall0 + args.duration
+    threads = [Camera(server.url, cid, fixtures, args.fps, args.mode, args.batch_size, stop_at) for cid in ids]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.time() - wall0
+    cpu1 = server.cpu_seconds()
+    memory = server.memory_mb()
+
+    if args.record:
+        for cid in ids:
+            requests.post(f"{server.url}/record/stop", timeout=120, json={"clientId": cid})
+        wait_for_uploads(server.url)
+
+    lat = sorted(x for t in threads for x in t.latencies)
+    frames = sum(t.frames for t in threads)
+    ms = lambda v: round(v * 1000, 2) if v is not None else None
+    return {
+        "cameras": cameras,
+        "frames": frames,
+        "requests": sum(t.requests for t in threads),
+        "errors": sum(t.errors for t in threads),
+        "throttled": sum(t.throttled for t in threads),
+        "durationSec": round(wall, 2),
+        "fps": round(frames / wall, 1),
+        "rps": round(sum(t.requests for t in threads) / wall, 1),
+        "latencyMs": {"p50": ms(percentile(lat, 0.50)), "p90": ms(percentile(lat, 0.90)),
+                      "p99": ms(percentile(lat, 0.99)), "max": ms(lat[-1] if lat else None)},
+        "cpuMsPerFrame": round(1000 * (cpu1 - cpu0) / frames, 3) if frames and cpu0 is not None else None,
+        "serverCpuPercent": round(100 * (cpu1 - cpu0) / wall, 1) if cpu0 is not None else None,
+        "memoryMb": memory,
+    }
+
+
+def compare(result: dict, baseline_path: str, tolerance: float) -> List[str]:
+    """Regressions against an earlier result file, matched by camera count."""
+    with open(baseline_path) as f:
+        baseline = {r["cameras"]: r for r in json.load(f)["runs"]}
+    problems = []
+    for run in result["runs"]:
+        old = baseline.get(run["cameras"])
+        if old is None:
+            continue
+        if old["fps"] and run["fps"] < old["fps"] * (1 - tolerance):
+            problems.append(f"{run['cameras']} cameras: fps {run['fps']} < baseline {old['fps']}")
+        p99, old_p99 = run["latencyMs"]["p99"], old["latencyMs"]["p99"]
+        if p99 is not None and old_p99 and p99 > old_p99 * (1 + tolerance):
+            problems.append(f"{run['cameras']} cameras: p99 {p99} ms > baseline {old_p99} ms")
+    return problems
+
+
+# ---------------------------------------------------------------------- #
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    p.add_argument("--cameras", default="1,4,16", help="camera counts to run, e.g. 1,4,16,64")
+    p.add_argument("--fps", type=float, default=10, help="frames/s per camera (0 = unthrottled)")
+    p.add_argument("--duration", type=float, default=15, help="seconds per run")
+    p.add_argument("--mode", choices=["post", "batch"], default="post")
+    p.add_argument("--batch-size", type=int, default=8)
+    p.add_argument("--record", action="store_true", help="record every camera during the run")
+    p.add_argument("--record-format", default="h264")
+    p.add_argument("--width", type=int, default=640)
+    p.add_argument("--height", type=int, default=480)
+    p.add_argument("--quality", type=int, default=80)
+    p.add_argument("--static", action="store_true", help="send one still image (exercises change detection)")
+    p.add_argument("--fixtures", help="glob of JPEG files to send instead of synthetic frames")
+    p.add_argument("--server", choices=sorted(SERVERS), default="flask")
+    p.add_argument("--url", help="benchmark an already running server instead (no CPU / memory figures)")
+    p.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="extra server environment")
+    p.add_argument("--output", help="write the JSON result here (default: stdout)")
+    p.add_argument("--baseline", help="earlier JSON result to check for regressions")
+    p.add_argument("--tolerance", type=float, default=0.10)
+    args = p.parse_args(argv)
+
+    fixtures = load_fixtures(args.fixtures) if args.fixtures else make_fixtures(
+        30, args.width, args.height, args.quality, args.static)
+    counts = [int(c) for c in args.cameras.split(",") if c]
+
+    result = {
+        "config": dict(vars(args), fixtureCount=len(fixtures),
+                       avgFixtureBytes=int(sum(map(len, fixtures)) / len(fixtures))),
+        "host": {"python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count()},
+        "startedAt": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "runs": [],
+    }
+    with tempfile.TemporaryDirectory(prefix="loadgen_") as workdir:
+        for cameras in counts:
+            # A fresh server per run, so memory figures are not carried over
+            if args.url:
+                server = RemoteServer(args.url)
+            else:
+                server = ServerProcess(args.server, workdir, dict(kv.split("=", 1) for kv in args.env))
+            try:
+                run = run_once(server, cameras, args, fixtures)
+                if isinstance(server, ServerProcess):
+                    run["serverReadySec"] = round(server.ready_seconds, 2)
+                result["runs"].append(run)
+                print(f"[loadgen] {cameras:>4} cameras: {run['fps']:>8} fps  p50 {run['latencyMs']['p50']} ms  "
+                      f"p99 {run['latencyMs']['p99']} ms  cpu/frame {run['cpuMsPerFrame']} ms  "
+                      f"rss {run['memoryMb']['rss']} MB  errors {run['errors']}  429s {run['throttled']}",
+                      file=sys.stderr)
+            finally:
+                server.stop()
+
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.baseline:
+        problems = compare(result, args.baseline, args.tolerance)
+        for line in problems:
+            print(f"[loadgen] REGRESSION {line}", file=sys.stderr)
+        return 1 if problems else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
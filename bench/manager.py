@@ -0,0 +1,163 @@
+"""
+RecordingManager contention benchmark: N threads x M clients calling
+add_frame / stop / start, reported as frames handed over per second.
+
+Recorders are replaced by a stand-in whose add_frame only appends to a
+bounded deque and whose stop takes --flush-ms (the encoder drain and
+container close of a real recording), so the figures measure the manager's
+locking and nothing else. "per-client" is the current RecordingManager;
+"global" is the earlier one, where every call took one manager-wide lock:
+
+    python bench/manager.py --threads 1,2,4,8,16 --clients 32 --duration 3
+
+With --stop-every 0 only the hot path is measured and both are bound by
+the GIL; with stops, "per-client" lets flushes of different clients
+overlap and keeps add_frame running meanwhile, while "global" stalls every
+thread for each flush.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import threading
+import time
+from collections import deque
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from server import recording  # noqa: E402
+
+
+class NullRecorder:
+    """Recorder stand-in: the manager-facing surface, no encoding."""
+
+    flush_seconds = 0.0
+
+    def __init__(self, client_id: str, fps: int = 10, max_seconds=None, **options):
+        self.client_id = client_id
+        self.active = False
+        self.backlogged = False
+        self._queue = deque(maxlen=30)
+
+    def start(self):
+        self.active = True
+
+    def add_frame(self, frame, ts=None):
+        self._queue.append((frame, ts))
+
+    def add_repeat(self, ts=None):
+        pass
+
+    def stop_and_upload(self):
+        self.active = False
+        time.sleep(self.flush_seconds)
+        return None, None
+
+    def stats(self) -> dict:
+        return {"active": self.active, "queueDepth": len(self._queue)}
+
+
+class GlobalLockManager(recording.RecordingManager):
+    """The pre per-client-lock manager: every call under one lock."""
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+
+    def start(self, client_id, fps=10, max_seconds=None, **options):
+        with self._lock:
+            super().start(client_id, fps, max_seconds, **options)
+
+    def add_frame(self, client_id, frame, ts=None):
+        with self._lock:
+            rec = self._by_client.get(client_id)
+            if rec and rec.active:
+                rec.add_frame(frame, ts)
+
+    def stop(self, client_id):
+        with self._lock:
+            return super().stop(client_id)
+
+
+def run(kind: str, threads: int, clients: int, duration: float, stop_every: int) -> dict:
+    mgr = GlobalLockManager() if kind == "global" else recording.RecordingManager()
+    ids = [f"cam{i}" for i in range(clients)]
+    for cid in ids:
+        mgr.start(cid)
+    frame = b"\xff\xd8" + bytes(1024)
+    counts = [0] * threads
+    latencies = [[] for _ in range(threads)]
+    deadline = time.perf_counter() + duration
+
+    def worker(t: int):
+        i = 0
+        while time.perf_counter() < deadline:
+            cid = ids[(t * 7 + i) % clients]
+            i += 1
+            if stop_every and i % stop_every == 0:
+                mgr.stop(cid)
+                mgr.start(cid)
+                continue
+            t0 = time.perf_counter()
+            mgr.add_frame(cid, frame)
+            latencies[t].append(time.perf_counter() - t0)
+            counts[t] += 1
+
+    pool = [threading.Thread(target=worker, args=(t,)) for t in range(threads)]
+    start = time.perf_counter()
+    for th in pool:
+        th.start()
+    for th in pool:
+        th.join()
+    wall = time.perf_counter() - start
+    lat = sorted(x for per in latencies for x in per)
+    return {
+        "manager": kind,
+        "threads": threads,
+        "clients": clients,
+        "framesPerSec": round(sum(counts) / wall),
+        "addFrameUs": {
+            "p50": round(1e6 * statistics.median(lat), 2) if lat else None,
+            "p99": round(1e6 * lat[int(0.99 * (len(lat) - 1))], 2) if lat else None,
+        },
+    }
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    p.add_argument("--threads", default="1,2,4,8,16", help="thread counts to run")
+    p.add_argument("--clients", type=int, default=32)
+    p.add_argument("--duration", type=float, default=3, help="seconds per run")
+    p.add_argument("--stop-every", type=int, default=500,
+                   help="each thread stops and restarts a recording every N calls (0 = never)")
+    p.add_argument("--flush-ms", type=float, default=50, help="time a stop spends draining / closing")
+    p.add_argument("--output", help="write the JSON result here (default: stdout)")
+    args = p.parse_args(argv)
+
+    NullRecorder.flush_seconds = args.flush_ms / 1000
+    recording.Recorder = NullRecorder  # the manager looks the class up at start()
+    result = {
+        "config": vars(args),
+        "host": {"python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count()},
+        "startedAt": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "runs": [],
+    }
+    for threads in [int(n) for n in args.threads.split(",") if n]:
+        for kind in ("global", "per-client"):
+            r = run(kind, threads, args.clients, args.duration, args.stop_every)
+            result["runs"].append(r)
+            print(f"[manager] {kind:>10} {threads:>3} threads: {r['framesPerSec']:>9} frames/s  "
+                  f"add_frame p50 {r['addFrameUs']['p50']} us  p99 {r['addFrameUs']['p99']} us", file=sys.stderr)
+
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
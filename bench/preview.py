@@ -0,0 +1,84 @@
+"""
+Preview benchmark: CPU time and bytes of each preview size (Frame.preview,
+?size= on /latest_frame and /stream) for the same uploaded JPEGs.
+
+Every measurement uses a fresh Frame, so each figure is the cost of the
+first viewer of a frame; later viewers get the cached bytes. "thumb-full"
+is the thumbnail built from a full-resolution decode, for comparison with
+the reduced-scale decode the server uses:
+
+    python bench/preview.py --frames 100 --width 1920 --height 1080
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from loadgen import load_fixtures, make_fixtures  # noqa: E402
+from server import frame_store  # noqa: E402
+from server.frame_store import Frame, PREVIEW_SIZES  # noqa: E402
+
+
+def thumb_from_full_decode(data: bytes) -> bytes:
+    """Thumbnail without the reduced-scale decode."""
+    import cv2
+    import numpy as np
+
+    gray = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_GRAYSCALE)
+    h, w = gray.shape[:2]
+    width = PREVIEW_SIZES["thumb"]
+    gray = cv2.resize(gray, (width, h * width // w), interpolation=cv2.INTER_AREA)
+    return cv2.imencode(".jpg", gray, [cv2.IMWRITE_JPEG_QUALITY, frame_store.PREVIEW_JPEG_QUALITY])[1].tobytes()
+
+
+def run(name: str, fixtures: list, frames: int) -> dict:
+    ms, sizes = [], []
+    for i in range(frames):
+        data = fixtures[i % len(fixtures)]
+        t0 = time.perf_counter()
+        if name == "thumb-full":
+            out = thumb_from_full_decode(data)
+        else:
+            out = Frame(data, time.time(), i).preview(name)
+        ms.append(1000 * (time.perf_counter() - t0))
+        sizes.append(len(out))
+    return {
+        "size": name,
+        "msPerPreview": round(statistics.median(ms), 3),
+        "bytesPerPreview": int(statistics.median(sizes)),
+        "uploadBytes": int(statistics.median(len(f) for f in fixtures)),
+    }
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    p.add_argument("--frames", type=int, default=100)
+    p.add_argument("--width", type=int, default=1280)
+    p.add_argument("--height", type=int, default=720)
+    p.add_argument("--quality", type=int, default=85)
+    p.add_argument("--fixtures", help="glob of JPEG files to use instead of synthetic frames")
+    p.add_argument("--output", help="write the JSON result here (default: stdout)")
+    args = p.parse_args(argv)
+
+    fixtures = load_fixtures(args.fixtures) if args.fixtures else make_fixtures(
+        30, args.width, args.height, args.quality, False)
+    run("full", fixtures[:2], 2)  # load cv2 outside the timings
+    results = [run(name, fixtures, args.frames) for name in list(PREVIEW_SIZES) + ["thumb-full"]]
+    for r in results:
+        print(f"[preview] {r['size']:>10}: {r['msPerPreview']:>7} ms  {r['bytesPerPreview'] / 1024:>7.1f} KiB",
+              file=sys.stderr)
+
+    text = json.dumps({"config": vars(args), "runs": results}, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
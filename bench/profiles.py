@@ -0,0 +1,100 @@
+"""
+Encoder profile benchmark: CPU cost and output bitrate of each entry in
+recording.ENCODER_PROFILES on the same footage.
+
+Frames go through a real Recorder (decode, scale, encode, mux) without the
+queue or the upload, and the process CPU time spent on them -- encoder
+threads included -- is reported per minute of recorded video:
+
+    python bench/profiles.py --seconds 30 --fps 10 --width 1280 --height 720
+    python bench/profiles.py --fixtures 'footage/*.jpg' --profiles low-cpu,archive
+
+Synthetic fixtures (the load generator's moving gradient plus noise) are
+harder to compress than most camera footage; use --fixtures for figures
+that match a deployment.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from loadgen import load_fixtures, make_fixtures  # noqa: E402
+from server import recording  # noqa: E402
+
+
+def run(profile: str, fixtures: list, seconds: float, fps: int) -> dict:
+    rec = recording.Recorder(client_id=f"bench-{profile}", fps=fps, format="h264", profile=profile)
+    frames = int(seconds * fps)
+    cpu0, wall0 = time.process_time(), time.perf_counter()
+    for i in range(frames):
+        rec._encode((fixtures[i % len(fixtures)], i / fps))
+    rec._close_container()
+    cpu = time.process_time() - cpu0
+    wall = time.perf_counter() - wall0
+
+    size = os.path.getsize(rec._path_local)
+    os.remove(rec._path_local)
+    if rec._thumbnail_path and os.path.exists(rec._thumbnail_path):
+        os.remove(rec._thumbnail_path)
+    return {
+        "profile": profile,
+        "settings": recording.ENCODER_PROFILES[profile],
+        "size": f"{rec._w}x{rec._h}",
+        "frames": rec._frames,
+        "cpuSecPerMinute": round(cpu * 60 / seconds, 2),
+        "encodeFps": round(frames / wall, 1),
+        "bitrateKbps": round(size * 8 / seconds / 1000, 1),
+        "bytes": size,
+    }
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    p.add_argument("--profiles", default=",".join(recording.ENCODER_PROFILES), help="comma-separated profile names")
+    p.add_argument("--seconds", type=float, default=20, help="seconds of video per profile")
+    p.add_argument("--fps", type=int, default=10)
+    p.add_argument("--width", type=int, default=1280)
+    p.add_argument("--height", type=int, default=720)
+    p.add_argument("--quality", type=int, default=85)
+    p.add_argument("--fixtures", help="glob of JPEG files to encode instead of synthetic frames")
+    p.add_argument("--output", help="write the JSON result here (default: stdout)")
+    args = p.parse_args(argv)
+
+    profiles = [name for name in args.profiles.split(",") if name]
+    unknown = [name for name in profiles if name not in recording.ENCODER_PROFILES]
+    if unknown:
+        p.error(f"unknown profiles {unknown}; known: {list(recording.ENCODER_PROFILES)}")
+    fixtures = load_fixtures(args.fixtures) if args.fixtures else make_fixtures(
+        30, args.width, args.height, args.quality, False)
+
+    result = {
+        "config": vars(args),
+        "host": {"python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count()},
+        "startedAt": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "runs": [],
+    }
+    # The Recorder's own log lines go to stderr, keeping stdout for the JSON
+    with tempfile.TemporaryDirectory(prefix="profiles_") as workdir, contextlib.redirect_stdout(sys.stderr):
+        recording.RECORDINGS_DIR = workdir
+        for profile in profiles:
+            r = run(profile, fixtures, args.seconds, args.fps)
+            result["runs"].append(r)
+            print(f"[profiles] {profile:>12}: {r['size']:>9}  {r['cpuSecPerMinute']:>7} CPU s/min  "
+                  f"{r['bitrateKbps']:>8} kbit/s  {r['encodeFps']:>6} fps", file=sys.stderr)
+
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,182 @@
+"""
+Worker startup benchmark: how long a fresh process takes to import the
+server, build the app and answer its first request.
+
+Each run is a new interpreter started with `python -X importtime`, so the
+report has the same per-module figures as that flag (self and cumulative
+microseconds), plus create_app() and first-request wall times:
+
+    python bench/startup.py --runs 5 --output startup.json
+    python bench/startup.py --entry asgi --baseline startup.json
+
+Codecs (av, cv2, numpy) and the Firebase SDK are meant to load on first
+use, not at startup, and so are the upload pools and the recordings
+directory / index. The run fails (exit 1) if any of them is imported,
+started or created while the worker starts, if the median import time is
+over --budget-ms, or if it rose by more than --tolerance against a
+--baseline result file.
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# Modules that must stay out of worker startup
+LAZY_MODULES = ("av", "cv2", "numpy", "firebase_admin", "google.cloud.storage", "google.cloud.firestore")
+# Thread name prefixes of pools that start with their first job
+LAZY_THREADS = ("upload-job", "upload-file")
+
+# Runs in the child; prints one JSON line after the importtime output
+_CHILD = r"""
+import json, sys, threading, time
+t0 = time.perf_counter()
+if {entry!r} == "asgi":
+    from asgi import app
+    flask_app = app.flask_app
+else:
+    from app import app as flask_app
+t1 = time.perf_counter()
+status = flask_app.test_client().get("/test").status_code
+t2 = time.perf_counter()
+print(json.dumps({{
+    "createAppMs": round(1000 * (t1 - t0), 1),
+    "firstRequestMs": round(1000 * (t2 - t1), 1),
+    "status": status,
+    "modules": sorted(sys.modules),
+    "threads": [t.name for t in threading.enumerate()],
+}}))
+"""
+
+_IMPORTTIME = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def parse_importtime(stderr: str) -> List[dict]:
+    """[{"module", "selfUs", "cumulativeUs", "depth"}] from -X importtime output."""
+    rows = []
+    for line in stderr.splitlines():
+        m = _IMPORTTIME.match(line)
+        if m:
+            rows.append({"module": m.group(4), "selfUs": int(m.group(1)),
+                         "cumulativeUs": int(m.group(2)), "depth": (len(m.group(3)) - 1) // 2})
+    return rows
+
+
+def run_once(entry: str, env: Dict[str, str]) -> dict:
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _CHILD.format(entry=entry)],
+        cwd=ROOT, env=env, capture_output=True, text=True, timeout=120,
+    )
+    wall = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise RuntimeError(f"startup failed ({proc.returncode}):\n{proc.stderr[-2000:]}")
+    child = json.loads(proc.stdout.strip().splitlines()[-1])
+    rows = parse_importtime(proc.stderr)
+    created = [p for p in (env["RECORDINGS_DIR"], env["RECORDINGS_INDEX_PATH"]) if os.path.exists(p)]
+    for path in created:  # each run starts from nothing
+        shutil.rmtree(path) if os.path.isdir(path) else os.remove(path)
+    return {
+        "processMs": round(1000 * wall, 1),
+        "importMs": round(sum(r["cumulativeUs"] for r in rows if r["depth"] == 0) / 1000, 1),
+        "createAppMs": child["createAppMs"],
+        "firstRequestMs": child["firstRequestMs"],
+        "status": child["status"],
+        "lazyModulesLoaded": [m for m in LAZY_MODULES if m in child["modules"]],
+        "lazyThreadsStarted": sorted({n.split("_")[0] for n in child["threads"] if n.startswith(LAZY_THREADS)}),
+        "pathsCreated": [os.path.basename(p) for p in created],
+        "rows": rows,
+    }
+
+
+def compare(result: dict, baseline_path: str, tolerance: float) -> List[str]:
+    with open(baseline_path) as f:
+        old = json.load(f)["median"]
+    problems = []
+    for key in ("importMs", "createAppMs"):
+        if old.get(key) and result["median"][key] > old[key] * (1 + tolerance):
+            problems.append(f"{key} {result['median'][key]} > baseline {old[key]}")
+    return problems
+
+
+# ---------------------------------------------------------------------- #
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    p.add_argument("--entry", choices=["app", "asgi"], default="app", help="app.py (gunicorn) or asgi.py (uvicorn)")
+    p.add_argument("--runs", type=int, default=5)
+    p.add_argument("--top", type=int, default=15, help="slowest modules (self time) to list")
+    p.add_argument("--budget-ms", type=float, help="fail if the median import time is above this")
+    p.add_argument("--output", help="write the JSON result here (default: stdout)")
+    p.add_argument("--baseline", help="earlier JSON result to check for regressions")
+    p.add_argument("--tolerance", type=float, default=0.25)
+    args = p.parse_args(argv)
+
+    runs = []
+    with tempfile.TemporaryDirectory(prefix="startup_") as workdir:
+        env = dict(
+            os.environ,
+            FIREBASE_BACKEND="local",
+            FIREBASE_WARMUP_DELAY="-1",  # keep the background warm-up out of the figures
+            LOCAL_STORAGE_DIR=os.path.join(workdir, "storage"),
+            RECORDINGS_INDEX_PATH=os.path.join(workdir, "recordings.sqlite3"),
+            RECORDINGS_DIR=os.path.join(workdir, "recordings"),
+            UPLOAD_QUEUE_DIR=os.path.join(workdir, "recordings", "upload_queue"),
+            SHARED_FRAMES_DIR=os.path.join(workdir, "frames"),
+        )
+        for i in range(args.runs):
+            run = run_once(args.entry, env)
+            runs.append(run)
+            print(f"[startup] run {i + 1}: import {run['importMs']} ms  create_app {run['createAppMs']} ms  "
+                  f"first request {run['firstRequestMs']} ms  process {run['processMs']} ms", file=sys.stderr)
+
+    # Per-module self time, median over runs
+    self_us: Dict[str, List[int]] = {}
+    for run in runs:
+        for row in run["rows"]:
+            self_us.setdefault(row["module"], []).append(row["selfUs"])
+    slowest = sorted(((statistics.median(v), k) for k, v in self_us.items()), reverse=True)[:args.top]
+
+    result = {
+        "config": vars(args),
+        "host": {"python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count()},
+        "startedAt": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "median": {key: round(statistics.median(r[key] for r in runs), 1)
+                   for key in ("importMs", "createAppMs", "firstRequestMs", "processMs")},
+        "lazyModulesLoaded": sorted({m for r in runs for m in r["lazyModulesLoaded"]}),
+        "lazyThreadsStarted": sorted({t for r in runs for t in r["lazyThreadsStarted"]}),
+        "pathsCreated": sorted({p for r in runs for p in r["pathsCreated"]}),
+        "slowestModules": [{"module": k, "selfMs": round(us / 1000, 2)} for us, k in slowest],
+    }
+
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    problems = [f"{m} imported at startup" for m in result["lazyModulesLoaded"]]
+    problems += [f"{t} threads started at startup" for t in result["lazyThreadsStarted"]]
+    problems += [f"{p} created at startup" for p in result["pathsCreated"]]
+    if any(r["status"] != 200 for r in runs):
+        problems.append("/test did not return 200")
+    if args.budget_ms and result["median"]["importMs"] > args.budget_ms:
+        problems.append(f"importMs {result['median']['importMs']} > budget {args.budget_ms}")
+    if args.baseline:
+        problems += compare(result, args.baseline, args.tolerance)
+    for line in problems:
+        print(f"[startup] REGRESSION {line}", file=sys.stderr)
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,8 +4,14 @@ import requests
 import time
 import sys
 
+from uploader import FrameUploader
+
 SERVER_URL = "http://127.0.0.1:5000"  # <-- change to match your network/server
 CLIENT_ID = "CAMERA_01"
+# "stream": one persistent /upload/stream connection; "post": pooled /upload requests;
+# "batch": several frames per /upload/batch request (high-latency links)
+UPLOAD_MODE = "stream"
+REPORT_EVERY = 5  # seconds between fps / latency reports
 
 
 def test_server():
@@ -31,11 +37,11 @@ def open_camera(index=0):
     return cap
 
 
-def send_frame(frame, frame_id):
-    _, buffer = cv2.imencode('.jpg', frame)
-    files = {'image': ('frame.jpg', buffer.tobytes(), 'image/jpeg')}
-    headers = {"X-Client-ID": CLIENT_ID}
-    requests.post(f"{SERVER_URL}/upload", files=files, headers=headers, timeout=3)
+def print_report(report):
+    lat = report["latencyMs"]
+    print(f"📈 {report['mode']}: {report['fps']} fps sent, latency avg {lat['avg']} ms / p95 {lat['p95']} ms, "
+          f"dropped {report['dropped']}, failed {report['failed']}, server lag {report['serverLagMs']} ms, "
+          f"hint {report['hint']}")
 
 
 def main():
@@ -52,19 +58,27 @@ def main():
         print("❌", e)
         sys.exit(1)
 
+    uploader = FrameUploader(SERVER_URL, CLIENT_ID, mode=UPLOAD_MODE)
     frame_count = 0
     start_time = time.time()
+    last_report = start_time
 
     # Step 3: Stream frames for 10 seconds (or until 'q' pressed)
     try:
         while (time.time() - start_time) < 1000:
             ret, frame = cap.read()
+            capture_ts = time.time()
             if not ret:
                 print("⚠️ Frame read failed")
                 break
 
-            frame_count += 1
-            send_frame(frame, frame_count)
+            # Send at the rate / size / quality the server last asked for
+            if uploader.due(capture_ts):
+                frame_count += 1
+                uploader.send(uploader.encode(frame), capture_ts)
+            if time.time() - last_report >= REPORT_EVERY:
+                print_report(uploader.report())
+                last_report = time.time()
 
             cv2.imshow("Streaming (press Q to quit)", frame)
             if cv2.waitKey(1) & 0xFF == ord("q"):
@@ -75,6 +89,8 @@ def main():
     except KeyboardInterrupt:
         print("\n🛑 Interrupted by user")
     finally:
+        uploader.close()
+        print_report(uploader.report())
         cap.release()
         cv2.destroyAllWindows()
 
@@ -0,0 +1,251 @@
+# uploader.py -- frame upload path shared by client.py and client2.py
+import queue
+import struct
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+import cv2
+import requests
+from requests.adapters import HTTPAdapter
+
+# Same wire layout as server/framing.py: uint32 JPEG length, uint64 capture ms
+FRAME_HEADER = struct.Struct(">IQ")
+# Reopen the stream this often so the server's summary (and upload hint) comes back
+STREAM_ROTATE_SECONDS = 5
+# A batch is sent once it is full or this long after its first frame
+BATCH_MAX_WAIT = 1.0
+
+
+class FrameUploader:
+    """
+    Sends JPEG frames in the background so the capture loop never waits on
+    the network.
+
+    mode="stream": one long chunked POST to /upload/stream on a keep-alive
+    connection, frames written back to back with a length prefix.
+    mode="post": a POST /upload per frame over a pooled Session, with up to
+    `max_in_flight` requests outstanding at once.
+    mode="batch": up to `batch_size` frames per POST /upload/batch, for
+    high-latency links where per-request overhead dominates.
+
+    If `queue_size` frames are already waiting, send() drops the oldest.
+    The server's latest upload hint (interval, max width, JPEG quality) is
+    kept in `hint`; due() and encode() apply it.
+    """
+
+    def __init__(self, server_url: str, client_id: str, mode: str = "stream",
+                 max_in_flight: int = 4, queue_size: int = 8, batch_size: int = 8):
+        self.server_url = server_url.rstrip("/")
+        self.mode = mode
+        self.batch_size = batch_size
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_in_flight)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["X-Client-ID"] = client_id
+
+        if mode == "batch":
+            queue_size = max(queue_size, 2 * batch_size)
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._closed = threading.Event()
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=1000)
+        self._started = time.time()
+        self.sent = 0
+        self.dropped = 0
+        self.failed = 0
+        self.server_lag_ms: Optional[float] = None
+        self.hint: dict = {}
+        self._last_due = 0.0
+
+        if mode == "stream":
+            workers = [self._stream_loop]
+        elif mode == "batch":
+            workers = [self._batch_loop]
+        else:
+            workers = [self._post_loop] * max_in_flight
+        self._threads = [threading.Thread(target=fn, daemon=True) for fn in workers]
+        for t in self._threads:
+            t.start()
+
+    # ------------------------------------------------------------------ #
+    def due(self, now: Optional[float] = None) -> bool:
+        """True if the hinted interval has passed since the last due frame."""
+        now = now or time.time()
+        if now - self._last_due < self.hint.get("intervalMs", 0) / 1000:
+            return False
+        self._last_due = now
+        return True
+
+    def encode(self, frame) -> bytes:
+        """JPEG-encode a BGR frame at the hinted size and quality."""
+        max_width = self.hint.get("maxWidth", 0)
+        if max_width and frame.shape[1] > max_width:
+            height = int(frame.shape[0] * max_width / frame.shape[1])
+            frame = cv2.resize(frame, (max_width, height), interpolation=cv2.INTER_AREA)
+        _, buffer = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, self.hint.get("quality", 90)])
+        return buffer.tobytes()
+
+    def send(self, jpeg: bytes, capture_ts: Optional[float] = None):
+        """Queue a frame; never blocks."""
+        item = (jpeg, capture_ts or time.time())
+        while True:
+            try:
+                self._queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    continue
+                with self._lock:
+                    self.dropped += 1
+
+    def close(self, timeout: float = 5.0):
+        """Flush what is queued (up to `timeout`) and stop the senders."""
+        self._closed.set()
+        deadline = time.time() + timeout
+        for t in self._threads:
+            t.join(max(0.0, deadline - time.time()))
+        self.session.close()
+
+    def report(self) -> dict:
+        """Achieved upload rate and capture -> sent latency."""
+        elapsed = max(time.time() - self._started, 1e-6)
+        with self._lock:
+            lat = sorted(self._latencies)
+            sent, dropped, failed = self.sent, self.dropped, self.failed
+        return {
+            "mode": self.mode,
+            "sent": sent,
+            "dropped": dropped,
+            "failed": failed,
+            "fps": round(sent / elapsed, 1),
+            "latencyMs": {
+                "avg": round(1000 * sum(lat) / len(lat), 1) if lat else None,
+                "p95": round(1000 * lat[int(0.95 * (len(lat) - 1))], 1) if lat else None,
+            },
+            "serverLagMs": self.server_lag_ms,
+            "hint": self.hint,
+        }
+
+    # ------------------------------------------------------------------ #
+    def _next(self):
+        """Next queued frame, or None once closed and drained."""
+        while True:
+            try:
+                return self._queue.get(timeout=0.5)
+            except queue.Empty:
+                if self._closed.is_set():
+                    return None
+
+    @staticmethod
+    def _pack(jpeg: bytes, capture_ts: float) -> bytes:
+        return FRAME_HEADER.pack(len(jpeg), int(capture_ts * 1000)) + jpeg
+
+    def _apply_summary(self, summary: dict):
+        """Take lag and hint from a /upload/stream or /upload/batch response."""
+        self.server_lag_ms = summary.get("lagMs", {}).get("avg")
+        self.hint = summary.get("hint") or self.hint
+
+    def _record(self, capture_ts: float):
+        with self._lock:
+            self.sent += 1
+            self._latencies.append(time.time() - capture_ts)
+
+    def _post_loop(self):
+        while True:
+            item = self._next()
+            if item is None:
+                return
+            jpeg, capture_ts = item
+            try:
+                r = self.session.post(
+                    f"{self.server_url}/upload",
+                    files={"image": ("frame.jpg", jpeg, "image/jpeg")},
+                    headers={"X-Capture-Ts": str(int(capture_ts * 1000))},
+                    timeout=3,
+                )
+                if r.status_code == 429:
+                    time.sleep(float(r.headers.get("Retry-After", 1)))
+                r.raise_for_status()
+                self.hint = r.json().get("hint") or self.hint
+                self._record(capture_ts)
+            except requests.RequestException:
+                with self._lock:
+                    self.failed += 1
+
+    def _frames(self):
+        """Request body for one stream: frames until rotation or close."""
+        deadline = time.time() + STREAM_ROTATE_SECONDS
+        while time.time() < deadline:
+            item = self._next()
+            if item is None:
+                return
+            jpeg, capture_ts = item
+            yield self._pack(jpeg, capture_ts)
+            self._record(capture_ts)  # resumed once the chunk is written
+
+    def _stream_loop(self):
+        backoff = 1.0
+        while not (self._closed.is_set() and self._queue.empty()):
+            try:
+                r = self.session.post(
+                    f"{self.server_url}/upload/stream",
+                    data=self._frames(),
+                    headers={"Content-Type": "application/octet-stream"},
+                    timeout=(5, 30),
+                )
+                if r.status_code == 429:
+                    time.sleep(float(r.headers.get("Retry-After", 1)))
+                    continue
+                r.raise_for_status()
+                self._apply_summary(r.json())
+                backoff = 1.0
+            except requests.RequestException as e:
+                with self._lock:
+                    self.failed += 1
+                print(f"⚠️ Stream upload error: {e}")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 10.0)
+
+    def _take_batch(self) -> list:
+        """Up to batch_size queued frames, waiting at most BATCH_MAX_WAIT after the first."""
+        first = self._next()
+        if first is None:
+            return []
+        batch = [first]
+        deadline = time.time() + BATCH_MAX_WAIT
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _batch_loop(self):
+        while True:
+            batch = self._take_batch()
+            if not batch:
+                return
+            try:
+                r = self.session.post(
+                    f"{self.server_url}/upload/batch",
+                    data=b"".join(self._pack(jpeg, ts) for jpeg, ts in batch),
+                    headers={"Content-Type": "application/octet-stream"},
+                    timeout=10,
+                )
+                if r.status_code == 429:
+                    time.sleep(float(r.headers.get("Retry-After", 1)))
+                r.raise_for_status()
+                self._apply_summary(r.json())
+                for _, capture_ts in batch:
+                    self._record(capture_ts)
+            except requests.RequestException:
+                with self._lock:
+                    self.failed += len(batch)
@@ -0,0 +1,10 @@
+# gunicorn.conf.py -- picked up automatically by `gunicorn app:app`
+import os
+
+# /stream/<client_id> keeps a response open for as long as a dashboard is
+# watching, so each worker needs threads rather than the default sync worker.
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 32))
+# More than one worker needs FRAME_STORE=shared, or each worker only sees
+# the frames it received itself.
+workers = int(os.environ.get("GUNICORN_WORKERS", 1))
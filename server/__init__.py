@@ -16,4 +16,12 @@ def create_app():
     from .routes import bp as server_bp
     app.register_blueprint(server_bp)
 
+    # Resume recording uploads left unfinished by a previous run
+    from .upload_queue import upload_queue
+    upload_queue.recover()
+
+    # Storage / Firestore clients are created off the request path
+    from .firebase_service import warm_up
+    warm_up()
+
     return app
@@ -0,0 +1,288 @@
+"""
+ASGI entry point for high-concurrency ingest (see /asgi.py):
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5000 --workers 4
+
+POST /upload, /upload/batch and /upload/stream are handled on the event
+loop: bodies are read asynchronously, so thousands of slow camera connections
+cost a coroutine each rather than a worker. Parsing and storing frames
+(ingest_frame) runs on a bounded thread pool; decode / encode already happen
+on each recorder's encoder thread. GET /stream/<client_id> is also served
+natively; its frame waits run on a separate pool of STREAM_WORKERS threads.
+
+Every other route is the Flask app bridged with asgiref, which buffers
+request bodies (hence the native upload handlers) and runs every bridged
+request of a worker on one shared thread: they are served one at a time,
+and a slow one holds up the rest. That is why /stream, which never ends
+while a viewer is connected, must not go through the bridge.
+
+Backpressure: when INGEST_MAX_PENDING uploads are already waiting for the
+pool, or the camera's recorder uses overflow="block" and its queue is full,
+the upload is refused with 429 and a Retry-After header before its body is
+read. An open stream is throttled instead: the next chunk is not read until
+the previous frames are stored, which pushes back through TCP.
+"""
+import asyncio
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from typing import Optional
+from urllib.parse import parse_qs
+
+from asgiref.wsgi import WsgiToAsgi
+from werkzeug.formparser import FormDataParser
+from werkzeug.http import parse_options_header
+
+from . import create_app
+from . import routes
+from .clients import REGISTRY_FULL_RETRY_AFTER, RegistryFull
+from .frame_store import DEFAULT_PREVIEW_SIZE, PREVIEW_SIZES
+from .framing import FrameDecoder, FramingError
+
+INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", 16))
+INGEST_MAX_PENDING = int(os.environ.get("INGEST_MAX_PENDING", 512))
+INGEST_RETRY_AFTER = int(os.environ.get("INGEST_RETRY_AFTER", 1))  # seconds
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", 8 * 1024 * 1024))
+MAX_BATCH_BYTES = int(os.environ.get("MAX_BATCH_BYTES", 64 * 1024 * 1024))
+# Threads for /stream frame waits; kept apart from the ingest pool so that
+# viewers, each holding a thread for up to STREAM_WAIT_SECONDS, never starve uploads
+STREAM_WORKERS = int(os.environ.get("STREAM_WORKERS", 32))
+
+_STREAM_PATH = re.compile(r"^/stream/([^/]+)$")
+
+
+class IngestApp:
+    """ASGI app: native frame uploads, everything else delegated to Flask."""
+
+    def __init__(self, flask_app=None, workers: int = INGEST_WORKERS, max_pending: int = INGEST_MAX_PENDING,
+                 stream_workers: int = STREAM_WORKERS):
+        self.flask_app = flask_app or create_app()
+        self.wsgi = WsgiToAsgi(self.flask_app)
+        self.max_pending = max_pending
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ingest")
+        self._stream_pool = ThreadPoolExecutor(max_workers=stream_workers, thread_name_prefix="stream")
+        self._pending = 0  # only touched on the event loop
+        self._streams = 0  # open /stream responses, idem
+        self.rejected = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http" and scope["path"] == "/upload" and scope["method"] == "POST":
+            await self._upload(scope, receive, send)
+        elif scope["type"] == "http" and scope["path"] == "/upload/stream" and scope["method"] == "POST":
+            await self._upload_stream(scope, receive, send)
+        elif scope["type"] == "http" and scope["path"] == "/upload/batch" and scope["method"] == "POST":
+            await self._upload(scope, receive, send, self._ingest_batch, MAX_BATCH_BYTES)
+        elif scope["type"] == "http" and scope["method"] == "GET" and _STREAM_PATH.match(scope["path"]):
+            await self._stream(scope, receive, send, _STREAM_PATH.match(scope["path"]).group(1))
+        else:
+            await self.wsgi(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self._pool.shutdown(wait=False)
+                self._stream_pool.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    # ------------------------------------------------------------------ #
+    @staticmethod
+    def _request_info(scope):
+        headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope["headers"]}
+        query = {k: v[0] for k, v in parse_qs(scope.get("query_string", b"").decode()).items()}
+        return headers, headers.get("x-client-id") or query.get("clientId") or "unknown"
+
+    async def _refuse_if_busy(self, send, client_id: str) -> bool:
+        if self._pending >= self.max_pending or routes.rec_mgr.is_backlogged(client_id):
+            self.rejected += 1
+            await self._respond(send, 429, {"error": "Server busy, retry later"},
+                                [(b"retry-after", str(INGEST_RETRY_AFTER).encode())])
+            return True
+        return False
+
+    async def _refuse_new_client(self, send):
+        """Every client slot is taken by a recording camera (see ClientRegistry)."""
+        self.rejected += 1
+        await self._respond(send, 429, {"error": "Too many clients, retry later"},
+                            [(b"retry-after", str(REGISTRY_FULL_RETRY_AFTER).encode())])
+
+    async def _upload(self, scope, receive, send, handler=None, max_bytes: int = MAX_UPLOAD_BYTES):
+        """Buffered upload: read the whole body, then run `handler` on the pool."""
+        headers, client_id = self._request_info(scope)
+        if await self._refuse_if_busy(send, client_id):
+            return
+
+        length = int(headers.get("content-length") or 0)
+        if length > max_bytes:
+            await self._respond(send, 413, {"error": "Upload too large"})
+            return
+
+        self._pending += 1
+        try:
+            body = await self._read_body(receive)
+            if body is None:
+                return  # client went away
+            if len(body) > max_bytes:
+                await self._respond(send, 413, {"error": "Upload too large"})
+                return
+            loop = asyncio.get_running_loop()
+            status, payload = await loop.run_in_executor(self._pool, handler or self._ingest, client_id, headers, body)
+        except RegistryFull:
+            await self._refuse_new_client(send)
+            return
+        except Exception as e:
+            status, payload = 500, {"error": str(e)}
+        finally:
+            self._pending -= 1
+        await self._respond(send, status, payload)
+
+    async def _upload_stream(self, scope, receive, send):
+        _, client_id = self._request_info(scope)
+        if await self._refuse_if_busy(send, client_id):
+            return
+        tally = routes.StreamTally(client_id)
+        decoder = FrameDecoder()
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    return
+                frames = decoder.feed(message.get("body", b""))
+                if frames:
+                    self._pending += 1
+                    try:
+                        await loop.run_in_executor(self._pool, self._ingest_many, tally, frames)
+                    finally:
+                        self._pending -= 1
+                if not message.get("more_body"):
+                    decoder.close()
+                    break
+        except FramingError as e:
+            await self._respond(send, 400, dict(tally.summary(), status="error", error=str(e)))
+            return
+        except RegistryFull:
+            await self._refuse_new_client(send)
+            return
+        await self._respond(send, 200, tally.summary())
+
+    async def _stream(self, scope, receive, send, client_id: str):
+        """GET /stream/<client_id>: the MJPEG feed of routes.stream_frames, off the Flask bridge."""
+        query = {k: v[0] for k, v in parse_qs(scope.get("query_string", b"").decode()).items()}
+        size = query.get("size", DEFAULT_PREVIEW_SIZE)
+        if size not in PREVIEW_SIZES:
+            await self._respond(send, 400, {"error": f"size must be one of {list(PREVIEW_SIZES)}"})
+            return
+        parts = routes.mjpeg_parts(client_id, query.get("raw") == "1", size)
+
+        async def wait_for_disconnect():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+
+        gone = asyncio.ensure_future(wait_for_disconnect())
+        loop = asyncio.get_running_loop()
+        self._streams += 1
+        try:
+            await send({
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [(b"content-type", b"multipart/x-mixed-replace; boundary=frame"),
+                            (b"cache-control", b"no-cache"), (b"x-accel-buffering", b"no")],
+            })
+            while not gone.done():
+                part = await loop.run_in_executor(self._stream_pool, next, parts, None)
+                if part is None or gone.done():
+                    break
+                await send({"type": "http.response.body", "body": part, "more_body": True})
+            if not gone.done():
+                await send({"type": "http.response.body", "body": b""})
+        except OSError:
+            pass  # viewer went away mid-write
+        finally:
+            self._streams -= 1
+            gone.cancel()
+            try:
+                parts.close()
+            except ValueError:
+                pass  # still running on the pool (cancelled mid-wait); it ends with its wait
+
+    @staticmethod
+    def _ingest_many(tally, frames):
+        for image_data, capture_ts in frames:
+            tally.ingest(image_data, capture_ts)
+
+    @staticmethod
+    async def _read_body(receive) -> Optional[bytes]:
+        chunks = []
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return None
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body"):
+                return b"".join(chunks)
+
+    def _ingest(self, client_id: str, headers: dict, body: bytes):
+        """Runs on the ingest pool: parse the form and store the frame."""
+        mimetype, options = parse_options_header(headers.get("content-type", ""))
+        _, form, files = FormDataParser().parse(BytesIO(body), mimetype, len(body), options)
+        if "image" not in files:
+            return 400, {"error": "No image file"}
+        file = files["image"]
+        if file.filename == "":
+            return 400, {"error": "No file selected"}
+        image_data = file.read()
+        if not routes.is_jpeg(image_data):
+            return 400, {"error": "Failed to decode image"}
+
+        raw_ts = headers.get("x-capture-ts") or form.get("timestamp")
+        try:
+            capture_ts = float(raw_ts) / 1000 if raw_ts else None
+        except ValueError:
+            capture_ts = None
+        number = routes.ingest_frame(client_id, image_data, capture_ts)
+        hint = routes.client_hints.hint(client_id, load=self._pending / self.max_pending)
+        return 200, {"status": "success", "frame_count": number or routes.frame_store.total_frames(),
+                     "unchanged": number is None, "hint": hint}
+
+    @staticmethod
+    def _ingest_batch(client_id: str, headers: dict, body: bytes):
+        """Runs on the ingest pool: store every frame of an /upload/batch body."""
+        mimetype, options = parse_options_header(headers.get("content-type", ""))
+        form = files = None
+        if mimetype == "multipart/form-data":
+            _, form, files = FormDataParser().parse(BytesIO(body), mimetype, len(body), options)
+        tally = routes.StreamTally(client_id)
+        try:
+            for image_data, capture_ts in routes.iter_batch(mimetype, BytesIO(body), form, files):
+                tally.ingest(image_data, capture_ts)
+        except FramingError as e:
+            return 400, dict(tally.summary(), status="error", error=str(e))
+        return 200, tally.summary()
+
+    @staticmethod
+    async def _respond(send, status: int, payload: dict, extra_headers=()):
+        body = json.dumps(payload).encode()
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"application/json"),
+                        (b"content-length", str(len(body)).encode()), *extra_headers],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    # ------------------------------------------------------------------ #
+    def stats(self) -> dict:
+        return {"pending": self._pending, "maxPending": self.max_pending,
+                "workers": self._pool._max_workers, "rejected": self.rejected, "streams": self._streams}
+
+
+def create_asgi_app() -> IngestApp:
+    return IngestApp()
@@ -0,0 +1,142 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+# A client that has not uploaded for this long is forgotten, along with its
+# frames, detector state and any recording it left running.
+CLIENT_IDLE_SECONDS = float(os.environ.get("CLIENT_IDLE_SECONDS", 300))
+# Most clients tracked at once; the least recently seen is evicted first.
+MAX_CLIENTS = int(os.environ.get("MAX_CLIENTS", 1000))
+# Retry-After (seconds) for a new client turned away by a full registry
+REGISTRY_FULL_RETRY_AFTER = int(os.environ.get("REGISTRY_FULL_RETRY_AFTER", 30))
+
+
+class RegistryFull(Exception):
+    """A new client arrived while every tracked client is busy (see ClientRegistry)."""
+
+
+class ClientRegistry:
+    """
+    Last-seen times kept in an OrderedDict in upload order, so the oldest
+    client is always at the front: touch() moves a client to the back, and
+    expiry pops from the front until it meets a client that is still fresh.
+    Each client is popped at most once per touch, so upkeep is O(1)
+    amortized, and recent() only walks the clients it returns.
+
+    Callbacks registered with on_expire(fn) are called as fn(client_id),
+    outside the registry lock, for every client that is dropped.
+
+    `refresh(client_id) -> last seen` lets a caller with a better clock
+    (another worker saw the client, see shared_frames.py) keep an idle
+    entry alive; capacity evictions do not consult it.
+
+    When a new client arrives at capacity, the least recently seen client
+    for which `busy(client_id)` is false (not recording) makes room. If
+    every tracked client is busy, touch() raises RegistryFull and the new
+    client is not tracked. Both callables run under the registry lock and
+    must not call back into it.
+    """
+
+    def __init__(self, idle_seconds: float = CLIENT_IDLE_SECONDS, capacity: int = MAX_CLIENTS,
+                 refresh: Optional[Callable[[str], float]] = None,
+                 busy: Optional[Callable[[str], bool]] = None):
+        self.idle_seconds = idle_seconds
+        self.capacity = max(1, capacity)
+        self.refresh = refresh
+        self.busy = busy
+        self._seen: "OrderedDict[str, float]" = OrderedDict()
+        self._callbacks: List[Callable[[str], None]] = []
+        self._expired = 0
+        self._rejected = 0
+        self._lock = threading.Lock()
+
+    def on_expire(self, fn: Callable[[str], None]):
+        self._callbacks.append(fn)
+
+    def touch(self, client_id: str, now: Optional[float] = None):
+        """Mark the client as seen now (moving it to the back); RegistryFull if there is no room."""
+        now = now or time.time()
+        with self._lock:
+            dropped = self._collect(now)
+            admitted = client_id in self._seen or self._make_room(dropped)
+            if admitted:
+                self._seen[client_id] = now
+                self._seen.move_to_end(client_id)
+            else:
+                self._rejected += 1
+        self._notify(dropped)
+        if not admitted:
+            raise RegistryFull(f"{len(self._seen)} clients tracked, all busy")
+
+    def expire(self, now: Optional[float] = None) -> List[str]:
+        """Drop idle clients now rather than on the next touch()."""
+        with self._lock:
+            dropped = self._collect(now or time.time())
+        self._notify(dropped)
+        return dropped
+
+    def _make_room(self, dropped: List[str]) -> bool:
+        """Evict the oldest client that is not busy if the registry is full."""
+        if len(self._seen) < self.capacity:
+            return True
+        for client_id in self._seen:  # oldest first; busy clients are skipped
+            if not (self.busy and self.busy(client_id)):
+                del self._seen[client_id]
+                dropped.append(client_id)
+                self._expired += 1
+                return True
+        return False
+
+    def _collect(self, now: float) -> List[str]:
+        dropped = []
+        cutoff = now - self.idle_seconds
+        for _ in range(len(self._seen)):  # each entry is looked at most once
+            client_id, seen = next(iter(self._seen.items()))
+            if seen >= cutoff:
+                break
+            self._seen.popitem(last=False)
+            refreshed = self.refresh(client_id) if self.refresh else 0.0
+            if refreshed >= cutoff:
+                self._seen[client_id] = refreshed  # seen elsewhere; back of the line
+            else:
+                dropped.append(client_id)
+        self._expired += len(dropped)
+        return dropped
+
+    def _notify(self, dropped: List[str]):
+        for client_id in dropped:
+            print(f"[Clients] Forgetting client {client_id}")
+            for fn in self._callbacks:
+                try:
+                    fn(client_id)
+                except Exception as e:
+                    print(f"[Clients] Cleanup for {client_id} failed: {e}")
+
+    # ------------------------------------------------------------------ #
+    def recent(self, window: float) -> List[str]:
+        """Clients seen in the last `window` seconds, most recent first."""
+        self.expire()
+        cutoff = time.time() - window
+        with self._lock:
+            out = []
+            for client_id in reversed(self._seen):
+                if self._seen[client_id] < cutoff:
+                    break
+                out.append(client_id)
+            return out
+
+    def last_seen(self) -> Dict[str, float]:
+        with self._lock:
+            return dict(self._seen)
+
+    def __contains__(self, client_id: str) -> bool:
+        return client_id in self._seen
+
+    def __len__(self) -> int:
+        return len(self._seen)
+
+    def stats(self) -> dict:
+        return {"tracked": len(self._seen), "capacity": self.capacity,
+                "idleSeconds": self.idle_seconds, "expired": self._expired, "rejected": self._rejected}
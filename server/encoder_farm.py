@@ -0,0 +1,336 @@
+"""
+Encoding farm (ENCODER_PROCESSES > 0): recordings run in a pool of encoder
+processes instead of the web worker, so concurrent encodes use every core
+rather than sharing one interpreter.
+
+Each encoder process is started with `python -m server.encoder_farm` and
+owns a RecordingManager of its own. The web worker keeps a
+FarmRecordingManager, a thin client with the RecordingManager interface:
+a new recording goes to the process with the least work (sum of the fps of
+its active recordings), and uploaded JPEGs are copied into a ring of slots
+in a SharedMemory block shared with that process; only (client, slot,
+length, capture time) goes over the control socket. A frame that finds no
+free slot is dropped, like a full recorder queue would drop it.
+
+Finished recordings are uploaded by the encoder process through the same
+durable upload queue, so its jobs survive a restart as before.
+"""
+import atexit
+import itertools
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing import resource_tracker
+from multiprocessing.connection import Connection
+from multiprocessing.shared_memory import SharedMemory
+from typing import Dict, Optional
+
+from .recording import RecordingManager, RemoteRecording
+
+# Encoder processes; 0 = encode in the web worker, -1 = one per core
+ENCODER_PROCESSES = int(os.environ.get("ENCODER_PROCESSES", 0))
+if ENCODER_PROCESSES < 0:
+    ENCODER_PROCESSES = os.cpu_count() or 1
+# Frames in flight per encoder process, and the largest JPEG a slot holds
+# (bigger ones are sent over the socket instead)
+ENCODER_SLOTS = int(os.environ.get("ENCODER_SLOTS", 64))
+ENCODER_SLOT_BYTES = int(os.environ.get("ENCODER_SLOT_BYTES", 1024 * 1024))
+STATS_INTERVAL = 1.0  # encoder processes push recorder stats this often
+STOP_TIMEOUT = 60.0
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+class EncoderProcess:
+    """
+    Parent side of one encoder process. The shared block starts with one
+    state byte per slot (1 = holds a frame not yet copied out by the
+    encoder), followed by the slots themselves.
+    """
+
+    def __init__(self, index: int, slots: int = ENCODER_SLOTS, slot_bytes: int = ENCODER_SLOT_BYTES):
+        self.index = index
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        self.shm = SharedMemory(create=True, size=slots + slots * slot_bytes)
+        parent_sock, child_sock = socket.socketpair()
+        self.proc = subprocess.Popen(
+            [sys.executable, "-m", "server.encoder_farm", self.shm.name, str(slots), str(slot_bytes),
+             str(child_sock.fileno())],
+            cwd=ROOT, pass_fds=[child_sock.fileno()],
+        )
+        child_sock.close()
+        self.conn = Connection(parent_sock.detach())
+        self.alive = True
+        self.stats: Dict[str, dict] = {}  # client -> Recorder.stats(), as last pushed
+        self.dropped = 0
+        self._next_slot = 0
+        self._slot_lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._waiters: Dict[int, list] = {}  # request id -> [Event, reply]
+        self._ids = itertools.count()
+        threading.Thread(target=self._read_loop, name=f"encoder-{index}-reader", daemon=True).start()
+        print(f"[EncoderFarm] Started encoder process {index} (pid {self.proc.pid})")
+
+    def send(self, msg: tuple):
+        with self._send_lock:
+            try:
+                self.conn.send(msg)
+            except OSError:
+                self.alive = False  # the reader thread reports the exit
+
+    def request(self, msg: tuple, timeout: float = STOP_TIMEOUT):
+        """Send ("op", <request id>, ...) and wait for the reply; None on timeout."""
+        req = next(self._ids)
+        waiter = self._waiters[req] = [threading.Event(), None]
+        try:
+            self.send((msg[0], req) + msg[1:])
+            return waiter[1] if waiter[0].wait(timeout) else None
+        finally:
+            self._waiters.pop(req, None)
+
+    def put_frame(self, client_id: str, data: bytes, ts: float) -> bool:
+        """Hand a JPEG to the process; False if every slot is still in use."""
+        n = len(data)
+        if n > self.slot_bytes:
+            self.send(("frame_bytes", client_id, bytes(data), ts))
+            return True
+        buf = self.shm.buf
+        with self._slot_lock:
+            for _ in range(self.slots):
+                slot = self._next_slot
+                self._next_slot = (slot + 1) % self.slots
+                if buf[slot] == 0:
+                    buf[slot] = 1
+                    break
+            else:
+                self.dropped += 1
+                return False
+        offset = self.slots + slot * self.slot_bytes
+        buf[offset:offset + n] = data
+        self.send(("frame", client_id, slot, n, ts))
+        return True
+
+    def slots_free(self) -> int:
+        return self.slots - sum(self.shm.buf[:self.slots])
+
+    def _read_loop(self):
+        while True:
+            try:
+                msg = self.conn.recv()
+            except (EOFError, OSError):
+                break
+            if msg[0] == "stats":
+                self.stats = msg[1]
+            elif msg[0] == "done":
+                _, req, self.stats, reply = msg
+                waiter = self._waiters.get(req)
+                if waiter is not None:
+                    waiter[1] = reply
+                    waiter[0].set()
+        self.alive = False
+        for waiter in list(self._waiters.values()):
+            waiter[0].set()
+        print(f"[EncoderFarm] Encoder process {self.index} exited ({self.proc.poll()})")
+
+    def close(self):
+        """Closing the socket makes the process finish its recordings and exit."""
+        try:
+            self.conn.close()
+        except OSError:
+            pass
+        self.shm.close()
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class FarmRecordingManager:
+    """
+    RecordingManager interface over an encoder process pool. Processes are
+    started with the first recording, and a process that died is replaced
+    at the next start.
+    """
+
+    def __init__(self, processes: int = ENCODER_PROCESSES):
+        self.size = max(1, processes)
+        self._procs = []
+        self._by_client: Dict[str, tuple] = {}  # client -> (EncoderProcess, fps, started at)
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+
+    def _process_load(self, proc: EncoderProcess) -> float:
+        return sum(fps for cid, (p, fps, _) in list(self._by_client.items())
+                   if p is proc and self.is_active(cid))
+
+    def _pick(self) -> EncoderProcess:
+        for dead in [p for p in self._procs if not p.alive]:
+            dead.close()
+        self._procs = [p for p in self._procs if p.alive]
+        while len(self._procs) < self.size:
+            self._procs.append(EncoderProcess(len(self._procs)))
+        return min(self._procs, key=self._process_load)
+
+    # ------------------------------------------------------------------ #
+    def start(self, client_id: str, fps: int = 10, max_seconds: Optional[int] = None, **options):
+        with self._lock:
+            if self.is_active(client_id):
+                print(f"[RecordingManager] {client_id} already active.")
+                return
+            proc = self._pick()
+            proc.stats.pop(client_id, None)  # an earlier recording's figures
+            self._by_client[client_id] = (proc, fps, time.time())
+            proc.send(("start", client_id, dict(fps=fps, max_seconds=max_seconds, **options)))
+
+    def add_frame(self, client_id: str, frame, ts: Optional[float] = None):
+        entry = self._by_client.get(client_id)
+        if entry is None or not self.is_active(client_id):
+            return
+        if not isinstance(frame, (bytes, bytearray, memoryview)):
+            import cv2  # a BGR array; the encoder processes take JPEGs
+
+            frame = cv2.imencode(".jpg", frame)[1].tobytes()
+        entry[0].put_frame(client_id, frame, ts if ts is not None else time.time())
+
+    def add_repeat(self, client_id: str, ts: Optional[float] = None):
+        entry = self._by_client.get(client_id)
+        if entry is not None and self.is_active(client_id):
+            entry[0].send(("repeat", client_id, ts if ts is not None else time.time()))
+
+    def stop(self, client_id: str):
+        """Stop in the encoder process and wait for its (url, doc_id)."""
+        entry = self._by_client.get(client_id)
+        if entry is None or not entry[0].alive:
+            print(f"[RecordingManager] No recorder found for {client_id}")
+            return None, None
+        result = entry[0].request(("stop", client_id))
+        if self._by_client.get(client_id) is entry:
+            del self._by_client[client_id]
+        if result is None:
+            print(f"[RecordingManager] Encoder process did not confirm stop of {client_id}")
+            return None, None
+        return result
+
+    def forget(self, client_id: str):
+        entry = self._by_client.pop(client_id, None)
+        if entry is not None and entry[0].alive:
+            entry[0].send(("forget", client_id))
+
+    # ------------------------------------------------------------------ #
+    def is_active(self, client_id: str) -> bool:
+        entry = self._by_client.get(client_id)
+        if entry is None or not entry[0].alive:
+            return False
+        stats = entry[0].stats.get(client_id)
+        if stats is None or time.time() - entry[2] < 2 * STATS_INTERVAL:
+            return True  # not reported yet; the process drops frames it has no recorder for
+        return stats["active"]
+
+    def active_recorder(self, client_id: str) -> Optional[RemoteRecording]:
+        if not self.is_active(client_id):
+            return None
+        proc, fps, _ = self._by_client[client_id]
+        stats = proc.stats.get(client_id) or {}
+        fill = stats["queueDepth"] / stats["queueSize"] if stats.get("queueSize") else 0.0
+        return RemoteRecording(fps, fill)
+
+    def is_backlogged(self, client_id: str) -> bool:
+        entry = self._by_client.get(client_id)
+        if entry is None:
+            return False
+        stats = entry[0].stats.get(client_id) or {}
+        return (stats.get("active", False) and stats.get("overflow") == "block"
+                and stats.get("queueDepth", 0) >= stats.get("queueSize", 1)) or entry[0].slots_free() == 0
+
+    def list_clients(self) -> list:
+        return list(self._by_client.keys())
+
+    def stats(self) -> dict:
+        out = {}
+        for proc in list(self._procs):
+            out.update(proc.stats)
+        return out
+
+    def farm_stats(self) -> list:
+        """Per encoder process: pid, load, recordings, free frame slots, frames dropped."""
+        return [{
+            "pid": p.proc.pid,
+            "alive": p.alive,
+            "load": self._process_load(p),
+            "recordings": sum(1 for s in p.stats.values() if s["active"]),
+            "slotsFree": p.slots_free(),
+            "framesDropped": p.dropped,
+        } for p in list(self._procs)]
+
+    def close(self):
+        for proc in self._procs:
+            proc.close()
+
+
+# ====================================================================== #
+def serve(shm_name: str, slots: int, slot_bytes: int, fd: int):
+    """Encoder process main loop: one RecordingManager fed over `fd`."""
+    shm = SharedMemory(name=shm_name)
+    # The web worker owns (and unlinks) the block
+    resource_tracker.unregister(shm._name, "shared_memory")
+    conn = Connection(fd)
+    mgr = RecordingManager()
+    send_lock = threading.Lock()
+
+    def reply(msg: tuple):
+        with send_lock:
+            try:
+                conn.send(msg)
+            except OSError:
+                pass
+
+    def push_stats():
+        while True:
+            time.sleep(STATS_INTERVAL)
+            reply(("stats", mgr.stats()))
+
+    def stop(req: int, client_id: str):
+        result = mgr.stop(client_id)
+        reply(("done", req, mgr.stats(), tuple(result) if result else (None, None)))
+
+    threading.Thread(target=push_stats, name="stats", daemon=True).start()
+    while True:
+        try:
+            msg = conn.recv()
+        except (EOFError, OSError):
+            break
+        op = msg[0]
+        if op == "frame":
+            _, client_id, slot, n, ts = msg
+            offset = slots + slot * slot_bytes
+            data = bytes(shm.buf[offset:offset + n])
+            shm.buf[slot] = 0  # copied out; the slot can be reused
+            mgr.add_frame(client_id, data, ts)
+        elif op == "frame_bytes":
+            mgr.add_frame(msg[1], msg[2], msg[3])
+        elif op == "repeat":
+            mgr.add_repeat(msg[1], msg[2])
+        elif op == "start":
+            try:
+                mgr.start(msg[1], **msg[2])
+            except ValueError as e:
+                print(f"[EncoderFarm] Cannot start {msg[1]}: {e}")
+        elif op == "stop":
+            # Stopping drains the encoder; keep feeding the other recordings meanwhile
+            threading.Thread(target=stop, args=(msg[1], msg[2]), daemon=True).start()
+        elif op == "forget":
+            mgr.forget(msg[1])
+
+    # The web worker went away: close what is still recording so it gets uploaded
+    for client_id in mgr.list_clients():
+        if mgr.is_active(client_id):
+            mgr.stop(client_id)
+    shm.close()
+
+
+if __name__ == "__main__":
+    serve(sys.argv[1], int(sys.argv[2]), int(sys.argv[3]), int(sys.argv[4]))
@@ -1,13 +1,21 @@
-
 import os
-import firebase_admin
-from firebase_admin import credentials, storage, firestore
+import threading
+import time
 from datetime import datetime
-from typing import Dict
+from typing import Callable, Dict, Optional
 
 # ---- configure these ----
 FIREBASE_SERVICE_JSON = os.environ.get("FIREBASE_SERVICE_JSON", "firebase-service-account.json")
 FIREBASE_BUCKET = os.environ.get("FIREBASE_BUCKET", "auth-view-f0237.firebasestorage.app")
+# "firebase" (default) or "local": file-backed stand-ins from local_backend.py
+FIREBASE_BACKEND = os.environ.get("FIREBASE_BACKEND", "firebase")
+LOCAL_STORAGE_DIR = os.environ.get("LOCAL_STORAGE_DIR", os.path.join(os.path.dirname(__file__), "..", "local_storage"))
+# Files larger than this upload in parts of this size (multiple of 256 KiB)
+UPLOAD_CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_SIZE", 8 * 1024 * 1024))
+COMPOSE_MAX_SOURCES = 32  # Cloud Storage limit per compose call
+# Seconds after startup before the clients are created in the background
+# (see warm_up); negative = only on first use
+FIREBASE_WARMUP_DELAY = float(os.environ.get("FIREBASE_WARMUP_DELAY", 1.0))
 
 
 # -------------------------
@@ -15,39 +23,170 @@ FIREBASE_BUCKET = os.environ.get("FIREBASE_BUCKET", "auth-view-f0237.firebasesto
 _app = None
 _db = None
 _bucket = None
+_init_lock = threading.Lock()
 
 def init_firebase():
     global _app, _db, _bucket
     if _app:
         return
-    cred = credentials.Certificate(FIREBASE_SERVICE_JSON)
-    _app = firebase_admin.initialize_app(cred, {"storageBucket": FIREBASE_BUCKET})
-    _db = firestore.client()
-    _bucket = storage.bucket()
+    with _init_lock:
+        if _app:
+            return
+        # firebase_admin and the google-cloud clients take longer to import
+        # than the rest of the server; only recordings need them.
+        import firebase_admin
+        from firebase_admin import credentials, storage, firestore
+
+        cred = credentials.Certificate(FIREBASE_SERVICE_JSON)
+        app = firebase_admin.initialize_app(cred, {"storageBucket": FIREBASE_BUCKET})
+        _db = firestore.client()
+        _bucket = storage.bucket()
+        _app = app
+
+def warm_up(delay: float = FIREBASE_WARMUP_DELAY):
+    """
+    Create the storage and Firestore clients on a background thread,
+    `delay` seconds from now, so the first recording does not pay for it
+    and the worker starts serving first.
+    """
+    if delay < 0:
+        return
+
+    def _run():
+        time.sleep(delay)
+        start = time.time()
+        try:
+            get_bucket()
+            get_db()
+            print(f"[Firebase] Clients ready in {time.time() - start:.2f}s")
+        except Exception as e:
+            print(f"[Firebase] Warm-up failed (will retry on first use): {e}")
+
+    threading.Thread(target=_run, name="firebase-warmup", daemon=True).start()
 
 def get_db():
+    global _db
+    if FIREBASE_BACKEND == "local":
+        if _db is None:
+            from .local_backend import LocalFirestore
+            _db = LocalFirestore()
+        return _db
     init_firebase()
     return _db
 
 def get_bucket():
+    global _bucket
+    if FIREBASE_BACKEND == "local":
+        if _bucket is None:
+            from .local_backend import LocalBucket
+            _bucket = LocalBucket(LOCAL_STORAGE_DIR)
+        return _bucket
     init_firebase()
     return _bucket
 
-def upload_file(local_path: str, dest_path: str) -> str:
+def upload_file(local_path: str, dest_path: str, content_type: str = "video/mp4",
+                chunk_size: int = UPLOAD_CHUNK_SIZE,
+                progress: Optional[Callable[[int, int], None]] = None) -> str:
     """
     Uploads a file to Cloud Storage and returns a signed URL (long-lived).
+    Files over `chunk_size` go up as parts that are composed into `dest_path`
+    (see ChunkedUpload), so a dropped connection only re-sends one part.
+    `progress(bytes_done, total_bytes)` is called as data goes up.
     """
+    total = os.path.getsize(local_path)
+    if total > chunk_size:
+        upload = ChunkedUpload(dest_path, content_type=content_type, chunk_size=chunk_size, progress=progress)
+        return upload.upload(local_path)
+
     bucket = get_bucket()
     blob = bucket.blob(dest_path)
-    blob.upload_from_filename(local_path, content_type="video/mp4")
+    blob.upload_from_filename(local_path, content_type=content_type)
+    if progress:
+        progress(total, total)
     # Make public or use signed URL—choose one:
     blob.make_public()
     return blob.public_url  # or blob.generate_signed_url(datetime.utcnow()+timedelta(days=7))
 
-def save_record_metadata(data: Dict) -> str:
+
+class ChunkedUpload:
+    """
+    Resumable upload of one file as fixed-size parts.
+
+    Each part is stored as `<dest>.parts/NNNNN` and the parts are composed
+    into `dest` once all are up. A part already present in the bucket with
+    the expected size is skipped, so retrying (even from a new process)
+    resumes where the previous attempt stopped.
+    """
+
+    def __init__(self, dest_path: str, content_type: str = "application/octet-stream",
+                 chunk_size: int = UPLOAD_CHUNK_SIZE,
+                 progress: Optional[Callable[[int, int], None]] = None):
+        self.dest_path = dest_path
+        self.content_type = content_type
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.bytes_uploaded = 0
+        self.bytes_total = 0
+        self._bucket = get_bucket()
+        self._parts = []
+
+    def _part_name(self, index: int) -> str:
+        return f"{self.dest_path}.parts/{index:05d}"
+
+    def upload(self, local_path: str) -> str:
+        """Upload `local_path` part by part, compose it and return its URL."""
+        size = os.path.getsize(local_path)
+        self.bytes_total = size
+        with open(local_path, "rb") as f:
+            offset = 0
+            while offset < size:
+                n = min(self.chunk_size, size - offset)
+                self._upload_part(f, n)
+                offset += n
+        return self._compose()
+
+    def _upload_part(self, f, n: int):
+        name = self._part_name(len(self._parts))
+        existing = self._bucket.get_blob(name)
+        if existing is not None and existing.size == n:
+            f.seek(n, os.SEEK_CUR)
+            part = existing
+        else:
+            part = self._bucket.blob(name)
+            part.upload_from_file(f, size=n, content_type=self.content_type)
+        self._parts.append(part)
+        self.bytes_uploaded += n
+        if self.progress:
+            self.progress(self.bytes_uploaded, self.bytes_total)
+
+    def _compose(self) -> str:
+        if not self._parts:
+            raise ValueError(f"ChunkedUpload {self.dest_path}: empty file")
+        dest = self._bucket.blob(self.dest_path)
+        dest.content_type = self.content_type
+        # Compose accepts at most 32 sources: fold the parts in batches
+        pending = list(self._parts)
+        dest.compose(pending[:COMPOSE_MAX_SOURCES])
+        pending = pending[COMPOSE_MAX_SOURCES:]
+        while pending:
+            dest.compose([dest] + pending[:COMPOSE_MAX_SOURCES - 1])
+            pending = pending[COMPOSE_MAX_SOURCES - 1:]
+        for part in self._parts:
+            try:
+                part.delete()
+            except Exception:
+                pass
+        dest.make_public()
+        return dest.public_url
+
+def save_record_metadata(data: Dict, collection: str = "recordings") -> str:
     """
-    Writes a Firestore document under 'recordings'.
+    Writes a Firestore document under 'recordings' (or `collection`).
     """
     db = get_db()
-    doc_ref = db.collection("recordings").add(data)[1]  # add returns (update, ref)
+    doc_ref = db.collection(collection).add(data)[1]  # add returns (update, ref)
+    if collection == "recordings":
+        # Write through so /recordings sees it without a Firestore round trip
+        from .recordings_index import recordings_index
+        recordings_index.put(doc_ref.id, data)
     return doc_ref.id
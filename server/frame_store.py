@@ -0,0 +1,229 @@
+import threading
+from collections import deque
+from typing import Dict, Optional, Tuple
+
+from .clients import ClientRegistry
+from .stats import STAGE_SECONDS
+
+PREVIEW_JPEG_QUALITY = 85
+# Preview sizes viewers can ask for (?size=): largest width, 0 = as uploaded
+PREVIEW_SIZES = {"thumb": 160, "medium": 480, "full": 0}
+DEFAULT_PREVIEW_SIZE = "full"
+
+
+def is_jpeg(data: bytes) -> bool:
+    """Cheap sanity check on an upload without decoding it (SOI marker)."""
+    return len(data) > 4 and data[:2] == b"\xff\xd8"
+
+
+def jpeg_dimensions(data: bytes) -> Optional[Tuple[int, int]]:
+    """(width, height) from a JPEG's SOF header, without decoding it."""
+    i, n = 2, len(data)
+    while i + 9 < n:
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:  # fill byte
+            i += 1
+            continue
+        length = (data[i + 2] << 8) | data[i + 3]
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            h = (data[i + 5] << 8) | data[i + 6]
+            w = (data[i + 7] << 8) | data[i + 8]
+            return w, h
+        i += 2 + length
+    return None
+
+
+class Frame:
+    """
+    One received frame: the JPEG bytes exactly as uploaded, plus grayscale
+    previews (one per PREVIEW_SIZES entry) that are only built the first time
+    a viewer asks for that size and are then shared by every later viewer.
+    """
+
+    __slots__ = ("data", "timestamp", "frame_number", "capture_ts", "_previews", "_lock")
+
+    def __init__(self, data: bytes, timestamp: float, frame_number: int, capture_ts: Optional[float] = None):
+        self.data = data
+        self.timestamp = timestamp
+        self.frame_number = frame_number
+        self.capture_ts = capture_ts  # client clock, if the client sent it
+        self._previews: Dict[str, Optional[bytes]] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def original_size(self) -> int:
+        return len(self.data)
+
+    def preview(self, size: str = DEFAULT_PREVIEW_SIZE) -> Optional[bytes]:
+        """Grayscale preview JPEG no wider than PREVIEW_SIZES[size], transcoded once per frame and size."""
+        if size in self._previews:
+            return self._previews[size]
+        with self._lock:
+            if size not in self._previews:
+                self._previews[size] = self._build_preview(PREVIEW_SIZES[size])
+            return self._previews[size]
+
+    def _build_preview(self, max_width: int) -> Optional[bytes]:
+        import cv2  # first viewer pays for it, not worker start
+        import numpy as np
+
+        # libjpeg can decode at 1/2, 1/4 or 1/8 scale, skipping most of the
+        # IDCT work; use the smallest scale that is still at least max_width
+        flag = cv2.IMREAD_GRAYSCALE
+        dims = jpeg_dimensions(self.data) if max_width else None
+        if dims:
+            for factor, reduced in ((8, cv2.IMREAD_REDUCED_GRAYSCALE_8), (4, cv2.IMREAD_REDUCED_GRAYSCALE_4),
+                                    (2, cv2.IMREAD_REDUCED_GRAYSCALE_2)):
+                if dims[0] // factor >= max_width:
+                    flag = reduced
+                    break
+        with STAGE_SECONDS.time(stage="preview_decode"):
+            gray = cv2.imdecode(np.frombuffer(self.data, np.uint8), flag)
+        if gray is None:
+            return None
+        h, w = gray.shape[:2]
+        if max_width and w > max_width:
+            gray = cv2.resize(gray, (max_width, max(1, h * max_width // w)), interpolation=cv2.INTER_AREA)
+        with STAGE_SECONDS.time(stage="preview_encode"):
+            ok, buffer = cv2.imencode(".jpg", gray, [cv2.IMWRITE_JPEG_QUALITY, PREVIEW_JPEG_QUALITY])
+        return buffer.tobytes() if ok else None
+
+
+class FrameStore:
+    """
+    Per-client ring buffers of recently received frames.
+    Each client keeps at most `max_frames` entries, so memory grows with the
+    number of cameras rather than with traffic. Lookups are dict hits.
+    Process-local; see shared_frames.SharedFrameStore for several workers.
+    A client's buffer is dropped once `registry` expires the client.
+    """
+
+    def __init__(self, max_frames: int = 50, registry: Optional[ClientRegistry] = None):
+        self.max_frames = max_frames
+        self._frames: Dict[str, deque] = {}
+        self._totals: Dict[str, Dict[str, int]] = {}
+        self._conds: Dict[str, threading.Condition] = {}
+        self._last_client: Optional[str] = None
+        self._frame_count = 0
+        self._lock = threading.Lock()
+        self.registry = registry or ClientRegistry()
+        self.registry.on_expire(self.remove)
+
+    def _condition(self, client_id: str) -> threading.Condition:
+        with self._lock:
+            cond = self._conds.get(client_id)
+            if cond is None:
+                cond = self._conds[client_id] = threading.Condition()
+            return cond
+
+    # ------------------------------------------------------------------ #
+    def next_frame_number(self) -> int:
+        """Unique, increasing frame number (stream viewers rely on it)."""
+        with self._lock:
+            self._frame_count += 1
+            return self._frame_count
+
+    def total_frames(self) -> int:
+        return self._frame_count
+
+    def touch(self, client_id: str):
+        """Record that the client uploaded something (even if not stored); may raise RegistryFull."""
+        self.registry.touch(client_id)
+
+    def last_seen(self) -> Dict[str, float]:
+        return self.registry.last_seen()
+
+    def recent(self, window: float) -> list:
+        """Clients that uploaded in the last `window` seconds."""
+        return self.registry.recent(window)
+
+    def add(self, client_id: str, frame: Frame):
+        """Append a frame to the client's ring buffer (oldest entry falls off)."""
+        with self._lock:
+            buf = self._frames.get(client_id)
+            if buf is None:
+                buf = self._frames[client_id] = deque(maxlen=self.max_frames)
+                self._totals[client_id] = {"frames": 0, "bytes": 0}
+            buf.append(frame)
+            totals = self._totals[client_id]
+            totals["frames"] += 1
+            totals["bytes"] += frame.original_size
+            self._last_client = client_id
+            cond = self._conds.get(client_id)
+
+        # Wake any stream viewers following this client
+        if cond is not None:
+            with cond:
+                cond.notify_all()
+
+    def latest(self, client_id: Optional[str] = None) -> Optional[Frame]:
+        """Most recent frame for `client_id`, or for whichever client posted last."""
+        with self._lock:
+            if client_id is None:
+                client_id = self._last_client
+            buf = self._frames.get(client_id) if client_id is not None else None
+            return buf[-1] if buf else None
+
+    def wait_for_frame(self, client_id: str, after_number: int, timeout: float) -> Optional[Frame]:
+        """
+        Block until `client_id` has a frame newer than `after_number`.
+        All viewers of a client wait on one condition, so a new frame is
+        fanned out to every stream at once. Returns None on timeout.
+        """
+        cond = self._condition(client_id)
+        with cond:
+            frame = self.latest(client_id)
+            if frame is None or frame.frame_number <= after_number:
+                cond.wait(timeout)
+                frame = self.latest(client_id)
+        if frame is None:
+            self._drop_condition(client_id, cond)
+            return None
+        if frame.frame_number <= after_number:
+            return None
+        return frame
+
+    def _drop_condition(self, client_id: str, cond: threading.Condition):
+        """Forget the condition of a client with no frames (an unknown or expired one)."""
+        with self._lock:
+            if self._conds.get(client_id) is cond and client_id not in self._frames:
+                del self._conds[client_id]
+
+    def clients(self) -> list:
+        with self._lock:
+            return list(self._frames.keys())
+
+    def remove(self, client_id: str):
+        """Drop the client's buffer (stream viewers just stop getting frames)."""
+        with self._lock:
+            self._frames.pop(client_id, None)
+            self._totals.pop(client_id, None)
+            self._conds.pop(client_id, None)
+            if self._last_client == client_id:
+                self._last_client = None
+
+    # ------------------------------------------------------------------ #
+    def stats(self) -> dict:
+        """Stored-frame figures overall and per client."""
+        with self._lock:
+            per_client = {}
+            stored = 0
+            stored_bytes = 0
+            for cid, buf in self._frames.items():
+                buf_bytes = sum(f.original_size for f in buf)
+                totals = self._totals[cid]
+                per_client[cid] = {
+                    "total_frames": totals["frames"],
+                    "total_bytes": totals["bytes"],
+                    "frames_stored": len(buf),
+                    "avg_frame_size": buf_bytes / len(buf) if buf else 0,
+                }
+                stored += len(buf)
+                stored_bytes += buf_bytes
+            return {
+                "frames_stored": stored,
+                "avg_frame_size": stored_bytes / stored if stored else 0,
+                "clients": per_client,
+            }
@@ -0,0 +1,78 @@
+"""
+Length-prefixed frame framing for /upload/stream.
+
+Each frame on the wire is a 12-byte header -- JPEG length (uint32) and
+capture time in epoch milliseconds (uint64, 0 = unknown), both big-endian --
+followed by the JPEG bytes. A client keeps one chunked POST open and writes
+frames back to back; there is no per-frame multipart encoding or response.
+"""
+import struct
+from typing import Iterator, List, Optional, Tuple
+
+FRAME_HEADER = struct.Struct(">IQ")
+MAX_FRAME_BYTES = 16 * 1024 * 1024
+
+
+class FramingError(ValueError):
+    pass
+
+
+def pack_frame(jpeg: bytes, capture_ts: Optional[float] = None) -> bytes:
+    """Header + payload for one frame; `capture_ts` in epoch seconds."""
+    return FRAME_HEADER.pack(len(jpeg), int(capture_ts * 1000) if capture_ts else 0) + jpeg
+
+
+def _unpack_header(header: bytes) -> Tuple[int, Optional[float]]:
+    length, ts_ms = FRAME_HEADER.unpack(header)
+    if length == 0 or length > MAX_FRAME_BYTES:
+        raise FramingError(f"bad frame length {length}")
+    return length, (ts_ms / 1000 if ts_ms else None)
+
+
+def _read_exact(stream, n: int) -> bytes:
+    buf = b""
+    while len(buf) < n:
+        chunk = stream.read(n - len(buf))
+        if not chunk:
+            break
+        buf += chunk
+    return buf
+
+
+def read_frames(stream) -> Iterator[Tuple[bytes, Optional[float]]]:
+    """Yield (jpeg, capture_ts) from a blocking file-like body until EOF."""
+    while True:
+        header = _read_exact(stream, FRAME_HEADER.size)
+        if not header:
+            return
+        if len(header) < FRAME_HEADER.size:
+            raise FramingError("truncated frame header")
+        length, capture_ts = _unpack_header(header)
+        payload = _read_exact(stream, length)
+        if len(payload) < length:
+            raise FramingError("truncated frame")
+        yield payload, capture_ts
+
+
+class FrameDecoder:
+    """Incremental decoder for bodies that arrive in arbitrary chunks (ASGI)."""
+
+    def __init__(self):
+        self._buf = bytearray()
+
+    def feed(self, data: bytes) -> List[Tuple[bytes, Optional[float]]]:
+        self._buf += data
+        frames = []
+        while len(self._buf) >= FRAME_HEADER.size:
+            length, capture_ts = _unpack_header(bytes(self._buf[:FRAME_HEADER.size]))
+            end = FRAME_HEADER.size + length
+            if len(self._buf) < end:
+                break
+            frames.append((bytes(self._buf[FRAME_HEADER.size:end]), capture_ts))
+            del self._buf[:end]
+        return frames
+
+    def close(self):
+        """Call at end of body; raises if a partial frame is left over."""
+        if self._buf:
+            raise FramingError("truncated frame")
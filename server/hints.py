@@ -0,0 +1,93 @@
+import os
+import threading
+import time
+from typing import Dict
+
+# Upload hints: every /upload response tells the camera how to send next
+HINT_IDLE_INTERVAL_MS = int(os.environ.get("HINT_IDLE_INTERVAL_MS", 2000))
+HINT_WATCHED_INTERVAL_MS = int(os.environ.get("HINT_WATCHED_INTERVAL_MS", 100))
+HINT_CLIENT_MAX_BPS = int(os.environ.get("HINT_CLIENT_MAX_BPS", 4 * 1024 * 1024))
+# A viewer counts as watching for this long after its last request / frame
+HINT_WATCH_WINDOW = 10.0
+MIN_QUALITY = 40
+
+# maxWidth 0 = send at camera resolution
+_TIERS = {
+    "recorded": {"maxWidth": 0, "quality": 85},
+    "watched": {"maxWidth": 1280, "quality": 75},
+    "idle": {"maxWidth": 640, "quality": 60},
+}
+
+
+class ClientHints:
+    """
+    Decides the upload hint for each camera from what the server sees:
+    recorded cameras are asked for the recorder's frame rate at full size,
+    watched ones for a live-preview rate, idle ones for a trickle. A filling
+    encoder queue or a loaded ingest pool stretches the interval, and a
+    client over its bandwidth share gets lower quality (and, unless it is
+    being recorded, a smaller frame).
+    """
+
+    def __init__(self, rec_mgr):
+        self.rec_mgr = rec_mgr
+        self._viewed: Dict[str, float] = {}
+        self._rates: Dict[str, list] = {}  # client -> [window start, bytes so far, last bytes/s]
+        self._lock = threading.Lock()
+
+    def viewed(self, client_id: str):
+        """A dashboard fetched this client's frames."""
+        self._viewed[client_id] = time.time()
+
+    def forget(self, client_id: str):
+        with self._lock:
+            self._viewed.pop(client_id, None)
+            self._rates.pop(client_id, None)
+
+    def observe(self, client_id: str, nbytes: int):
+        """Account an uploaded frame towards the client's measured bandwidth."""
+        now = time.time()
+        with self._lock:
+            rate = self._rates.get(client_id)
+            if rate is None:
+                rate = self._rates[client_id] = [now, 0, 0.0]
+            rate[1] += nbytes
+            if now - rate[0] >= 1.0:  # one-second windows
+                rate[2] = rate[1] / (now - rate[0])
+                rate[0], rate[1] = now, 0
+
+    def bandwidth(self, client_id: str) -> float:
+        rate = self._rates.get(client_id)
+        return rate[2] if rate else 0.0
+
+    # ------------------------------------------------------------------ #
+    def hint(self, client_id: str, load: float = 0.0) -> dict:
+        """
+        {"mode", "intervalMs", "maxWidth", "quality"} for the client's next
+        uploads. `load` is the ingest server's pool usage (0..1), if known.
+        """
+        rec = self.rec_mgr.active_recorder(client_id)
+        if rec is not None:
+            mode = "recorded"
+            interval = 1000.0 / rec.fps
+            fill = rec.queue_fill
+            if fill > 0.9:
+                interval *= 4
+            elif fill > 0.5:
+                interval *= 2
+        elif time.time() - self._viewed.get(client_id, 0.0) < HINT_WATCH_WINDOW:
+            mode = "watched"
+            interval = HINT_WATCHED_INTERVAL_MS
+        else:
+            mode = "idle"
+            interval = HINT_IDLE_INTERVAL_MS
+        if load > 0.5 and mode != "recorded":
+            interval *= 2
+
+        max_width = _TIERS[mode]["maxWidth"]
+        quality = _TIERS[mode]["quality"]
+        if self.bandwidth(client_id) > HINT_CLIENT_MAX_BPS:
+            quality = max(MIN_QUALITY, quality - 20)
+            if mode != "recorded":  # a recording keeps its frame size
+                max_width //= 2
+        return {"mode": mode, "intervalMs": int(round(interval)), "maxWidth": max_width, "quality": quality}
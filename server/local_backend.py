@@ -0,0 +1,210 @@
+"""
+Local stand-ins for the Firebase clients, selected with FIREBASE_BACKEND=local.
+They implement just the parts of the google-cloud-storage and Firestore APIs
+that firebase_service uses -- storage backed by plain files, Firestore kept
+in memory -- so uploads and listings can be exercised (and benchmarked)
+without credentials or network.
+"""
+import os
+import shutil
+import threading
+import uuid
+from datetime import datetime, timezone
+from typing import Optional
+
+
+class LocalBlob:
+    """File-backed equivalent of google.cloud.storage.Blob."""
+
+    def __init__(self, bucket: "LocalBucket", name: str, chunk_size: Optional[int] = None):
+        self.bucket = bucket
+        self.name = name
+        self.chunk_size = chunk_size
+        self.content_type: Optional[str] = None
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.bucket.root, *self.name.split("/"))
+
+    @property
+    def size(self) -> Optional[int]:
+        return os.path.getsize(self.path) if os.path.exists(self.path) else None
+
+    @property
+    def public_url(self) -> str:
+        return f"{self.bucket.base_url}/{self.name}"
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def reload(self):
+        pass
+
+    def _write_from(self, src, size: Optional[int]):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = f"{self.path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as dst:
+            if size is None:
+                shutil.copyfileobj(src, dst)
+            else:
+                remaining = size
+                while remaining > 0:
+                    buf = src.read(min(remaining, 1 << 20))
+                    if not buf:
+                        break
+                    dst.write(buf)
+                    remaining -= len(buf)
+        os.replace(tmp, self.path)
+        self.bucket.uploads += 1
+
+    def upload_from_filename(self, filename: str, content_type: Optional[str] = None, **kwargs):
+        self.content_type = content_type
+        with open(filename, "rb") as src:
+            self._write_from(src, None)
+
+    def upload_from_file(self, file_obj, rewind: bool = False, size: Optional[int] = None,
+                         content_type: Optional[str] = None, **kwargs):
+        if rewind:
+            file_obj.seek(0)
+        self.content_type = content_type
+        self._write_from(file_obj, size)
+
+    def compose(self, sources, **kwargs):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = f"{self.path}.{threading.get_ident()}.compose"
+        with open(tmp, "wb") as dst:
+            for blob in sources:
+                with open(blob.path, "rb") as src:
+                    shutil.copyfileobj(src, dst)
+        os.replace(tmp, self.path)
+
+    def delete(self, **kwargs):
+        os.remove(self.path)
+        try:
+            os.rmdir(os.path.dirname(self.path))  # drop emptied "<dest>.parts/" dirs
+        except OSError:
+            pass
+
+    def make_public(self, **kwargs):
+        pass
+
+
+class LocalBucket:
+    """Directory-backed equivalent of google.cloud.storage.Bucket."""
+
+    def __init__(self, root: str, base_url: Optional[str] = None):
+        self.root = os.path.abspath(root)
+        self.base_url = base_url or f"file://{self.root}"
+        self.uploads = 0  # upload calls served, handy for tests / benchmarks
+        os.makedirs(self.root, exist_ok=True)
+
+    def blob(self, blob_name: str, chunk_size: Optional[int] = None, **kwargs) -> LocalBlob:
+        return LocalBlob(self, blob_name, chunk_size=chunk_size)
+
+    def get_blob(self, blob_name: str, **kwargs) -> Optional[LocalBlob]:
+        blob = LocalBlob(self, blob_name)
+        return blob if blob.exists() else None
+
+    def list_blobs(self, prefix: str = "", **kwargs):
+        for dirpath, _, filenames in os.walk(self.root):
+            for fn in filenames:
+                name = os.path.relpath(os.path.join(dirpath, fn), self.root).replace(os.sep, "/")
+                if name.startswith(prefix) and not name.endswith((".tmp", ".compose")):
+                    yield LocalBlob(self, name)
+
+
+# ---------------------------------------------------------------------- #
+class LocalDocument:
+    """Snapshot returned by LocalQuery.stream() (like DocumentSnapshot)."""
+
+    def __init__(self, doc_id: str, data: dict):
+        self.id = doc_id
+        self._data = data
+
+    def to_dict(self) -> dict:
+        return dict(self._data)
+
+
+def _comparable(value):
+    # Firestore compares timestamps as instants; treat naive datetimes as UTC
+    if isinstance(value, datetime) and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+class LocalQuery:
+    """The subset of google.cloud.firestore.Query we use: where / order_by / limit / stream."""
+
+    _OPS = {
+        "==": lambda a, b: a == b, "<": lambda a, b: a < b, "<=": lambda a, b: a <= b,
+        ">": lambda a, b: a > b, ">=": lambda a, b: a >= b,
+    }
+
+    def __init__(self, collection: "LocalCollection", filters=(), order=None, limit=None):
+        self._collection = collection
+        self._filters = list(filters)
+        self._order = order
+        self._limit = limit
+
+    def where(self, field_path: str, op_string: str, value) -> "LocalQuery":
+        return LocalQuery(self._collection, self._filters + [(field_path, self._OPS[op_string], value)],
+                          self._order, self._limit)
+
+    def order_by(self, field_path: str, direction: str = "ASCENDING") -> "LocalQuery":
+        return LocalQuery(self._collection, self._filters, (field_path, direction), self._limit)
+
+    def limit(self, count: int) -> "LocalQuery":
+        return LocalQuery(self._collection, self._filters, self._order, count)
+
+    def stream(self):
+        docs = [
+            (doc_id, data) for doc_id, data in self._collection.snapshot()
+            if all(f in data and op(_comparable(data[f]), _comparable(v)) for f, op, v in self._filters)
+        ]
+        if self._order:
+            field, direction = self._order
+            docs = [d for d in docs if field in d[1]]
+            docs.sort(key=lambda d: _comparable(d[1][field]), reverse=direction == "DESCENDING")
+        if self._limit is not None:
+            docs = docs[:self._limit]
+        for doc_id, data in docs:
+            yield LocalDocument(doc_id, data)
+
+
+class LocalDocumentRef:
+    def __init__(self, doc_id: str):
+        self.id = doc_id
+
+
+class LocalCollection(LocalQuery):
+    """In-memory collection; `add` mirrors CollectionReference.add."""
+
+    def __init__(self, name: str):
+        super().__init__(self)
+        self.name = name
+        self._docs = {}
+        self._lock = threading.Lock()
+
+    def add(self, document_data: dict):
+        doc_id = uuid.uuid4().hex[:20]
+        with self._lock:
+            self._docs[doc_id] = dict(document_data)
+        return datetime.utcnow(), LocalDocumentRef(doc_id)
+
+    def snapshot(self):
+        with self._lock:
+            return list(self._docs.items())
+
+
+class LocalFirestore:
+    """Process-local equivalent of the Firestore client (collections only)."""
+
+    def __init__(self):
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    def collection(self, name: str) -> LocalCollection:
+        with self._lock:
+            if name not in self._collections:
+                self._collections[name] = LocalCollection(name)
+            return self._collections[name]
@@ -0,0 +1,98 @@
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+from .stats import STAGE_SECONDS
+
+# Mean absolute luminance difference (0-255) a frame needs, against the last
+# kept frame, to count as changed. 0 disables the detector.
+MOTION_THRESHOLD = float(os.environ.get("MOTION_THRESHOLD", 0))
+# Keep one frame this often even in a still scene, so viewers and the
+# client list never go stale.
+MOTION_KEEPALIVE_SECONDS = float(os.environ.get("MOTION_KEEPALIVE_SECONDS", 5))
+THUMB_SIZE = (64, 48)
+
+
+@STAGE_SECONDS.timed(stage="motion_decode")
+def luma_thumbnail(data: bytes) -> Optional["np.ndarray"]:
+    """Tiny grayscale copy of a JPEG; libjpeg decodes straight to 1/8 scale."""
+    import cv2  # only needed once a threshold is set
+    import numpy as np
+
+    small = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if small is None:
+        return None
+    return cv2.resize(small, THUMB_SIZE, interpolation=cv2.INTER_AREA).astype(np.int16)
+
+
+class MotionDetector:
+    """
+    Per-client change detector. Each upload's thumbnail is compared with
+    that of the last frame kept for the client; frames below the client's
+    threshold are reported unchanged so they are not stored or re-encoded.
+    """
+
+    def __init__(self, threshold: float = MOTION_THRESHOLD, keepalive: float = MOTION_KEEPALIVE_SECONDS):
+        self.default_threshold = threshold
+        self.keepalive = keepalive
+        self._thresholds: Dict[str, float] = {}
+        self._state: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def set_threshold(self, client_id: str, threshold: Optional[float]):
+        """Per-client override; None goes back to the default."""
+        with self._lock:
+            if threshold is None:
+                self._thresholds.pop(client_id, None)
+            else:
+                self._thresholds[client_id] = float(threshold)
+
+    def reset(self, client_id: str):
+        """Forget the reference so the client's next frame is kept."""
+        with self._lock:
+            state = self._state.get(client_id)
+            if state is not None:
+                state["ref"] = None
+
+    def forget(self, client_id: str):
+        """Drop the client's reference and counters (its threshold override stays)."""
+        with self._lock:
+            self._state.pop(client_id, None)
+
+    def threshold(self, client_id: str) -> float:
+        return self._thresholds.get(client_id, self.default_threshold)
+
+    def changed(self, client_id: str, data: bytes) -> bool:
+        """True if the frame should be kept (and becomes the new reference)."""
+        threshold = self.threshold(client_id)
+        with self._lock:
+            state = self._state.setdefault(client_id, {"ref": None, "kept_at": 0.0, "checked": 0, "skipped": 0})
+        if threshold <= 0:
+            return True
+
+        thumb = luma_thumbnail(data)
+        now = time.time()
+        with self._lock:
+            state["checked"] += 1
+            ref = state["ref"]
+            if (thumb is not None and ref is not None and now - state["kept_at"] < self.keepalive
+                    and float(abs(thumb - ref).mean()) < threshold):
+                state["skipped"] += 1
+                return False
+            state["ref"] = thumb
+            state["kept_at"] = now
+            return True
+
+    # ------------------------------------------------------------------ #
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                cid: {
+                    "threshold": self.threshold(cid),
+                    "checked": st["checked"],
+                    "skipped": st["skipped"],
+                    "skipRatio": round(st["skipped"] / st["checked"], 3) if st["checked"] else 0.0,
+                }
+                for cid, st in self._state.items()
+            }
@@ -233,144 +233,558 @@
 
 
 
-import av
+import base64
+import fcntl
+import json
 import os
+import queue
 import threading
 import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from fractions import Fraction
 from typing import Optional, Tuple
-import numpy as np
-import cv2
 
-from .firebase_service import upload_file, save_record_metadata
+from .frame_store import jpeg_dimensions
+from .stats import STAGE_SECONDS
+from .upload_queue import upload_queue
 
-# Directory for temporary MP4 files
-RECORDINGS_DIR = os.path.join(os.path.dirname(__file__), "..", "recordings_tmp")
-os.makedirs(RECORDINGS_DIR, exist_ok=True)
+# Directory for temporary MP4 files (created by the first recording)
+RECORDINGS_DIR = os.environ.get("RECORDINGS_DIR", os.path.join(os.path.dirname(__file__), "..", "recordings_tmp"))
+# Lock + info files naming the worker that records each client (FRAME_STORE=shared)
+RECORDING_OWNERS_DIR = os.path.join(RECORDINGS_DIR, "owners")
+# How long /record/stop on another worker waits for the owner to finish
+REMOTE_STOP_TIMEOUT = 30.0
+
+# Per-recorder frame queue between /upload and the encoder thread
+DEFAULT_QUEUE_SIZE = int(os.environ.get("RECORDER_QUEUE_SIZE", 30))
+# "drop_oldest": a full queue discards its oldest frame; "block": the caller
+# waits up to BLOCK_TIMEOUT seconds for room, then the frame is dropped.
+DEFAULT_OVERFLOW = os.environ.get("RECORDER_OVERFLOW", "drop_oldest")
+OVERFLOW_POLICIES = ("drop_oldest", "block")
+BLOCK_TIMEOUT = 2.0
+
+# Recording formats: "h264" re-encodes to MP4; "mjpeg" muxes the uploaded
+# JPEGs untouched into Matroska (no decode, no encode on the hot path).
+RECORDING_FORMATS = ("h264", "mjpeg")
+DEFAULT_FORMAT = os.environ.get("RECORDING_FORMAT", "h264")
+_CONTAINERS = {"h264": (".mp4", "mp4", "video/mp4"), "mjpeg": (".mkv", "matroska", "video/x-matroska")}
+
+# Optional MJPEG -> H.264 transcodes run here after a recording stops
+TRANSCODE_WORKERS = int(os.environ.get("TRANSCODE_WORKERS", 2))
+_transcode_pool = ThreadPoolExecutor(max_workers=TRANSCODE_WORKERS, thread_name_prefix="transcode")
+
+# Recording timestamps: "vfr" keeps each frame's capture time as its PTS;
+# "cfr" resamples to exactly `fps` by dropping/duplicating frames.
+TIMING_MODES = ("vfr", "cfr")
+DEFAULT_TIMING = os.environ.get("RECORDING_TIMING", "vfr")
+MAX_DUPLICATE_SECONDS = 5  # longest gap "cfr" fills with repeats
+
+# Rotate to a new file every N seconds of footage (0 = one file per recording)
+DEFAULT_SEGMENT_SECONDS = int(os.environ.get("RECORDING_SEGMENT_SECONDS", 0))
+
+# Named x264 settings for "h264" recordings and MJPEG transcodes.
+# threads 0 = FFmpeg picks; gopSeconds 0 = x264's default keyframe interval;
+# maxHeight 0 = keep the camera's resolution, otherwise scale down to it.
+ENCODER_PROFILES = {
+    "default": {"preset": "medium", "tune": None, "crf": 23, "threads": 0, "gopSeconds": 0, "maxHeight": 0},
+    # Many cameras per node: cheapest preset, one thread per recording, capped at 480p
+    "low-cpu": {"preset": "ultrafast", "tune": None, "crf": 26, "threads": 1, "gopSeconds": 4, "maxHeight": 480},
+    # Long-term storage: smallest files for the CPU, 720p, sparse keyframes
+    "archive": {"preset": "slow", "tune": None, "crf": 28, "threads": 0, "gopSeconds": 10, "maxHeight": 720},
+    "high-quality": {"preset": "slower", "tune": "film", "crf": 18, "threads": 0, "gopSeconds": 2, "maxHeight": 0},
+}
+DEFAULT_ENCODER_PROFILE = os.environ.get("RECORDING_PROFILE", "default")
+
+MS_TIME_BASE = Fraction(1, 1000)
+_STOP = object()  # queue sentinel: encoder thread exits after draining
+_REPEAT = object()  # queue item: "same picture as before" at a new capture time
+
+
+def capped_size(w: int, h: int, max_height: int) -> Tuple[int, int]:
+    """(w, h) scaled down to `max_height` (0 = no cap), kept even for 4:2:0."""
+    if not max_height or h <= max_height:
+        return w, h
+    return int(w * max_height / h) // 2 * 2, max_height // 2 * 2
+
+
+def add_h264_stream(container, fps, profile: dict, vfr: bool = False):
+    """
+    Add a libx264 stream configured from an ENCODER_PROFILES entry.
+    `vfr` turns B-frames off: with reordering the muxer's DTS runs behind
+    irregular PTS, and the MP4 duration (taken from the last DTS) comes out
+    short after a gap between frames.
+    """
+    options = {"preset": profile["preset"], "crf": str(profile["crf"])}
+    if profile.get("tune"):
+        options["tune"] = profile["tune"]
+    stream = container.add_stream("libx264", rate=fps, options=options)
+    stream.pix_fmt = "yuv420p"
+    stream.codec_context.thread_count = profile["threads"]
+    if vfr:
+        stream.codec_context.max_b_frames = 0
+    if profile["gopSeconds"]:
+        stream.codec_context.gop_size = max(1, int(round(float(fps) * profile["gopSeconds"])))
+    return stream
+
+
+def transcode_to_h264(src_path: str, dst_path: str, profile: Optional[dict] = None):
+    """Re-encode a recorded file to H.264 MP4, keeping its timestamps."""
+    import av
+
+    profile = profile or ENCODER_PROFILES["default"]
+    with av.open(src_path) as src, av.open(dst_path, mode="w") as dst:
+        in_stream = src.streams.video[0]
+        # The source keeps capture times, so the output is variable-rate too
+        out_stream = add_h264_stream(dst, in_stream.average_rate or 10, profile, vfr=True)
+        w, h = capped_size(in_stream.codec_context.width, in_stream.codec_context.height, profile["maxHeight"])
+        out_stream.width = w
+        out_stream.height = h
+        out_stream.codec_context.time_base = in_stream.time_base
+        for frame in src.decode(in_stream):
+            frame = frame.reformat(width=w, height=h, format="yuv420p")
+            for packet in out_stream.encode(frame):
+                dst.mux(packet)
+        for packet in out_stream.encode():
+            dst.mux(packet)
 
 
 class Recorder:
     """
     Per-client video recorder using PyAV (FFmpeg backend).
-    Encodes to MP4 (H.264) with accurate timestamps and async upload.
+    Encodes to MP4 (H.264), or muxes the uploaded JPEGs as MJPEG in MKV,
+    with accurate timestamps and async upload.
+    Frames are queued by add_frame and encoded on a dedicated thread, so a
+    slow encode never runs inside an /upload request.
     """
 
-    def __init__(self, client_id: str, fps: int = 10, max_seconds: Optional[int] = None):
+    def __init__(self, client_id: str, fps: int = 10, max_seconds: Optional[int] = None,
+                 queue_size: int = DEFAULT_QUEUE_SIZE, overflow: str = DEFAULT_OVERFLOW,
+                 format: str = DEFAULT_FORMAT, transcode: bool = False, timing: str = DEFAULT_TIMING,
+                 segment_seconds: int = DEFAULT_SEGMENT_SECONDS, profile: str = DEFAULT_ENCODER_PROFILE):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"overflow must be one of {OVERFLOW_POLICIES}, got {overflow!r}")
+        if format not in RECORDING_FORMATS:
+            raise ValueError(f"format must be one of {RECORDING_FORMATS}, got {format!r}")
+        if timing not in TIMING_MODES:
+            raise ValueError(f"timing must be one of {TIMING_MODES}, got {timing!r}")
+        if profile not in ENCODER_PROFILES:
+            raise ValueError(f"profile must be one of {tuple(ENCODER_PROFILES)}, got {profile!r}")
         self.client_id = client_id
         self.fps = fps
         self.max_seconds = max_seconds
-        self._container: Optional[av.container.OutputContainer] = None
-        self._stream: Optional[av.video.stream.VideoStream] = None
+        self.overflow = overflow
+        self.format = format
+        # Only meaningful for mjpeg: re-encode to H.264 MP4 before upload
+        self.transcode = transcode and format == "mjpeg"
+        self.timing = timing
+        self.segment_seconds = segment_seconds or 0
+        # x264 settings for h264 (and for the transcode of mjpeg)
+        self.profile = profile
+        self.recording_id = uuid.uuid4().hex
+        self._container: Optional["av.container.OutputContainer"] = None
+        self._stream: Optional["av.video.stream.VideoStream"] = None
         self._path_local: Optional[str] = None
+        self._base_path: Optional[str] = None
         self._frames = 0
+        self._segment_index = 0
+        self._segment_start_pts = 0
+        self._segment_frames = 0
+        self._segments = []  # storage paths of segments handed to the upload queue
+        self._dropped = 0
         self._w = None
         self._h = None
         self._start_ts: Optional[float] = None
+        self._first_ts: Optional[float] = None
+        self._last_pts = -1
+        self._last_slot = -1
+        self._last_payload = None
+        # Reused per frame by the h264 path (see _prepare_bgr)
+        self._frame_pool = []
+        self._pool_index = 0
+        self._bgr_resized = None
+        self._i420 = None
+        self._skipped = 0
+        self._duplicated = 0
+        self._repeated = 0
+        self._held_ts: Optional[float] = None
         self._lock = threading.Lock()
         self._timer: Optional[threading.Timer] = None
         self._active = False
         self._thumbnail_path = None
+        self._queue: queue.Queue = queue.Queue(maxsize=max(1, queue_size))
+        self._worker: Optional[threading.Thread] = None
 
     # ------------------------------------------------------------------ #
     def start(self):
-        """Start recording and optionally schedule auto-stop."""
+        """Start recording, the encoder thread and optionally schedule auto-stop."""
         with self._lock:
             if self._active:
                 print(f"[Recorder] {self.client_id} already recording.")
                 return
             self._active = True
             self._start_ts = time.time()
+            self._worker = threading.Thread(
+                target=self._encode_loop, name=f"encoder-{self.client_id}", daemon=True
+            )
+            self._worker.start()
             print(f"[Recorder] Started recording for {self.client_id}")
             if self.max_seconds and self.max_seconds > 0:
                 self._timer = threading.Timer(self.max_seconds, self.stop_and_upload)
                 self._timer.start()
 
     # ------------------------------------------------------------------ #
-    def add_frame(self, frame_bgr):
-        """Add a frame to the video stream."""
-        with self._lock:
-            if not self._active or frame_bgr is None or not isinstance(frame_bgr, np.ndarray):
+    @STAGE_SECONDS.timed(stage="recorder_enqueue")
+    def add_frame(self, frame, ts: Optional[float] = None):
+        """
+        Queue a frame for encoding. Accepts a BGR ndarray or the uploaded
+        JPEG bytes (decoded on the encoder thread). Never encodes inline.
+        `ts` is the capture time (epoch seconds); arrival time if omitted.
+        """
+        if not self._active or frame is None:
+            return
+        frame = (frame, ts if ts is not None else time.time())
+        if self.overflow == "block":
+            try:
+                self._queue.put(frame, timeout=BLOCK_TIMEOUT)
+            except queue.Full:
+                self._dropped += 1
+            return
+        while True:
+            try:
+                self._queue.put_nowait(frame)
                 return
+            except queue.Full:
+                try:
+                    dropped = self._queue.get_nowait()
+                except queue.Empty:
+                    continue
+                if dropped is _STOP:  # stopped meanwhile; keep the sentinel
+                    self._queue.put(_STOP)
+                    return
+                self._dropped += 1
 
-            # Normalize frame
-            if frame_bgr.ndim == 2:
-                frame_bgr = cv2.cvtColor(frame_bgr, cv2.COLOR_GRAY2BGR)
-            elif frame_bgr.shape[2] == 4:
-                frame_bgr = cv2.cvtColor(frame_bgr, cv2.COLOR_RGBA2BGR)
-
-            h, w = frame_bgr.shape[:2]
-
-            # Lazily initialize writer
-            if self._container is None:
-                self._h, self._w = h, w
-                filename = f"{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}_{self.client_id}_{uuid.uuid4().hex}.mp4"
-                self._path_local = os.path.join(RECORDINGS_DIR, filename)
-
-                # Create PyAV container + stream
-                self._container = av.open(self._path_local, mode="w")
-                self._stream = self._container.add_stream("libx264", rate=self.fps)
-                self._stream.width = w
-                self._stream.height = h
-                self._stream.pix_fmt = "yuv420p"
-                print(f"[Recorder] PyAV writer created: {self._path_local} ({w}x{h}@{self.fps}fps)")
-
-            # Capture thumbnail on first frame
-            if self._frames == 0:
-                thumb_name = os.path.splitext(self._path_local)[0] + "_thumb.jpg"
-                cv2.imwrite(thumb_name, frame_bgr)
-                self._thumbnail_path = thumb_name
-
-            # Convert to RGB (PyAV expects RGB)
-            frame_rgb = cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2RGB)
-            video_frame = av.VideoFrame.from_ndarray(frame_rgb, format="rgb24")
-            for packet in self._stream.encode(video_frame):
+    def add_repeat(self, ts: Optional[float] = None):
+        """
+        The camera sent a frame identical to the last one (see motion.py):
+        keep the timeline moving without decoding or storing a new picture.
+        """
+        self.add_frame(_REPEAT, ts)
+
+    def _encode_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            try:
+                self._encode(item)
+            except Exception as e:
+                print(f"[Recorder] Encode error for {self.client_id}: {e}")
+
+    def _open_container(self, w: int, h: int):
+        import av  # loaded by the first recording, not at worker start
+
+        ext, container_format, _ = _CONTAINERS[self.format]
+        if self.format == "h264":
+            w, h = capped_size(w, h, ENCODER_PROFILES[self.profile]["maxHeight"])
+        self._h, self._w = h, w
+        if self._base_path is None:
+            name = f"{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}_{self.client_id}_{self.recording_id}"
+            os.makedirs(RECORDINGS_DIR, exist_ok=True)
+            self._base_path = os.path.join(RECORDINGS_DIR, name)
+        if self.segment_seconds:
+            self._path_local = f"{self._base_path}_seg{self._segment_index:05d}{ext}"
+        else:
+            self._path_local = self._base_path + ext
+        self._segment_frames = 0
+
+        # Create PyAV container + stream; PTS are in milliseconds of capture time
+        self._container = av.open(self._path_local, mode="w", format=container_format)
+        if self.format == "mjpeg":
+            self._stream = self._container.add_stream("mjpeg", rate=self.fps)
+            self._stream.pix_fmt = "yuvj420p"
+            self._stream.time_base = MS_TIME_BASE
+        else:
+            self._stream = add_h264_stream(self._container, self.fps, ENCODER_PROFILES[self.profile],
+                                           vfr=self.timing != "cfr")
+            self._stream.codec_context.time_base = MS_TIME_BASE
+        self._stream.width = w
+        self._stream.height = h
+        profile = f", {self.profile}" if self.format == "h264" else ""
+        print(f"[Recorder] PyAV writer created: {self._path_local} ({w}x{h}@{self.fps}fps, {self.format}{profile})")
+
+    @STAGE_SECONDS.timed(stage="recorder_encode")
+    def _encode(self, item):
+        """Encode one (frame, capture time) item (encoder thread only)."""
+        frame, ts = item
+        if frame is _REPEAT:
+            if self._last_payload is None:
+                return
+            self._repeated += 1
+            if self.timing != "cfr":
+                # VFR holds the previous picture until the next PTS anyway;
+                # only the end of a still stretch needs writing (at stop).
+                self._held_ts = ts
+                return
+            payload = self._last_payload
+        else:
+            payload = self._prepare_jpeg(frame) if self.format == "mjpeg" else self._prepare_bgr(frame)
+        if payload is None:
+            return
+        if self._first_ts is None:
+            self._first_ts = ts
+        rel_ms = (ts - self._first_ts) * 1000
+
+        if self.timing != "cfr":
+            self._write(payload, int(round(rel_ms)))
+            self._last_payload = payload
+            self._held_ts = None
+            return
+
+        # Constant frame rate: snap to the fps grid, drop frames that land on
+        # an already-filled slot and repeat the previous frame across gaps.
+        slot = int(round(rel_ms * self.fps / 1000))
+        if slot <= self._last_slot:
+            self._skipped += 1
+            return
+        if self._last_payload is not None:
+            missing = min(slot - self._last_slot - 1, self.fps * MAX_DUPLICATE_SECONDS)
+            for s in range(self._last_slot + 1, self._last_slot + 1 + missing):
+                self._write(self._last_payload, self._slot_pts(s))
+                self._duplicated += 1
+        self._write(payload, self._slot_pts(slot))
+        self._last_slot = slot
+        self._last_payload = payload
+
+    def _slot_pts(self, slot: int) -> int:
+        return int(round(slot * 1000 / self.fps))
+
+    def _write(self, payload, pts: int):
+        """Mux/encode one prepared frame at `pts` (ms); PTS must stay strictly increasing."""
+        pts = max(pts, self._last_pts + 1)
+        if self.segment_seconds and self._segment_frames:
+            if pts - self._segment_start_pts >= self.segment_seconds * 1000:
+                self._rotate()
+        if self._segment_frames == 0:
+            self._segment_start_pts = pts
+
+        # Each file's timeline starts at zero
+        file_pts = pts - self._segment_start_pts
+        if self.format == "mjpeg":
+            import av
+
+            packet = av.Packet(payload)
+            packet.stream = self._stream
+            packet.time_base = MS_TIME_BASE
+            packet.pts = packet.dts = file_pts
+            packet.is_keyframe = True
+            self._container.mux(packet)
+        else:
+            payload.pts = file_pts
+            payload.time_base = MS_TIME_BASE
+            for packet in self._stream.encode(payload):
+                self._container.mux(packet)
+        self._last_pts = pts
+        self._frames += 1
+        self._segment_frames += 1
+
+    def _close_container(self):
+        # Flush encoder (MJPEG packets were muxed directly) and close file properly
+        if self.format != "mjpeg":
+            for packet in self._stream.encode():
                 self._container.mux(packet)
+        self._container.close()
+
+    def _rotate(self):
+        """Close the current segment, queue it for upload and start the next one."""
+        self._close_container()
+        self._submit_segment()
+        self._segment_index += 1
+        self._open_container(self._w, self._h)
+
+    def _prepare_jpeg(self, data) -> Optional[bytes]:
+        """The JPEG as-is, ready to mux as one MJPEG packet."""
+        import cv2
+        import numpy as np
+
+        if isinstance(data, np.ndarray):
+            data = cv2.imencode(".jpg", data)[1].tobytes()
+        size = jpeg_dimensions(data)
+        if size is None:
+            return None
+        if self._container is None:
+            self._open_container(*size)
+        if size != (self._w, self._h):
+            # Resolution changed mid-recording: the one case that pays for a transcode
+            img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+            if img is None:
+                return None
+            data = cv2.imencode(".jpg", cv2.resize(img, (self._w, self._h)))[1].tobytes()
+
+        if self._frames == 0:
+            self._thumbnail_path = self._base_path + "_thumb.jpg"
+            with open(self._thumbnail_path, "wb") as f:
+                f.write(data)
+        return data
+
+    def _prepare_bgr(self, frame_bgr) -> Optional["av.VideoFrame"]:
+        """
+        Decode/normalize to a yuv420p VideoFrame of the recording size.
+        Resizing and colour conversion write into buffers allocated once
+        per recording, and the result goes into one of two reused frames
+        (two, so the previous picture stays intact for "cfr" repeats); the
+        JPEG decode is the only per-frame allocation left.
+        """
+        import av
+        import cv2
+        import numpy as np
+
+        if isinstance(frame_bgr, (bytes, bytearray)):
+            frame_bgr = cv2.imdecode(np.frombuffer(frame_bgr, np.uint8), cv2.IMREAD_COLOR)
+        if frame_bgr is None or not isinstance(frame_bgr, np.ndarray):
+            return None
+
+        # Normalize frame
+        if frame_bgr.ndim == 2:
+            frame_bgr = cv2.cvtColor(frame_bgr, cv2.COLOR_GRAY2BGR)
+        elif frame_bgr.shape[2] == 4:
+            frame_bgr = cv2.cvtColor(frame_bgr, cv2.COLOR_RGBA2BGR)
+
+        h, w = frame_bgr.shape[:2]
+
+        # Lazily initialize writer
+        if self._container is None:
+            self._open_container(w, h)
+
+        # Keep the stream size fixed if the client changes resolution
+        if (h, w) != (self._h, self._w):
+            if self._bgr_resized is None:
+                self._bgr_resized = np.empty((self._h, self._w, 3), np.uint8)
+            frame_bgr = cv2.resize(frame_bgr, (self._w, self._h), dst=self._bgr_resized)
 
-            self._frames += 1
+        # Capture thumbnail on first frame
+        if self._frames == 0:
+            thumb_name = self._base_path + "_thumb.jpg"
+            cv2.imwrite(thumb_name, frame_bgr)
+            self._thumbnail_path = thumb_name
+
+        if self._w % 2 or self._h % 2:
+            # 4:2:0 needs even sizes; let PyAV convert (and allocate) instead
+            frame_rgb = cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2RGB)
+            return av.VideoFrame.from_ndarray(frame_rgb, format="rgb24")
+
+        if not self._frame_pool:
+            self._frame_pool = [av.VideoFrame(self._w, self._h, "yuv420p") for _ in range(2)]
+            self._i420 = np.empty((self._h * 3 // 2, self._w), np.uint8)
+        # Same BT.601 limited-range conversion swscale would do for the encoder
+        cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2YUV_I420, dst=self._i420)
+
+        frame = self._frame_pool[self._pool_index]
+        self._pool_index ^= 1
+        # Copies the data only if the encoder still holds a reference to it
+        frame.make_writable()
+        flat = self._i420.reshape(-1)
+        offset = 0
+        for plane in frame.planes:
+            size = plane.width * plane.height
+            rows = np.frombuffer(plane, np.uint8)[:plane.height * plane.line_size]
+            dst = rows.reshape(plane.height, plane.line_size)[:, :plane.width]
+            np.copyto(dst, flat[offset:offset + size].reshape(plane.height, plane.width))
+            offset += size
+        return frame
 
     # ------------------------------------------------------------------ #
-    def _background_upload(self, duration):
-        """Handle Firebase upload + metadata in a background thread."""
-        try:
-            dest_path = f"recordings/{os.path.basename(self._path_local)}"
-            public_url = upload_file(self._path_local, dest_path)
-
-            thumb_url = None
-            if self._thumbnail_path and os.path.exists(self._thumbnail_path):
-                thumb_dest = f"recordings/thumbnails/{os.path.basename(self._thumbnail_path)}"
-                thumb_url = upload_file(self._thumbnail_path, thumb_dest)
-
-            save_record_metadata({
-                "clientId": self.client_id,
-                "createdAt": datetime.utcnow(),
-                "durationSec": duration,
-                "fps": self.fps,
-                "frameCount": self._frames,
-                "storagePath": dest_path,
-                "publicUrl": public_url,
-                "thumbnailUrl": thumb_url,
-                "width": self._w,
-                "height": self._h,
-            })
-
-            print(f"[Recorder] Upload complete for {self.client_id}: {public_url}")
-
-        except Exception as e:
-            print(f"[Recorder] Upload error for {self.client_id}: {e}")
+    def _upload_name(self, path: str) -> str:
+        """Object name a closed file will be uploaded as (MP4 once transcoded)."""
+        base = os.path.splitext(os.path.basename(path))[0]
+        return base + (".mp4" if self.transcode else _CONTAINERS[self.format][0])
 
-        finally:
-            # Clean up
-            for f in [self._path_local, self._thumbnail_path]:
-                if f and os.path.exists(f):
-                    try:
-                        os.remove(f)
-                    except OSError:
-                        pass
+    def _prepare_upload(self, path: str):
+        """(path, content type, extra cleanup) for a closed file, transcoding if asked."""
+        if self.transcode:
+            mp4_path = os.path.splitext(path)[0] + ".mp4"
+            try:
+                transcode_to_h264(path, mp4_path, ENCODER_PROFILES[self.profile])
+                return mp4_path, _CONTAINERS["h264"][2], [path]
+            except Exception as e:
+                # Fall back to uploading the MJPEG original
+                print(f"[Recorder] Transcode error for {self.client_id}: {e}")
+        return path, _CONTAINERS[self.format][2], []
+
+    def _dispatch(self, fn, *args):
+        # Transcodes share a bounded pool; uploads go through the upload queue
+        if self.transcode:
+            _transcode_pool.submit(fn, *args)
+        else:
+            fn(*args)
+
+    def _submit_segment(self):
+        """Queue the segment that was just closed (encoder thread / stop)."""
+        dest_path = f"recordings/segments/{self._upload_name(self._path_local)}"
+        self._segments.append(dest_path)
+        meta = {
+            "recordingId": self.recording_id,
+            "clientId": self.client_id,
+            "createdAt": datetime.utcnow(),
+            "segmentIndex": self._segment_index,
+            "startSec": round(self._segment_start_pts / 1000, 3),
+            "durationSec": round((self._last_pts - self._segment_start_pts) / 1000 + 1 / self.fps, 2),
+            "frameCount": self._segment_frames,
+            "storagePath": dest_path,
+            "publicUrl": None,
+        }
+        self._dispatch(self._enqueue_segment, self._path_local, dest_path, meta)
+
+    def _enqueue_segment(self, path: str, dest_path: str, meta: dict):
+        path, content_type, cleanup = self._prepare_upload(path)
+        upload_queue.submit([{"local": path, "dest": dest_path, "contentType": content_type, "field": "publicUrl"}],
+                            meta, cleanup=cleanup, collection="recording_segments",
+                            label=f"{self.client_id} segment {meta['segmentIndex']}")
+
+    def _enqueue_upload(self, duration):
+        """Hand the finished files + metadata to the shared upload queue."""
+        files, cleanup = [], []
+        meta = {
+            "clientId": self.client_id,
+            "recordingId": self.recording_id,
+            "createdAt": datetime.utcnow(),
+            "durationSec": duration,
+            "fps": self.fps,
+            "format": "h264" if self.transcode else self.format,
+            "timing": self.timing,
+            "profile": self.profile if self.format == "h264" or self.transcode else None,
+            "frameCount": self._frames,
+            "publicUrl": None,
+            "thumbnailUrl": None,
+            "width": self._w,
+            "height": self._h,
+        }
+        if self.segment_seconds:
+            # Segments are uploaded on their own; this document links them
+            meta["storagePath"] = self._segments[0]
+            meta["segments"] = list(self._segments)
+            meta["segmentCount"] = len(self._segments)
+            meta["segmentSeconds"] = self.segment_seconds
+        else:
+            path, content_type, cleanup = self._prepare_upload(self._path_local)
+            meta["storagePath"] = f"recordings/{os.path.basename(path)}"
+            meta["format"] = "h264" if content_type == _CONTAINERS["h264"][2] else self.format
+            if meta["format"] != self.format:  # transcoded, possibly scaled down
+                meta["width"], meta["height"] = capped_size(
+                    self._w, self._h, ENCODER_PROFILES[self.profile]["maxHeight"])
+            files.append({"local": path, "dest": meta["storagePath"],
+                          "contentType": content_type, "field": "publicUrl"})
+        if self._thumbnail_path and os.path.exists(self._thumbnail_path):
+            files.append({"local": self._thumbnail_path,
+                          "dest": f"recordings/thumbnails/{os.path.basename(self._thumbnail_path)}",
+                          "contentType": "image/jpeg", "field": "thumbnailUrl"})
+
+        upload_queue.submit(files, meta, cleanup=cleanup, label=self.client_id)
 
     # ------------------------------------------------------------------ #
     def stop_and_upload(self) -> Tuple[Optional[str], Optional[str]]:
-        """Stop recording and trigger background upload."""
+        """Stop recording, drain the encoder thread and queue the upload."""
         with self._lock:
             if not self._active:
                 print(f"[Recorder] No active recording for {self.client_id}")
@@ -380,76 +794,309 @@ class Recorder:
             if self._timer:
                 self._timer.cancel()
                 self._timer = None
+            worker = self._worker
+            self._worker = None
 
-            if self._container is None:
-                print("[Recorder] No container initialized; skipping.")
-                return None, None
+        # Let the encoder finish what is queued; nothing else touches the
+        # container once it has exited, so flushing needs no lock.
+        if worker is not None:
+            self._queue.put(_STOP)
+            if worker is not threading.current_thread():
+                worker.join()
 
-            # Flush encoder and close file properly
-            for packet in self._stream.encode():
-                self._container.mux(packet)
-            self._container.close()
+        if self._container is None:
+            print("[Recorder] No container initialized; skipping.")
+            return None, None
 
-            duration = round(time.time() - self._start_ts, 2)
-            print(f"[Recorder] Stopped recording {self.client_id} after {duration}s ({self._frames} frames)")
+        if self._held_ts is not None:
+            # Close a trailing still stretch with one copy of its picture
+            self._write(self._last_payload, int(round((self._held_ts - self._first_ts) * 1000)))
+            self._held_ts = None
+        self._close_container()
+        self._last_payload = None
+        # Length of the footage itself (last PTS plus one frame), not wall time
+        duration = round(self._last_pts / 1000 + 1 / self.fps, 2)
+        print(f"[Recorder] Stopped recording {self.client_id} after {duration}s "
+              f"({self._frames} frames, {self._dropped} dropped)")
 
-            if not self._path_local or not os.path.exists(self._path_local):
-                print("[Recorder] Output file missing; nothing to upload.")
-                return None, None
+        if not self._path_local or not os.path.exists(self._path_local):
+            print("[Recorder] Output file missing; nothing to upload.")
+            return None, None
 
-            # Spawn background upload
-            t = threading.Thread(target=self._background_upload, args=(duration,), daemon=True)
-            t.start()
+        if self.segment_seconds:
+            self._submit_segment()
+        self._dispatch(self._enqueue_upload, duration)
 
-            return None, None
+        return None, None
 
     # ------------------------------------------------------------------ #
+    @property
+    def queue_fill(self) -> float:
+        """Fraction of the encoder queue in use (0..1)."""
+        return self._queue.qsize() / self._queue.maxsize if self._queue.maxsize else 0.0
+
+    @property
+    def backlogged(self) -> bool:
+        """True while a "block" recorder's queue is full (add_frame would wait)."""
+        return self._active and self.overflow == "block" and self._queue.full()
+
     @property
     def active(self) -> bool:
         with self._lock:
             return self._active
 
+    def stats(self) -> dict:
+        return {
+            "active": self._active,
+            "queueDepth": self._queue.qsize(),
+            "queueSize": self._queue.maxsize,
+            "overflow": self.overflow,
+            "format": self.format,
+            "timing": self.timing,
+            "profile": self.profile,
+            "segmentSeconds": self.segment_seconds,
+            "segmentsQueued": len(self._segments),
+            "framesEncoded": self._frames,
+            "framesDropped": self._dropped,
+            "framesSkipped": self._skipped,
+            "framesDuplicated": self._duplicated,
+            "framesRepeated": self._repeated,
+        }
+
 
 # ====================================================================== #
 class RecordingManager:
-    """Manages multiple Recorder instances (one per client)."""
+    """
+    Manages multiple Recorder instances (one per client).
+    There is no manager-wide lock: start/stop serialize on a lock owned by
+    the client, and the per-frame path (add_frame / is_active) is a plain
+    dict lookup, so one camera's flush never stalls another camera.
+    """
 
     def __init__(self):
         self._by_client = {}
-        self._lock = threading.Lock()
+        self._client_locks = {}
 
-    def start(self, client_id: str, fps: int = 10, max_seconds: Optional[int] = None):
-        with self._lock:
+    def _client_lock(self, client_id: str) -> threading.Lock:
+        lock = self._client_locks.get(client_id)
+        if lock is None:
+            # setdefault is atomic, so racing callers end up with the same lock
+            lock = self._client_locks.setdefault(client_id, threading.Lock())
+        return lock
+
+    def start(self, client_id: str, fps: int = 10, max_seconds: Optional[int] = None, **options):
+        """Start recording `client_id`; `options` are passed on to Recorder."""
+        with self._client_lock(client_id):
             rec = self._by_client.get(client_id)
             if rec and rec.active:
                 print(f"[RecordingManager] {client_id} already active.")
                 return
-            rec = Recorder(client_id=client_id, fps=fps, max_seconds=max_seconds)
+            rec = Recorder(client_id=client_id, fps=fps, max_seconds=max_seconds, **options)
             rec.start()
             self._by_client[client_id] = rec
 
-    def add_frame(self, client_id: str, frame_bgr):
-        with self._lock:
-            rec = self._by_client.get(client_id)
-            if rec and rec.active:
-                rec.add_frame(frame_bgr)
+    def add_frame(self, client_id: str, frame, ts: Optional[float] = None):
+        """Hand a frame (BGR ndarray or JPEG bytes) to the client's encoder queue."""
+        rec = self._by_client.get(client_id)
+        if rec and rec.active:
+            rec.add_frame(frame, ts)
 
     def stop(self, client_id: str):
-        with self._lock:
+        with self._client_lock(client_id):
             rec = self._by_client.get(client_id)
             if not rec:
                 print(f"[RecordingManager] No recorder found for {client_id}")
                 return None, None
+            # Drains the encoder thread and closes the container; only this
+            # client's lock is held meanwhile.
             return rec.stop_and_upload()
 
+    def add_repeat(self, client_id: str, ts: Optional[float] = None):
+        """Tell the client's recorder the picture has not changed."""
+        rec = self._by_client.get(client_id)
+        if rec and rec.active:
+            rec.add_repeat(ts)
+
     def is_active(self, client_id: str) -> bool:
-        with self._lock:
-            rec = self._by_client.get(client_id)
-            return rec.active if rec else False
+        rec = self._by_client.get(client_id)
+        return rec.active if rec else False
+
+    def forget(self, client_id: str):
+        """
+        The client went away: stop a recording it left running (on a
+        background thread, since stopping drains the encoder) and drop the
+        recorder once it has finished.
+        """
+        rec = self._by_client.get(client_id)
+        if rec is None:
+            return
+
+        def _stop():
+            if rec.active:
+                print(f"[RecordingManager] Stopping orphaned recording for {client_id}")
+                self.stop(client_id)
+            with self._client_lock(client_id):
+                if self._by_client.get(client_id) is rec:
+                    del self._by_client[client_id]
+
+        threading.Thread(target=_stop, name=f"forget-{client_id}", daemon=True).start()
+
+    def active_recorder(self, client_id: str) -> Optional[Recorder]:
+        rec = self._by_client.get(client_id)
+        return rec if rec and rec.active else None
+
+    def is_backlogged(self, client_id: str) -> bool:
+        rec = self._by_client.get(client_id)
+        return rec.backlogged if rec else False
 
     def list_clients(self) -> list[str]:
         """Return list of known clients (active or recently started)."""
-        with self._lock:
-            return list(self._by_client.keys())
+        return list(self._by_client.keys())
+
+    def stats(self) -> dict:
+        """Encoder queue depth / drop counters per client."""
+        return {cid: rec.stats() for cid, rec in list(self._by_client.items())}
+
+
+# ====================================================================== #
+class RemoteRecording:
+    """What ClientHints needs to know about a recording held by another process."""
+
+    def __init__(self, fps: int, queue_fill: float = 0.0):
+        self.fps = fps
+        self.queue_fill = queue_fill
+
+
+class SharedRecordingManager(RecordingManager):
+    """
+    RecordingManager for FRAME_STORE=shared (several gunicorn workers).
+    The worker that handles /record/start takes an exclusive flock on
+    owners/<client>.lock and feeds its Recorder from the shared frame store
+    on a tail thread, so frames uploaded to any worker land in the one
+    recording. /record/stop on another worker asks the owner to stop and
+    waits for the lock to be released.
+    """
+
+    def __init__(self, frame_store):
+        super().__init__()
+        self.frame_store = frame_store
+        self._owned = {}  # client_id -> fd holding the owner lock
+        self._remote_cache = {}  # client_id -> (checked_at, RemoteRecording or None)
+        os.makedirs(RECORDING_OWNERS_DIR, exist_ok=True)
+
+    def _owner_path(self, client_id: str, ext: str) -> str:
+        name = base64.urlsafe_b64encode(client_id.encode()).decode().rstrip("=")
+        return os.path.join(RECORDING_OWNERS_DIR, name + ext)
+
+    def _read_info(self, client_id: str) -> dict:
+        try:
+            with open(self._owner_path(client_id, ".json")) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_info(self, client_id: str, info: dict):
+        path = self._owner_path(client_id, ".json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(info, f)
+        os.replace(path + ".tmp", path)
+
+    def _owned_elsewhere(self, client_id: str) -> bool:
+        """True if another process holds the client's owner lock."""
+        fd = os.open(self._owner_path(client_id, ".lock"), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+            return False
+        except BlockingIOError:
+            return True
+        finally:
+            os.close(fd)  # also drops the probe lock
+
+    def _release(self, client_id: str):
+        fd = self._owned.pop(client_id, None)
+        if fd is not None:
+            os.close(fd)  # releases the flock
+
+    # ------------------------------------------------------------------ #
+    def start(self, client_id: str, fps: int = 10, max_seconds: Optional[int] = None, **options):
+        with self._client_lock(client_id):
+            if client_id in self._owned:
+                print(f"[RecordingManager] {client_id} already active.")
+                return
+            fd = os.open(self._owner_path(client_id, ".lock"), os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                print(f"[RecordingManager] {client_id} already recording in another worker.")
+                return
+            self._owned[client_id] = fd
+            self._write_info(client_id, {"pid": os.getpid(), "fps": fps, "stop": False})
+            # Only frames uploaded from now on belong to this recording
+            after = self.frame_store.total_frames()
+            rec = Recorder(client_id=client_id, fps=fps, max_seconds=max_seconds, **options)
+            rec.start()
+            self._by_client[client_id] = rec
+        threading.Thread(target=self._tail, args=(client_id, rec, after),
+                         name=f"tail-{client_id}", daemon=True).start()
+
+    def _tail(self, client_id: str, rec: Recorder, after: int):
+        """Copy the client's frames from the shared store into `rec` until it stops."""
+        try:
+            while rec.active:
+                if self._read_info(client_id).get("stop"):
+                    self.stop(client_id)
+                    break
+                if self.frame_store.wait_for_frame(client_id, after, 0.5) is None:
+                    continue
+                for frame in self.frame_store.frames_after(client_id, after):
+                    rec.add_frame(frame.data, frame.capture_ts or frame.timestamp)
+                    after = frame.frame_number
+        finally:
+            with self._client_lock(client_id):
+                if self._by_client.get(client_id) is rec:
+                    self._release(client_id)
+
+    # The tail thread reads every stored frame, so the per-upload hooks have
+    # nothing to do. Repeats are dropped: "vfr" holds the previous picture
+    # until the next stored frame anyway, and "cfr" fills the gap with copies.
+    def add_frame(self, client_id: str, frame, ts: Optional[float] = None):
+        pass
+
+    def add_repeat(self, client_id: str, ts: Optional[float] = None):
+        pass
+
+    def stop(self, client_id: str):
+        if client_id in self._owned:
+            result = super().stop(client_id)
+            with self._client_lock(client_id):
+                self._release(client_id)
+            return result
+        if not self._owned_elsewhere(client_id):
+            print(f"[RecordingManager] No recorder found for {client_id}")
+            return None, None
+        info = self._read_info(client_id)
+        info["stop"] = True
+        self._write_info(client_id, info)
+        deadline = time.time() + REMOTE_STOP_TIMEOUT
+        while self._owned_elsewhere(client_id) and time.time() < deadline:
+            time.sleep(0.1)
+        self._remote_cache.pop(client_id, None)
+        return None, None
 
+    def forget(self, client_id: str):
+        self._remote_cache.pop(client_id, None)
+        super().forget(client_id)
 
+    def active_recorder(self, client_id: str):
+        """The local Recorder, or a RemoteRecording if another worker records the client."""
+        rec = super().active_recorder(client_id)
+        if rec is not None:
+            return rec
+        checked_at, remote = self._remote_cache.get(client_id, (0.0, None))
+        if time.time() - checked_at > 1.0:  # probing costs an open + flock
+            remote = None
+            if self._owned_elsewhere(client_id):
+                remote = RemoteRecording(int(self._read_info(client_id).get("fps", 10)))
+            self._remote_cache[client_id] = (time.time(), remote)
+        return remote
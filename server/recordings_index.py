@@ -0,0 +1,226 @@
+import base64
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+# Local copy of the Firestore 'recordings' collection. It is written through
+# by save_record_metadata and topped up from Firestore in the background, so
+# /recordings is answered from disk instead of a remote query.
+RECORDINGS_INDEX_PATH = os.environ.get(
+    "RECORDINGS_INDEX_PATH",
+    os.path.join(os.environ.get("RECORDINGS_DIR", os.path.join(os.path.dirname(__file__), "..", "recordings_tmp")),
+                 "recordings_index.sqlite3"),
+)
+INDEX_REFRESH_SECONDS = float(os.environ.get("RECORDINGS_INDEX_REFRESH_SECONDS", 30))
+# Re-read this much history on each refresh to catch documents written by
+# other servers with a slightly older createdAt than ours.
+INDEX_REFRESH_OVERLAP = 300.0
+# After a failed refresh, wait this long before the next one, doubling per failure
+INDEX_RETRY_BASE = float(os.environ.get("RECORDINGS_INDEX_RETRY_BASE", 2.0))  # seconds
+INDEX_RETRY_MAX = 300.0
+MAX_PAGE_SIZE = 200
+
+
+def _epoch(value) -> Optional[float]:
+    """Seconds since epoch for a datetime / ISO string / number (naive = UTC)."""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.timestamp()
+    return None
+
+
+def _jsonable(data: Dict) -> Dict:
+    out = {}
+    for k, v in data.items():
+        out[k] = v.isoformat() if hasattr(v, "isoformat") else v
+    return out
+
+
+class RecordingsIndex:
+    """
+    SQLite-backed index of recording documents with keyset pagination.
+    A version counter bumps on every change and feeds the listing ETag, so
+    an unchanged list can be answered with 304 without touching rows.
+    The file and its schema are created by the first query or write, not
+    when the module is imported.
+    """
+
+    def __init__(self, path: str = RECORDINGS_INDEX_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._refresh_lock = threading.Lock()
+        self._next_refresh = 0.0  # time.time() after which a refresh is due
+        self._failures = 0  # consecutive failed refreshes
+        self._synced = False
+        self._ready = False
+        self._init_lock = threading.Lock()
+
+    def _create_schema(self, conn: sqlite3.Connection):
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS recordings ("
+                " id TEXT PRIMARY KEY, client_id TEXT, created_at REAL, doc TEXT)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS recordings_created ON recordings (created_at DESC, id DESC)")
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS recordings_client ON recordings (client_id, created_at DESC, id DESC)"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value REAL)")
+            conn.execute("INSERT OR IGNORE INTO meta VALUES ('version', 0)")
+
+    def _conn(self) -> sqlite3.Connection:
+        # One connection per thread; WAL lets several gunicorn workers share the file
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            with self._init_lock:
+                if not self._ready:
+                    self._create_schema(conn)
+                    self._ready = True
+        return conn
+
+    # ------------------------------------------------------------------ #
+    def put(self, doc_id: str, data: Dict):
+        """Insert or replace one document (write-through from save_record_metadata)."""
+        self.put_many([(doc_id, data)])
+
+    def put_many(self, docs: List[Tuple[str, Dict]]):
+        if not docs:
+            return
+        rows = [
+            (doc_id, data.get("clientId"), _epoch(data.get("createdAt")) or 0.0,
+             json.dumps(_jsonable(data), sort_keys=True))
+            for doc_id, data in docs
+        ]
+        with self._conn() as conn:
+            changed = 0
+            for row in rows:
+                cur = conn.execute("SELECT doc FROM recordings WHERE id = ?", (row[0],)).fetchone()
+                if cur is not None and cur[0] == row[3]:
+                    continue
+                conn.execute("INSERT OR REPLACE INTO recordings VALUES (?, ?, ?, ?)", row)
+                changed += 1
+            if changed:
+                conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+
+    def version(self) -> int:
+        return int(self._conn().execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0])
+
+    # ------------------------------------------------------------------ #
+    def refresh(self, wait: bool = False):
+        """
+        Pull documents newer than what we hold from Firestore (incremental),
+        if a refresh is due. wait=True blocks while another one is running
+        instead of skipping, then returns without a second attempt.
+        """
+        if time.time() < self._next_refresh:
+            return
+        if not self._refresh_lock.acquire(blocking=wait):
+            return  # a refresh is already running
+        if time.time() < self._next_refresh:  # done by the one we waited for
+            self._refresh_lock.release()
+            return
+        try:
+            from .firebase_service import get_db
+
+            newest = self._conn().execute("SELECT MAX(created_at) FROM recordings").fetchone()[0]
+            query = get_db().collection("recordings")
+            if newest:
+                since = datetime.fromtimestamp(newest - INDEX_REFRESH_OVERLAP, tz=timezone.utc)
+                query = query.where("createdAt", ">", since)
+            self.put_many([(d.id, d.to_dict()) for d in query.order_by("createdAt").stream()])
+            self._synced = True
+            self._failures = 0
+            self._next_refresh = time.time() + INDEX_REFRESH_SECONDS
+        except Exception as e:
+            self._failures += 1
+            delay = min(INDEX_RETRY_MAX, INDEX_RETRY_BASE * 2 ** (self._failures - 1))
+            self._next_refresh = time.time() + delay
+            print(f"[RecordingsIndex] Refresh failed ({self._failures} in a row), retrying in {delay:.1f}s: {e}")
+        finally:
+            self._refresh_lock.release()
+
+    def refresh_async(self):
+        """
+        Kick off a background refresh if one is due. Only the first sync of
+        an empty index blocks the request; once it has failed, later
+        attempts run in the background with backoff and the request is
+        answered from what the index holds.
+        """
+        if not self._synced and self._failures == 0 and self.version() == 0:
+            self.refresh(wait=True)
+        elif time.time() >= self._next_refresh:
+            threading.Thread(target=self.refresh, daemon=True).start()
+
+    # ------------------------------------------------------------------ #
+    @staticmethod
+    def _encode_cursor(created_at: float, doc_id: str) -> str:
+        return base64.urlsafe_b64encode(json.dumps([created_at, doc_id]).encode()).decode()
+
+    @staticmethod
+    def _decode_cursor(cursor: str) -> Tuple[float, str]:
+        created_at, doc_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return float(created_at), str(doc_id)
+
+    def etag(self, **params) -> str:
+        key = json.dumps([self.version(), params], sort_keys=True, default=str)
+        return hashlib.sha1(key.encode()).hexdigest()
+
+    def query(self, client_id: Optional[str] = None, since=None, until=None,
+              cursor: Optional[str] = None, limit: int = 50) -> Tuple[List[Dict], Optional[str]]:
+        """
+        Newest-first page of recordings. Returns (items, next_cursor);
+        next_cursor is None on the last page. Raises ValueError on a bad cursor.
+        """
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        clauses, args = [], []
+        if client_id:
+            clauses.append("client_id = ?")
+            args.append(client_id)
+        if since is not None:
+            clauses.append("created_at >= ?")
+            args.append(_epoch(since))
+        if until is not None:
+            clauses.append("created_at < ?")
+            args.append(_epoch(until))
+        if cursor:
+            try:
+                c_created, c_id = self._decode_cursor(cursor)
+            except Exception:
+                raise ValueError("invalid cursor")
+            clauses.append("(created_at < ? OR (created_at = ? AND id < ?))")
+            args += [c_created, c_created, c_id]
+        sql = "SELECT id, created_at, doc FROM recordings"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY created_at DESC, id DESC LIMIT ?"
+        rows = self._conn().execute(sql, args + [limit + 1]).fetchall()
+
+        items = []
+        for doc_id, _, doc in rows[:limit]:
+            it = json.loads(doc)
+            it["id"] = doc_id
+            items.append(it)
+        next_cursor = self._encode_cursor(rows[limit - 1][1], rows[limit - 1][0]) if len(rows) > limit else None
+        return items, next_cursor
+
+
+recordings_index = RecordingsIndex()
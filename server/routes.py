@@ -1,24 +1,113 @@
-from flask import Blueprint, request, jsonify, render_template
-import cv2, numpy as np, base64, time
+from flask import Blueprint, Response, request, jsonify, render_template, stream_with_context
+import base64, os, time
 from datetime import datetime
-
-from .recording import RecordingManager
-from .firebase_service import get_db
+from typing import Optional
+
+from .clients import REGISTRY_FULL_RETRY_AFTER, RegistryFull
+from .encoder_farm import ENCODER_PROCESSES, FarmRecordingManager
+from .frame_store import FrameStore, Frame, is_jpeg, PREVIEW_SIZES, DEFAULT_PREVIEW_SIZE
+from .framing import FramingError, read_frames
+from .hints import ClientHints
+from .motion import MotionDetector
+from .shared_frames import SharedFrameStore
+from .stats import registry, BYTES_RECEIVED, FRAMES_RECEIVED, FRAMES_UNCHANGED, PER_CLIENT_COUNTERS, STAGE_SECONDS
+from .recording import (
+    RecordingManager, SharedRecordingManager, DEFAULT_QUEUE_SIZE, DEFAULT_OVERFLOW, OVERFLOW_POLICIES,
+    DEFAULT_FORMAT, RECORDING_FORMATS, DEFAULT_TIMING, TIMING_MODES, DEFAULT_SEGMENT_SECONDS,
+    DEFAULT_ENCODER_PROFILE, ENCODER_PROFILES,
+)
+from .recordings_index import recordings_index
+from .upload_queue import upload_queue
 
 bp = Blueprint("server", __name__)
 
-frame_count = 0
-received_frames = []
-MAX_FRAMES_STORED = 50
-connected_clients = {}
+MAX_FRAMES_PER_CLIENT = int(os.environ.get("MAX_FRAMES_PER_CLIENT", 50))
+# "memory": per-process store (one worker); "shared": memory-mapped store that
+# every gunicorn worker sees, with recordings owned by a single worker.
+FRAME_STORE = os.environ.get("FRAME_STORE", "memory")
+
+# How long a stream viewer waits for a new frame before re-checking. Each
+# empty wait re-sends the last part, so a viewer that went away is noticed
+# by the failed write; a stream of a client with no frames at all (unknown
+# or expired) ends after STREAM_MAX_EMPTY_WAITS such waits.
+STREAM_WAIT_SECONDS = 5.0
+STREAM_MAX_EMPTY_WAITS = 12
+
+if FRAME_STORE == "shared":
+    frame_store = SharedFrameStore(max_frames=MAX_FRAMES_PER_CLIENT)
+    rec_mgr = SharedRecordingManager(frame_store)
+else:
+    frame_store = FrameStore(max_frames=MAX_FRAMES_PER_CLIENT)
+    # ENCODER_PROCESSES > 0: encode in a pool of processes (see encoder_farm.py)
+    rec_mgr = FarmRecordingManager(ENCODER_PROCESSES) if ENCODER_PROCESSES else RecordingManager()
+client_hints = ClientHints(rec_mgr)
+motion = MotionDetector()
+
+
+def _forget_client(client_id: str):
+    """Registry expiry callback: release what the rest of the server keeps per client."""
+    motion.forget(client_id)
+    client_hints.forget(client_id)
+    rec_mgr.forget(client_id)
+    for counter in PER_CLIENT_COUNTERS:
+        counter.remove(client=client_id)
+
+
+# The store drops the client's frames itself (see FrameStore.remove)
+frame_store.registry.on_expire(_forget_client)
+# A full registry makes room by evicting a client, but never one that is recording
+frame_store.registry.busy = rec_mgr.is_active
+
 
-rec_mgr = RecordingManager()
+@bp.errorhandler(RegistryFull)
+def _registry_full(e):
+    """Every client slot is taken by a recording camera: turn the new one away."""
+    resp = jsonify({"error": "Too many clients, retry later"})
+    resp.headers["Retry-After"] = str(REGISTRY_FULL_RETRY_AFTER)
+    return resp, 429
 
 
 def _get_client_id() -> str:
     return request.headers.get("X-Client-ID") or request.args.get("clientId") or "unknown"
 
 
+def _get_capture_ts():
+    """Client capture time in epoch seconds (X-Capture-Ts header or `timestamp` field, in ms)."""
+    raw = request.headers.get("X-Capture-Ts") or request.form.get("timestamp")
+    try:
+        return float(raw) / 1000 if raw else None
+    except ValueError:
+        return None
+
+
+@STAGE_SECONDS.timed(stage="ingest")
+def ingest_frame(client_id: str, image_data: bytes, capture_ts: Optional[float] = None) -> Optional[int]:
+    """
+    Store an uploaded JPEG and hand it to the client's recorder; returns its
+    frame number, or None if the picture had not changed (see motion.py).
+    Shared by /upload and the ASGI ingest server (server/asgi.py).
+    """
+    frame_store.touch(client_id)  # track last frame time
+    client_hints.observe(client_id, len(image_data))
+    FRAMES_RECEIVED.inc(client=client_id)
+    BYTES_RECEIVED.inc(len(image_data), client=client_id)
+    if not motion.changed(client_id, image_data):
+        # Nothing new to store or decode; the recording just holds the picture
+        FRAMES_UNCHANGED.inc(client=client_id)
+        rec_mgr.add_repeat(client_id, capture_ts)
+        return None
+
+    # Store the JPEG as received; the grayscale preview is built lazily
+    # by the first viewer (see Frame.preview).
+    number = frame_store.next_frame_number()
+    frame_store.add(client_id, Frame(image_data, time.time(), number, capture_ts))
+
+    # Recording only enqueues the JPEG; decode + encode run on the
+    # recorder's own encoder thread.
+    rec_mgr.add_frame(client_id, image_data, capture_ts)
+    return number
+
+
 @bp.route("/")
 def index():
     return render_template("dashboard.html")
@@ -26,7 +115,6 @@ def index():
 
 @bp.route("/upload", methods=["POST"])
 def upload_frame():
-    global frame_count, received_frames
     try:
         if "image" not in request.files:
             return jsonify({"error": "No image file"}), 400
@@ -36,50 +124,171 @@ def upload_frame():
             return jsonify({"error": "No file selected"}), 400
 
         image_data = file.read()
-        nparr = np.frombuffer(image_data, np.uint8)
-        frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        if frame is None:
+        if not is_jpeg(image_data):
             return jsonify({"error": "Failed to decode image"}), 400
 
-        # (Optional) processed preview -> grayscale
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        processed = cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
-
-        _, buffer = cv2.imencode(".jpg", processed, [cv2.IMWRITE_JPEG_QUALITY, 85])
-        frame_base64 = base64.b64encode(buffer).decode("utf-8")
-
-        frame_count += 1
-        received_frames.append({
-            "frame_data": frame_base64,
-            "timestamp": time.time(),
-            "frame_number": frame_count,
-            "original_size": len(image_data),
-            "processed_size": len(buffer)
-        })
-        if len(received_frames) > MAX_FRAMES_STORED:
-            received_frames.pop(0)
-
-        # ---- NEW: if recording is active for this client, add original frame ----
         client_id = _get_client_id()
-        connected_clients[client_id] = time.time()  # track last frame time
-        rec_mgr.add_frame(client_id, frame)
-
+        number = ingest_frame(client_id, image_data, _get_capture_ts())
         return jsonify({
             "status": "success",
-            "frame_count": frame_count
+            "frame_count": number or frame_store.total_frames(),
+            "unchanged": number is None,
+            # how to send the next frames (see ClientHints)
+            "hint": client_hints.hint(client_id)
         })
+    except RegistryFull as e:
+        return _registry_full(e)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+class StreamTally:
+    """Counters for one /upload/stream or /upload/batch request (also used by server/asgi.py)."""
+
+    def __init__(self, client_id: str):
+        self.client_id = client_id
+        self.frames = 0
+        self.unchanged = 0
+        self.rejected = 0
+        self.last_frame = None
+        self._lag_total = 0.0
+        self._lag_count = 0
+        self._lag_max = 0.0
+
+    def ingest(self, image_data: bytes, capture_ts: Optional[float]):
+        if not is_jpeg(image_data):
+            self.rejected += 1
+            return
+        number = ingest_frame(self.client_id, image_data, capture_ts)
+        self.frames += 1
+        if number is None:
+            self.unchanged += 1
+        else:
+            self.last_frame = number
+        if capture_ts:
+            lag = max(0.0, time.time() - capture_ts)
+            self._lag_total += lag
+            self._lag_count += 1
+            self._lag_max = max(self._lag_max, lag)
+
+    def summary(self) -> dict:
+        return {
+            "status": "success",
+            "hint": client_hints.hint(self.client_id),
+            "frames": self.frames,
+            "unchanged": self.unchanged,
+            "rejected": self.rejected,
+            "frame_count": self.last_frame,
+            # capture -> stored, per the client's clock
+            "lagMs": {
+                "avg": round(1000 * self._lag_total / self._lag_count, 1) if self._lag_count else None,
+                "max": round(1000 * self._lag_max, 1),
+            },
+        }
+
+
+@bp.route("/upload/stream", methods=["POST"])
+def upload_stream():
+    """
+    Persistent upload: the body is a run of length-prefixed frames (see
+    server/framing.py), normally sent with chunked transfer encoding for as
+    long as the camera runs. Frames are stored as they arrive; the response
+    summarises the connection once the client ends the body.
+    """
+    tally = StreamTally(_get_client_id())
+    try:
+        for image_data, capture_ts in read_frames(request.stream):
+            tally.ingest(image_data, capture_ts)
+    except FramingError as e:
+        return jsonify(dict(tally.summary(), status="error", error=str(e))), 400
+    return jsonify(tally.summary())
+
+
+def iter_batch(mimetype: str, stream, form, files):
+    """
+    (jpeg, capture_ts) pairs of an /upload/batch body, in order: either
+    multipart with repeated `image` files and matching `timestamp` fields
+    (ms), or length-prefixed frames (server/framing.py).
+    """
+    if mimetype == "multipart/form-data":
+        stamps = form.getlist("timestamp")
+        for i, file in enumerate(files.getlist("image")):
+            try:
+                capture_ts = float(stamps[i]) / 1000 if i < len(stamps) else None
+            except ValueError:
+                capture_ts = None
+            yield file.read(), capture_ts
+    else:
+        yield from read_frames(stream)
+
+
+@bp.route("/upload/batch", methods=["POST"])
+def upload_batch():
+    """
+    Several frames of one client in a single request, stored in order
+    through the same path as /upload. Answers with a summary and a hint.
+    """
+    tally = StreamTally(_get_client_id())
+    multipart = request.mimetype == "multipart/form-data"
+    try:
+        for image_data, capture_ts in iter_batch(request.mimetype, None if multipart else request.stream,
+                                                 request.form, request.files):
+            tally.ingest(image_data, capture_ts)
+    except FramingError as e:
+        return jsonify(dict(tally.summary(), status="error", error=str(e))), 400
+    return jsonify(tally.summary())
+
+
+@bp.route("/motion", methods=["POST"])
+def set_motion_threshold():
+    """
+    Per-client change-detection threshold: {"clientId", "threshold"} where
+    threshold is the mean luminance difference (0-255) a frame needs to be
+    kept; 0 keeps everything, null restores the server default.
+    """
+    data = request.get_json(silent=True) or {}
+    client_id = data.get("clientId") or _get_client_id()
+    threshold = data.get("threshold")
+    try:
+        motion.set_threshold(client_id, None if threshold is None else float(threshold))
+    except (TypeError, ValueError):
+        return jsonify({"error": "threshold must be a number or null"}), 400
+    return jsonify({"clientId": client_id, "threshold": motion.threshold(client_id)})
+
+
 @bp.route("/record/start", methods=["POST"])
 def start_record():
     data = request.get_json(silent=True) or {}
     client_id = data.get("clientId") or _get_client_id()
     fps = int(data.get("fps", 10))
     max_seconds = int(data.get("maxSeconds", 120))  # default 2 minutes
-    rec_mgr.start(client_id=client_id, fps=fps, max_seconds=max_seconds)
-    return jsonify({"status": "started", "clientId": client_id, "fps": fps, "maxSeconds": max_seconds})
+    queue_size = int(data.get("queueSize", DEFAULT_QUEUE_SIZE))
+    overflow = data.get("overflow", DEFAULT_OVERFLOW)
+    if overflow not in OVERFLOW_POLICIES:
+        return jsonify({"error": f"overflow must be one of {list(OVERFLOW_POLICIES)}"}), 400
+    # "h264" encodes to MP4; "mjpeg" stores the uploaded JPEGs untouched (MKV),
+    # optionally transcoded to H.264 in the background once stopped.
+    fmt = data.get("format", DEFAULT_FORMAT)
+    if fmt not in RECORDING_FORMATS:
+        return jsonify({"error": f"format must be one of {list(RECORDING_FORMATS)}"}), 400
+    transcode = bool(data.get("transcode", False))
+    # "vfr" stamps frames with their capture time; "cfr" resamples to `fps`
+    timing = data.get("timing", DEFAULT_TIMING)
+    if timing not in TIMING_MODES:
+        return jsonify({"error": f"timing must be one of {list(TIMING_MODES)}"}), 400
+    # Rotate to a new file (uploaded straight away) every N seconds; 0 = one file
+    segment_seconds = int(data.get("segmentSeconds", DEFAULT_SEGMENT_SECONDS))
+    # Named x264 settings (preset / CRF / threads / GOP / size cap), see ENCODER_PROFILES
+    profile = data.get("profile", DEFAULT_ENCODER_PROFILE)
+    if profile not in ENCODER_PROFILES:
+        return jsonify({"error": f"profile must be one of {list(ENCODER_PROFILES)}"}), 400
+    rec_mgr.start(client_id=client_id, fps=fps, max_seconds=max_seconds,
+                  queue_size=queue_size, overflow=overflow, format=fmt, transcode=transcode,
+                  timing=timing, segment_seconds=segment_seconds, profile=profile)
+    motion.reset(client_id)  # a recording must open on a real frame, not a repeat
+    return jsonify({"status": "started", "clientId": client_id, "fps": fps, "maxSeconds": max_seconds,
+                    "queueSize": queue_size, "overflow": overflow, "format": fmt, "transcode": transcode,
+                    "timing": timing, "segmentSeconds": segment_seconds, "profile": profile})
 
 
 @bp.route("/record/stop", methods=["POST"])
@@ -93,42 +302,152 @@ def stop_record():
 @bp.route("/recordings", methods=["GET"])
 def list_recordings():
     """
-    Simple admin listing endpoint (server-side).
-    For production, add pagination / auth.
+    Admin listing, newest first, served from the local recordings index.
+    Query: clientId, since / until (ISO time or epoch seconds), limit, cursor
+    (the nextCursor of the previous page). Honours If-None-Match.
     """
-    db = get_db()
-    docs = db.collection("recordings").order_by("createdAt", direction="DESCENDING").limit(50).stream()
-    items = []
-    for d in docs:
-        it = d.to_dict()
-        it["id"] = d.id
-        # Firestore returns Timestamp; make ISO string if present
-        if "createdAt" in it and hasattr(it["createdAt"], "isoformat"):
-            it["createdAt"] = it["createdAt"].isoformat()
-        items.append(it)
-    return jsonify({"items": items})
+    recordings_index.refresh_async()
+    params = {
+        "client_id": request.args.get("clientId") or None,
+        "since": request.args.get("since") or None,
+        "until": request.args.get("until") or None,
+        "cursor": request.args.get("cursor") or None,
+        "limit": request.args.get("limit", 50, type=int),
+    }
+    etag = recordings_index.etag(**params)
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers={"ETag": f'"{etag}"'})
+    try:
+        items, next_cursor = recordings_index.query(**params)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    resp = jsonify({"items": items, "nextCursor": next_cursor})
+    resp.set_etag(etag)
+    return resp
+
+
+def _preview_size() -> Optional[str]:
+    """?size= (thumb / medium / full), or None if it names no PREVIEW_SIZES entry."""
+    size = request.args.get("size", DEFAULT_PREVIEW_SIZE)
+    return size if size in PREVIEW_SIZES else None
 
 
 @bp.route("/latest_frame")
 def get_latest_frame():
-    latest = received_frames[-1] if received_frames else None
+    """
+    Latest frame for ?clientId= (or for whichever client posted last).
+    ?size=thumb|medium|full picks the preview width (see PREVIEW_SIZES).
+    """
+    client_id = request.args.get("clientId") or None
+    size = _preview_size()
+    if size is None:
+        return jsonify({"error": f"size must be one of {list(PREVIEW_SIZES)}"}), 400
+    latest = frame_store.latest(client_id)
+    # ?data=0 returns only the counters (used by dashboards that watch /stream)
+    want_data = request.args.get("data", "1") != "0"
+    if client_id and want_data:
+        client_hints.viewed(client_id)
+    preview = latest.preview(size) if latest and want_data else None
     return jsonify({
-        "frame_data": latest["frame_data"] if latest else None,
-        "frame_count": frame_count,
-        "connected_clients": connected_clients
+        "frame_data": base64.b64encode(preview).decode("utf-8") if preview else None,
+        "frame_number": latest.frame_number if latest else None,
+        "frame_count": frame_store.total_frames(),
+        "connected_clients": frame_store.last_seen()
     })
 
 
+def mjpeg_parts(client_id: str, raw: bool, size: str):
+    """Multipart JPEG parts for /stream (also used by server/asgi.py); each next() may block STREAM_WAIT_SECONDS."""
+    last_number, last_part, empty_waits = 0, None, 0
+    while True:
+        client_hints.viewed(client_id)
+        frame = frame_store.wait_for_frame(client_id, last_number, STREAM_WAIT_SECONDS)
+        if frame is None:
+            if frame_store.latest(client_id) is None:
+                empty_waits += 1
+                if empty_waits >= STREAM_MAX_EMPTY_WAITS:
+                    return
+            else:
+                empty_waits = 0
+            if last_part is not None:
+                yield last_part  # keepalive
+            continue
+        empty_waits = 0
+        last_number = frame.frame_number
+        data = frame.data if raw else frame.preview(size)
+        if data is None:
+            continue
+        last_part = (
+            b"--frame\r\nContent-Type: image/jpeg\r\nContent-Length: "
+            + str(len(data)).encode() + b"\r\n\r\n" + data + b"\r\n"
+        )
+        yield last_part
+
+
+@bp.route("/stream/<client_id>")
+def stream_frames(client_id):
+    """
+    MJPEG (multipart/x-mixed-replace) stream for one client.
+    Pushes a JPEG part only when a new frame arrives; ?raw=1 sends the
+    uploaded colour JPEG instead of the grayscale preview, whose width is
+    chosen with ?size= as on /latest_frame.
+    """
+    raw = request.args.get("raw") == "1"
+    size = _preview_size()
+    if size is None:
+        return jsonify({"error": f"size must be one of {list(PREVIEW_SIZES)}"}), 400
+    return Response(
+        stream_with_context(mjpeg_parts(client_id, raw, size)),
+        mimetype="multipart/x-mixed-replace; boundary=frame",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @bp.route("/stats")
 def stats():
-    total_data = sum(f["original_size"] for f in received_frames)
-    avg = total_data / len(received_frames) if received_frames else 0
+    store_stats = frame_store.stats()
     return jsonify({
-        "total_frames": frame_count,
-        "frames_stored": len(received_frames),
-        "avg_frame_size": avg
+        "total_frames": frame_store.total_frames(),
+        "frames_stored": store_stats["frames_stored"],
+        "avg_frame_size": store_stats["avg_frame_size"],
+        "max_frames_per_client": MAX_FRAMES_PER_CLIENT,
+        "clients": store_stats["clients"],
+        "recorders": rec_mgr.stats(),
+        "motion": motion.stats(),
+        "clientRegistry": frame_store.registry.stats(),
+        "encoderFarm": rec_mgr.farm_stats() if isinstance(rec_mgr, FarmRecordingManager) else None,
+        "uploads": upload_queue.stats()
     })
 
+def _recent_clients(window: float = 10.0) -> list:
+    return frame_store.recent(window)
+
+
+def _collect_pipeline():
+    """Scrape-time gauges for /metrics, read from the components that own them."""
+    recorders = rec_mgr.stats()
+    yield ("authview_recordings_active", "Recordings in progress.", "gauge",
+           [({}, sum(1 for r in recorders.values() if r["active"]))])
+    yield ("authview_recorder_queue_depth", "Frames waiting in a recorder's encoder queue.", "gauge",
+           [({"client": cid}, r["queueDepth"]) for cid, r in recorders.items() if r["active"]])
+    yield ("authview_recorder_frames_dropped", "Frames dropped by a recorder's overflow policy.", "gauge",
+           [({"client": cid}, r["framesDropped"]) for cid, r in recorders.items() if r["active"]])
+    uploads = upload_queue.stats()
+    yield ("authview_upload_jobs", "Upload queue jobs by state.", "gauge",
+           [({"state": s}, uploads[s]) for s in ("pending", "inFlight", "deadLetter")])
+    yield ("authview_connected_clients", "Clients that sent a frame in the last 10 s.", "gauge",
+           [({}, len(_recent_clients()))])
+
+
+registry.add_collector(_collect_pipeline)
+
+
+@bp.route("/metrics")
+def metrics():
+    """Prometheus text exposition of the ingest / recording / upload pipeline."""
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4")
+
+
 @bp.route("/client")
 def client_page():
     return render_template("client.html")
@@ -139,13 +458,8 @@ def client_page():
 def get_clients():
     """Return a list of currently active/connected clients (recently seen)."""
     try:
-        now = time.time()
         # Keep only clients seen in the last 10 seconds
-        active_clients = [
-            cid for cid, last_seen in connected_clients.items()
-            if now - last_seen < 10
-        ]
-        return jsonify({"clients": sorted(active_clients)})
+        return jsonify({"clients": sorted(_recent_clients())})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
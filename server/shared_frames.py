@@ -0,0 +1,330 @@
+"""
+Frame store shared by every worker process (FRAME_STORE=shared).
+
+Each client gets one memory-mapped file under SHARED_FRAMES_DIR (tmpfs by
+default): a small header followed by `max_frames` fixed-size slots that
+form a ring buffer of raw JPEGs. Writers take an flock on the client's file;
+readers take no lock -- every slot carries a sequence number that is odd
+while the slot is being written, and a read is retried if the number moved.
+Frame numbers come from one shared counter file, so they stay unique and
+increasing across workers. A client's file is deleted once no worker has
+seen it for CLIENT_IDLE_SECONDS.
+"""
+import base64
+import fcntl
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+
+from .clients import ClientRegistry
+from .frame_store import Frame
+
+SHARED_FRAMES_DIR = os.environ.get(
+    "SHARED_FRAMES_DIR",
+    os.path.join("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "authview_frames"),
+)
+# Largest JPEG a slot can hold; bigger uploads are not kept for viewers
+SHARED_FRAME_SLOT_BYTES = int(os.environ.get("SHARED_FRAME_SLOT_BYTES", 1024 * 1024))
+# Viewers in one worker are woken directly; frames from other workers are
+# noticed by polling this often.
+SHARED_POLL_SECONDS = 0.02
+
+# write_seq, total_frames, total_bytes, last_seen
+_HEADER = struct.Struct("<QQQd")
+_HEADER_SIZE = 64
+_LAST_SEEN = struct.Struct("<d")
+_LAST_SEEN_OFFSET = 24
+# seq (odd = being written), frame_number, length, timestamp, capture_ts (0 = none)
+_SLOT = struct.Struct("<QQIdd")
+_SLOT_META_SIZE = 48
+_COUNTER = struct.Struct("<Q")
+
+
+def _file_name(client_id: str) -> str:
+    return base64.urlsafe_b64encode(client_id.encode()).decode().rstrip("=") + ".ring"
+
+
+def _client_id(file_name: str) -> str:
+    stem = file_name[:-len(".ring")]
+    return base64.urlsafe_b64decode(stem + "=" * (-len(stem) % 4)).decode()
+
+
+class _Ring:
+    """
+    One client's mapped file. flock() excludes other processes only: it
+    locks the open file description, which every thread of this process
+    shares, so writers in one worker also take a thread lock.
+    """
+
+    def __init__(self, path: str, slots: int, slot_bytes: int):
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        self.stride = _SLOT_META_SIZE + slot_bytes
+        size = _HEADER_SIZE + slots * self.stride
+        self._write_lock = threading.Lock()
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self.fd).st_size < size:
+                os.ftruncate(self.fd, size)  # sparse: pages appear as slots fill
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+        self.map = mmap.mmap(self.fd, size)
+
+    def __del__(self):
+        # Once the last reader has let go of the mapping
+        os.close(self.fd)
+
+    @property
+    def removed(self) -> bool:
+        """True if another worker deleted this client's file."""
+        return os.fstat(self.fd).st_nlink == 0
+
+    def header(self):
+        return _HEADER.unpack_from(self.map, 0)
+
+    def _slot_offset(self, index: int) -> int:
+        return _HEADER_SIZE + index * self.stride
+
+    def write(self, frame: Frame) -> bool:
+        if len(frame.data) > self.slot_bytes:
+            return False
+        with self._write_lock:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try:
+                seq, total, total_bytes, _ = self.header()
+                off = self._slot_offset(seq % self.slots)
+                _SLOT.pack_into(self.map, off, 2 * seq + 1, 0, 0, 0.0, 0.0)
+                self.map[off + _SLOT_META_SIZE:off + _SLOT_META_SIZE + len(frame.data)] = frame.data
+                _SLOT.pack_into(self.map, off, 2 * seq + 2, frame.frame_number, len(frame.data),
+                                frame.timestamp, frame.capture_ts or 0.0)
+                _HEADER.pack_into(self.map, 0, seq + 1, total + 1, total_bytes + len(frame.data), time.time())
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+        return True
+
+    def touch(self):
+        _LAST_SEEN.pack_into(self.map, _LAST_SEEN_OFFSET, time.time())
+
+    def read(self, seq: int) -> Optional[Frame]:
+        """Frame with write sequence `seq` (0-based), or None if overwritten meanwhile."""
+        off = self._slot_offset(seq % self.slots)
+        for _ in range(3):
+            slot_seq, number, length, ts, capture_ts = _SLOT.unpack_from(self.map, off)
+            if slot_seq != 2 * seq + 2:
+                if slot_seq > 2 * seq + 2:
+                    return None  # already reused for a newer frame
+                time.sleep(0)  # being written right now
+                continue
+            data = self.map[off + _SLOT_META_SIZE:off + _SLOT_META_SIZE + length]
+            if _SLOT.unpack_from(self.map, off)[0] == slot_seq:
+                return Frame(data, ts, number, capture_ts or None)
+        return None
+
+    def lengths(self) -> List[int]:
+        seq = self.header()[0]
+        return [
+            _SLOT.unpack_from(self.map, self._slot_offset(i % self.slots))[2]
+            for i in range(max(0, seq - self.slots), seq)
+        ]
+
+
+class SharedFrameStore:
+    """
+    Drop-in for FrameStore backed by shared memory. Reads copy the JPEG out
+    of the mapping once per new frame; the resulting Frame (and its lazily
+    built previews) is cached per process.
+
+    Expiry runs in every worker on its own ClientRegistry, but a client is
+    only dropped once its shared last-seen time is idle as well.
+    """
+
+    def __init__(self, max_frames: int = 50, directory: str = SHARED_FRAMES_DIR,
+                 slot_bytes: int = SHARED_FRAME_SLOT_BYTES, registry: Optional[ClientRegistry] = None):
+        self.max_frames = max_frames
+        self.directory = directory
+        self.slot_bytes = slot_bytes
+        self._rings: Dict[str, _Ring] = {}
+        self._cache: Dict[str, Frame] = {}
+        self._conds: Dict[str, threading.Condition] = {}
+        self._last_client: Optional[str] = None
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._counter_fd = os.open(os.path.join(directory, "frame_count"), os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._counter_fd).st_size < _COUNTER.size:
+            os.ftruncate(self._counter_fd, _COUNTER.size)
+        self._counter = mmap.mmap(self._counter_fd, _COUNTER.size)
+        self._counter_lock = threading.Lock()
+        self.registry = registry or ClientRegistry(refresh=self._shared_last_seen)
+        self.registry.on_expire(self.remove)
+
+    def _ring(self, client_id: str, create: bool = True) -> Optional[_Ring]:
+        ring = self._rings.get(client_id)
+        if ring is not None and ring.removed:
+            self._forget(client_id)
+            ring = None
+        if ring is None:
+            path = os.path.join(self.directory, _file_name(client_id))
+            if not create and not os.path.exists(path):
+                return None
+            with self._lock:
+                ring = self._rings.get(client_id)
+                if ring is None:
+                    ring = self._rings[client_id] = _Ring(path, self.max_frames, self.slot_bytes)
+        return ring
+
+    def _condition(self, client_id: str) -> threading.Condition:
+        with self._lock:
+            cond = self._conds.get(client_id)
+            if cond is None:
+                cond = self._conds[client_id] = threading.Condition()
+            return cond
+
+    # ------------------------------------------------------------------ #
+    def next_frame_number(self) -> int:
+        with self._counter_lock:  # flock alone does not exclude this worker's other threads
+            fcntl.flock(self._counter_fd, fcntl.LOCK_EX)
+            try:
+                number = _COUNTER.unpack_from(self._counter, 0)[0] + 1
+                _COUNTER.pack_into(self._counter, 0, number)
+            finally:
+                fcntl.flock(self._counter_fd, fcntl.LOCK_UN)
+        return number
+
+    def total_frames(self) -> int:
+        return _COUNTER.unpack_from(self._counter, 0)[0]
+
+    def touch(self, client_id: str):
+        self.registry.touch(client_id)  # first: a rejected client gets no ring file
+        self._ring(client_id).touch()
+
+    def _shared_last_seen(self, client_id: str) -> float:
+        ring = self._ring(client_id, create=False)
+        return ring.header()[3] if ring is not None else 0.0
+
+    def last_seen(self) -> Dict[str, float]:
+        out = {}
+        for cid in self.clients():
+            ring = self._ring(cid, create=False)
+            if ring is not None:
+                out[cid] = ring.header()[3]
+        return out
+
+    def recent(self, window: float) -> list:
+        self.registry.expire()
+        cutoff = time.time() - window
+        return [cid for cid, seen in self.last_seen().items() if seen >= cutoff]
+
+    def add(self, client_id: str, frame: Frame):
+        if not self._ring(client_id).write(frame):
+            print(f"[SharedFrameStore] {client_id}: {len(frame.data)} byte frame exceeds slot size; not kept")
+            return
+        self._last_client = client_id
+        cond = self._conds.get(client_id)
+        if cond is not None:
+            with cond:
+                cond.notify_all()
+
+    def latest(self, client_id: Optional[str] = None) -> Optional[Frame]:
+        if client_id is None:
+            client_id = self._last_client
+            if client_id is None:
+                seen = self.last_seen()
+                client_id = max(seen, key=seen.get) if seen else None
+            if client_id is None:
+                return None
+        ring = self._ring(client_id, create=False)
+        if ring is None:
+            return None
+        seq = ring.header()[0]
+        if seq == 0:
+            return None
+        cached = self._cache.get(client_id)
+        frame = ring.read(seq - 1)
+        if frame is None:
+            return cached
+        if cached is not None and cached.frame_number == frame.frame_number:
+            return cached  # keeps the already built previews
+        self._cache[client_id] = frame
+        return frame
+
+    def frames_after(self, client_id: str, after_number: int) -> List[Frame]:
+        """Every frame still in the ring newer than `after_number`, oldest first."""
+        ring = self._ring(client_id, create=False)
+        if ring is None:
+            return []
+        seq = ring.header()[0]
+        frames = []
+        for s in range(seq - 1, max(-1, seq - 1 - self.max_frames), -1):
+            frame = ring.read(s)
+            if frame is None or frame.frame_number <= after_number:
+                break
+            frames.append(frame)
+        frames.reverse()
+        return frames
+
+    def wait_for_frame(self, client_id: str, after_number: int, timeout: float) -> Optional[Frame]:
+        deadline = time.time() + timeout
+        cond = self._condition(client_id)
+        while True:
+            frame = self.latest(client_id)
+            if frame is not None and frame.frame_number > after_number:
+                return frame
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                if frame is None:
+                    # Nothing from this client in any worker; don't keep its condition
+                    with self._lock:
+                        if self._conds.get(client_id) is cond:
+                            del self._conds[client_id]
+                return None
+            with cond:
+                cond.wait(min(remaining, SHARED_POLL_SECONDS))
+
+    def clients(self) -> list:
+        return [_client_id(n) for n in os.listdir(self.directory) if n.endswith(".ring")]
+
+    def _forget(self, client_id: str):
+        with self._lock:
+            self._rings.pop(client_id, None)
+            self._conds.pop(client_id, None)
+        self._cache.pop(client_id, None)
+        if self._last_client == client_id:
+            self._last_client = None
+
+    def remove(self, client_id: str):
+        """Drop the client's cached frames, and its file unless another worker saw it lately."""
+        if time.time() - self._shared_last_seen(client_id) >= self.registry.idle_seconds:
+            try:
+                os.unlink(os.path.join(self.directory, _file_name(client_id)))
+            except FileNotFoundError:
+                pass
+        self._forget(client_id)
+
+    # ------------------------------------------------------------------ #
+    def stats(self) -> dict:
+        per_client = {}
+        stored = stored_bytes = 0
+        for cid in self.clients():
+            ring = self._ring(cid, create=False)
+            if ring is None:
+                continue
+            _, total, total_bytes, _ = ring.header()
+            lengths = ring.lengths()
+            per_client[cid] = {
+                "total_frames": total,
+                "total_bytes": total_bytes,
+                "frames_stored": len(lengths),
+                "avg_frame_size": sum(lengths) / len(lengths) if lengths else 0,
+            }
+            stored += len(lengths)
+            stored_bytes += sum(lengths)
+        return {
+            "frames_stored": stored,
+            "avg_frame_size": stored_bytes / stored if stored else 0,
+            "clients": per_client,
+        }
@@ -1,34 +1,163 @@
+"""
+In-process metrics in the Prometheus text format, served on /metrics.
 
+Counters and histograms are updated in O(1) on the hot path (one small lock
+per metric, fixed histogram buckets); values that already live elsewhere --
+queue depths, active recordings -- are read by collectors at scrape time.
+"""
+import threading
 import time
-from video_stream import received_frames, frame_count
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Dict, Iterable, List, Tuple
 
-connected_clients = 0
-server_start_time = time.time()
+# Seconds; covers a 1/8-scale thumbnail decode up to a multi-second upload
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
 
+Labels = Tuple[Tuple[str, str], ...]
 
-def compute_stats():
-    """
-    Calculate overall server and frame stats.
-    """
-    total_data = sum(f["original_size"] for f in received_frames)
-    avg_frame_size = total_data / len(received_frames) if received_frames else 0
 
-    return {
-        "total_frames": frame_count,
-        "frames_stored": len(received_frames),
-        "total_data_received": total_data,
-        "average_frame_size": avg_frame_size,
-        "server_uptime": time.time() - server_start_time,
-        "connected_clients": connected_clients
-    }
+def _labels(labels: Dict[str, object]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
 
 
-def increment_clients():
-    global connected_clients
-    connected_clients += 1
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
 
 
-def decrement_clients():
-    global connected_clients
-    if connected_clients > 0:
-        connected_clients -= 1
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name, self.help, self.type = name, help, "counter"
+        self._values: Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = _labels(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def remove(self, **labels):
+        """Drop every series carrying these labels (e.g. client=... once the client is forgotten)."""
+        wanted = set(_labels(labels))
+        with self._lock:
+            for key in [k for k in self._values if wanted <= set(k)]:
+                del self._values[key]
+
+    def samples(self) -> List[Tuple[str, Labels, float]]:
+        with self._lock:
+            return [(self.name, k, v) for k, v in self._values.items()]
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: Iterable[float] = DEFAULT_BUCKETS):
+        self.name, self.help, self.type = name, help, "histogram"
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Labels, list] = {}  # labels -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _labels(labels)
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[i] += 1
+            series[-1] += value
+
+    def timed(self, **labels):
+        """Decorator form of time()."""
+        def wrap(fn):
+            @wraps(fn)
+            def inner(*args, **kwargs):
+                with self.time(**labels):
+                    return fn(*args, **kwargs)
+            return inner
+        return wrap
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> List[Tuple[str, Labels, float]]:
+        out = []
+        with self._lock:
+            series = {k: list(v) for k, v in self._series.items()}
+        for key, counts in series.items():
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                out.append((f"{self.name}_bucket", key + (("le", le),), cumulative))
+            out.append((f"{self.name}_count", key, cumulative))
+            out.append((f"{self.name}_sum", key, counts[-1]))
+        return out
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List = []
+        self._collectors: List[Callable] = []
+
+    def counter(self, name: str, help: str) -> Counter:
+        metric = Counter(name, help)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, help, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, fn: Callable):
+        """
+        fn() -> iterable of (name, help, type, [(labels dict, value), ...]),
+        called on every scrape for values owned by other components.
+        """
+        self._collectors.append(fn)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+        for fn in self._collectors:
+            try:
+                families = list(fn())
+            except Exception as e:
+                print(f"[Metrics] Collector {getattr(fn, '__name__', fn)} failed: {e}")
+                continue
+            for name, help, type_, values in families:
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {type_}")
+                for labels, value in values:
+                    lines.append(f"{name}{_format_labels(_labels(labels))} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+FRAMES_RECEIVED = registry.counter("authview_frames_received_total", "Frames uploaded, per client.")
+BYTES_RECEIVED = registry.counter("authview_bytes_received_total", "JPEG bytes uploaded, per client.")
+FRAMES_UNCHANGED = registry.counter("authview_frames_unchanged_total", "Uploads skipped by change detection, per client.")
+# Series labelled client=...; dropped when the client is forgotten (routes._forget_client)
+PER_CLIENT_COUNTERS = (FRAMES_RECEIVED, BYTES_RECEIVED, FRAMES_UNCHANGED)
+UPLOADS = registry.counter("authview_uploads_total", "Upload queue job outcomes (completed / retried / failed).")
+STAGE_SECONDS = registry.histogram(
+    "authview_stage_seconds",
+    "Time spent per pipeline stage (ingest, motion_decode, preview_decode, preview_encode, "
+    "recorder_enqueue, recorder_encode, upload).",
+)
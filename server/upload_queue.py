@@ -0,0 +1,258 @@
+import json
+import os
+import random
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process dev server, no cross-worker claims
+    fcntl = None
+
+from .firebase_service import upload_file, save_record_metadata
+from .stats import STAGE_SECONDS, UPLOADS
+
+# Pending jobs live next to the recordings they refer to, one JSON file each
+UPLOAD_QUEUE_DIR = os.environ.get("UPLOAD_QUEUE_DIR", os.path.join(
+    os.environ.get("RECORDINGS_DIR", os.path.join(os.path.dirname(__file__), "..", "recordings_tmp")), "upload_queue"))
+UPLOAD_WORKERS = int(os.environ.get("UPLOAD_WORKERS", 4))
+UPLOAD_MAX_ATTEMPTS = int(os.environ.get("UPLOAD_MAX_ATTEMPTS", 6))
+UPLOAD_BACKOFF_BASE = float(os.environ.get("UPLOAD_BACKOFF_BASE", 2.0))  # seconds
+UPLOAD_BACKOFF_MAX = 300.0
+
+
+class UploadQueue:
+    """
+    Bounded, retrying upload queue for finished recordings.
+
+    A job is a set of files to put in Cloud Storage plus a metadata document
+    that is written once every file is up. Jobs are persisted under
+    UPLOAD_QUEUE_DIR before anything is attempted, so a restart picks them up
+    again (see recover); local files are only deleted after the metadata is
+    saved. Jobs run on a fixed pool of UPLOAD_WORKERS threads and the files
+    of one job upload in parallel. The directory and the pools are created
+    by the first job, so importing the module costs nothing.
+    """
+
+    def __init__(self, queue_dir: str = UPLOAD_QUEUE_DIR, workers: int = UPLOAD_WORKERS,
+                 max_attempts: int = UPLOAD_MAX_ATTEMPTS):
+        self.queue_dir = queue_dir
+        self.max_attempts = max_attempts
+        self.workers = workers
+        self._job_pool: Optional[ThreadPoolExecutor] = None
+        self._file_pool: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._scheduled = set()
+        self._progress: Dict[str, tuple] = {}  # dest -> (bytes done, total) while uploading
+        self._counters = {"completed": 0, "failed": 0, "retries": 0, "inFlight": 0}
+
+    def _pools(self) -> Tuple[ThreadPoolExecutor, ThreadPoolExecutor]:
+        """(job pool, file pool), started with the first job."""
+        with self._lock:
+            if self._job_pool is None:
+                self._job_pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="upload-job")
+                self._file_pool = ThreadPoolExecutor(max_workers=self.workers * 2, thread_name_prefix="upload-file")
+            return self._job_pool, self._file_pool
+
+    def _job_names(self) -> List[str]:
+        try:
+            return os.listdir(self.queue_dir)
+        except FileNotFoundError:  # nothing was ever queued here
+            return []
+
+    # ------------------------------------------------------------------ #
+    def submit(self, files: List[Dict], metadata: Dict, cleanup: Optional[List[str]] = None,
+               label: str = "", collection: str = "recordings") -> str:
+        """
+        Persist and schedule a job.
+        files: [{"local", "dest", "contentType", "field"}] -- once uploaded,
+        each file's public URL is written into metadata[field].
+        cleanup: extra local paths to delete when the job succeeds.
+        collection: Firestore collection the metadata document goes to.
+        """
+        job_id = uuid.uuid4().hex
+        meta = dict(metadata)
+        if isinstance(meta.get("createdAt"), datetime):
+            meta["createdAt"] = meta["createdAt"].isoformat()
+        job = {
+            "id": job_id,
+            "label": label,
+            "attempts": 0,
+            "files": [dict(f, url=None) for f in files],
+            "metadata": meta,
+            "cleanup": cleanup or [],
+            "collection": collection,
+        }
+        self._save(job)
+        self._schedule(job_id)
+        return job_id
+
+    def recover(self):
+        """Re-schedule every job left on disk by a previous process."""
+        for name in sorted(self._job_names()):
+            if name.endswith(".json"):
+                self._schedule(name[:-len(".json")])
+
+    # ------------------------------------------------------------------ #
+    def _path(self, job_id: str) -> str:
+        return os.path.join(self.queue_dir, f"{job_id}.json")
+
+    def _remove_lock(self, job_id: str):
+        try:
+            os.remove(os.path.join(self.queue_dir, f"{job_id}.lock"))
+        except OSError:
+            pass
+
+    def _save(self, job: Dict):
+        os.makedirs(self.queue_dir, exist_ok=True)
+        tmp = self._path(job["id"]) + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(job, f)
+        os.replace(tmp, self._path(job["id"]))
+
+    def _schedule(self, job_id: str, delay: float = 0.0):
+        with self._lock:
+            if job_id in self._scheduled and delay == 0.0:
+                return
+            self._scheduled.add(job_id)
+        if delay > 0:
+            t = threading.Timer(delay, self._pools()[0].submit, args=(self._run, job_id))
+            t.daemon = True
+            t.start()
+        else:
+            self._pools()[0].submit(self._run, job_id)
+
+    def _unschedule(self, job_id: str):
+        with self._lock:
+            self._scheduled.discard(job_id)
+
+    def _run(self, job_id: str):
+        path = self._path(job_id)
+        if not os.path.exists(path):
+            self._unschedule(job_id)
+            return
+        # Claim the job through a side lock file: the JSON itself is replaced
+        # atomically on every save, which would defeat a lock held on it.
+        fd = os.open(path[:-len(".json")] + ".lock", os.O_RDWR | os.O_CREAT)
+        try:
+            # Another worker process may own this job (gunicorn -w N)
+            if fcntl is not None:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    self._unschedule(job_id)
+                    return
+            if not os.path.exists(path):  # finished by the previous lock holder
+                self._remove_lock(job_id)  # O_CREAT above made it again
+                self._unschedule(job_id)
+                return
+            with open(path) as f:
+                job = json.load(f)
+            with self._lock:
+                self._counters["inFlight"] += 1
+            try:
+                self._attempt(job)
+            finally:
+                with self._lock:
+                    self._counters["inFlight"] -= 1
+        finally:
+            os.close(fd)
+
+    def _attempt(self, job: Dict):
+        label = job["label"] or job["id"]
+        try:
+            # Files not uploaded by an earlier attempt go up in parallel
+            pending = [f for f in job["files"] if not f["url"] and os.path.exists(f["local"])]
+            futures = [
+                (f, self._pools()[1].submit(self._upload_one, f))
+                for f in pending
+            ]
+            error = None
+            for f, fut in futures:
+                try:
+                    f["url"] = fut.result()
+                except Exception as e:
+                    error = error or e
+                finally:
+                    with self._lock:
+                        self._progress.pop(f["dest"], None)
+            if error is not None:
+                raise error
+
+            meta = dict(job["metadata"])
+            if isinstance(meta.get("createdAt"), str):
+                meta["createdAt"] = datetime.fromisoformat(meta["createdAt"])
+            for f in job["files"]:
+                meta[f["field"]] = f["url"]
+            save_record_metadata(meta, collection=job.get("collection", "recordings"))
+        except Exception as e:
+            self._retry(job, e)
+            return
+
+        print(f"[UploadQueue] Upload complete for {label}")
+        for p in [f["local"] for f in job["files"]] + job["cleanup"]:
+            if p and os.path.exists(p):
+                try:
+                    os.remove(p)
+                except OSError:
+                    pass
+        os.remove(self._path(job["id"]))
+        self._remove_lock(job["id"])
+        with self._lock:
+            self._counters["completed"] += 1
+            self._scheduled.discard(job["id"])
+        UPLOADS.inc(result="completed")
+
+    def _upload_one(self, f: Dict) -> str:
+        with STAGE_SECONDS.time(stage="upload"):
+            return upload_file(f["local"], f["dest"], content_type=f["contentType"],
+                               progress=self._progress_callback(f["dest"]))
+
+    def _progress_callback(self, dest: str):
+        def report(done: int, total: int):
+            with self._lock:
+                self._progress[dest] = (done, total)
+        return report
+
+    def _retry(self, job: Dict, error: Exception):
+        job["attempts"] += 1
+        label = job["label"] or job["id"]
+        if job["attempts"] >= self.max_attempts:
+            # Keep the job and its files for inspection / manual re-queue
+            self._save(job)
+            os.replace(self._path(job["id"]), self._path(job["id"]) + ".failed")
+            self._remove_lock(job["id"])
+            print(f"[UploadQueue] Giving up on {label} after {job['attempts']} attempts: {error}")
+            with self._lock:
+                self._counters["failed"] += 1
+                self._scheduled.discard(job["id"])
+            UPLOADS.inc(result="failed")
+            return
+        self._save(job)
+        delay = min(UPLOAD_BACKOFF_MAX, UPLOAD_BACKOFF_BASE * 2 ** (job["attempts"] - 1))
+        delay *= random.uniform(0.8, 1.2)
+        print(f"[UploadQueue] Upload error for {label} (attempt {job['attempts']}), retrying in {delay:.1f}s: {error}")
+        with self._lock:
+            self._counters["retries"] += 1
+        UPLOADS.inc(result="retried")
+        self._schedule(job["id"], delay=delay)
+
+    # ------------------------------------------------------------------ #
+    def stats(self) -> dict:
+        names = self._job_names()
+        with self._lock:
+            counters = dict(self._counters)
+            progress = dict(self._progress)  # upload threads keep reporting meanwhile
+        return dict(
+            counters,
+            pending=sum(n.endswith(".json") for n in names),
+            deadLetter=sum(n.endswith(".failed") for n in names),
+            workers=self.workers,
+            progress={dest: {"bytesUploaded": d, "bytesTotal": t} for dest, (d, t) in progress.items()},
+        )
+
+
+upload_queue = UploadQueue()